@@ -55,12 +55,21 @@ class ModelParams(ParamGroup):
         self._white_background = False
         self.train_test_exp = True
         self.data_device = "cpu"
+        self.device = "cuda"
+        self.image_cache_mb = -1
+        self.load_workers = 8
+        self.dataset_cache = ""
+        self.jpeg_draft = False
+        self.scene_info_cache = False
         self.eval = False
         super().__init__(parser, "Loading Parameters", sentinel)
 
     def extract(self, args):
         g = super().extract(args)
         g.source_path = os.path.abspath(g.source_path)
+        # Configs of models trained before --device existed
+        if getattr(g, "device", None) is None:
+            g.device = "cuda"
         return g
 
 class PipelineParams(ParamGroup):
@@ -69,6 +78,7 @@ class PipelineParams(ParamGroup):
         self.compute_cov3D_python = False
         self.debug = False
         self.antialiasing = False
+        self.rasterizer = "cuda"
         super().__init__(parser, "Pipeline Parameters")
 
 class OptimizationParams(ParamGroup):
@@ -93,6 +103,17 @@ class OptimizationParams(ParamGroup):
         self.densify_from_iter = 500
         self.densify_until_iter = 15_000
         self.densify_grad_threshold = 0.0002
+        self.morton_reorder = False
+        self.prefetch_views = False
+        self.batch_size = 1
+        self.sampler = "epoch"
+        self.sampler_seed = 0
+        self.sampler_temperature = 1.0
+        self.sampler_floor = 0.2
+        self.coarse_to_fine_levels = 1
+        self.coarse_to_fine_until_iter = 5_000
+        self.sync_free = False
+        self.metrics_interval = 50
         self.depth_l1_weight_init = 1.0
         self.depth_l1_weight_final = 0.01
         self.random_background = False
@@ -0,0 +1,103 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+# Frames per second of the forward-only CPU renderer (render.py --cpu) on random
+# Gaussian clouds around an orbiting camera, for every Gaussian count, resolution
+# and thread count. With --compare, the forward pass of the pure PyTorch reference
+# rasterizer is timed on the same frames.
+# Run from the repository root: python -m benchmarks.cpu_renderer
+
+import os
+import math
+import time
+import torch
+from types import SimpleNamespace
+from argparse import ArgumentParser
+from scene.gaussian_model import GaussianModel
+from gaussian_renderer.cpu_renderer import CPURenderer
+from gaussian_renderer.torch_rasterizer import GaussianRasterizationSettings, GaussianRasterizer
+from utils.graphics_utils import getProjectionMatrix
+from utils.general_utils import inverse_sigmoid
+
+def random_model(num_gaussians, sh_degree, generator):
+    gaussians = GaussianModel(sh_degree, device="cpu")
+    gaussians._xyz = torch.randn((num_gaussians, 3), generator=generator)
+    gaussians._features_dc = torch.randn((num_gaussians, 1, 3), generator=generator) * 0.5
+    gaussians._features_rest = torch.randn((num_gaussians, (sh_degree + 1) ** 2 - 1, 3), generator=generator) * 0.1
+    # Sizes shrink with the count so that the depth complexity stays comparable
+    gaussians._scaling = torch.log(torch.rand((num_gaussians, 3), generator=generator) * 0.2 / num_gaussians ** (1 / 3) + 0.002)
+    gaussians._rotation = torch.randn((num_gaussians, 4), generator=generator)
+    gaussians._opacity = inverse_sigmoid(torch.rand((num_gaussians, 1), generator=generator) * 0.9 + 0.05)
+    gaussians.active_sh_degree = sh_degree
+    return gaussians
+
+def orbit_camera(angle, width, height):
+    # Looks at the origin from a distance of 3, half of the cloud is outside the view
+    fovx = math.radians(50)
+    fovy = 2 * math.atan(math.tan(fovx / 2) * height / width)
+    c, s = math.cos(angle), math.sin(angle)
+    R = torch.tensor([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]])
+    world_view_transform = torch.eye(4)
+    world_view_transform[:3, :3] = R.T
+    world_view_transform[3, 2] = 3.0
+    projection_matrix = getProjectionMatrix(0.01, 100.0, fovx, fovy).transpose(0, 1)
+    return SimpleNamespace(image_width=width, image_height=height, FoVx=fovx, FoVy=fovy, image_name="",
+                           world_view_transform=world_view_transform, projection_matrix=projection_matrix,
+                           full_proj_transform=world_view_transform @ projection_matrix,
+                           camera_center=world_view_transform.inverse()[3, :3])
+
+@torch.no_grad()
+def reference_render(camera, gaussians, bg):
+    rasterizer = GaussianRasterizer(GaussianRasterizationSettings(
+        image_height=camera.image_height, image_width=camera.image_width, tanfovx=math.tan(camera.FoVx * 0.5), tanfovy=math.tan(camera.FoVy * 0.5),
+        bg=bg, scale_modifier=1.0, viewmatrix=camera.world_view_transform, projmatrix=camera.full_proj_transform,
+        projmatrix_raw=camera.projection_matrix, sh_degree=gaussians.active_sh_degree, campos=camera.camera_center, prefiltered=False, debug=False))
+    means3D = gaussians.get_xyz
+    return rasterizer(means3D=means3D, means2D=torch.zeros_like(means3D), opacities=gaussians.get_opacity, shs=gaussians.get_features,
+                      scales=gaussians.get_scaling, rotations=gaussians.get_rotation)[0]
+
+def frames_per_second(render_frame, cameras):
+    render_frame(cameras[0])
+    start = time.perf_counter()
+    for camera in cameras:
+        render_frame(camera)
+    return len(cameras) / (time.perf_counter() - start)
+
+def cpu_renderer(counts, resolutions, threads, dtype, frames, sh_degree, compare):
+    generator = torch.Generator().manual_seed(0)
+    bg = torch.zeros(3)
+    print("\nCPU cores        : {}, blending in {}".format(os.cpu_count(), dtype))
+    header = "{:>10} {:>12} {:>8} {:>10}".format("Gaussians", "resolution", "threads", "FPS")
+    print(header + (" {:>15}".format("reference FPS") if compare else ""))
+    for num_gaussians in counts:
+        gaussians = random_model(num_gaussians, sh_degree, generator)
+        for width, height in resolutions:
+            cameras = [orbit_camera(2 * math.pi * idx / frames, width, height) for idx in range(frames)]
+            reference_fps = frames_per_second(lambda camera: reference_render(camera, gaussians, bg), cameras) if compare else None
+            for num_threads in threads:
+                renderer = CPURenderer(gaussians, num_threads, getattr(torch, dtype))
+                fps = frames_per_second(lambda camera: renderer.render(camera, bg), cameras)
+                renderer.pool.shutdown()
+                line = "{:>10} {:>12} {:>8} {:>10.2f}".format(num_gaussians, "{}x{}".format(width, height), renderer.num_threads, fps)
+                print(line + (" {:>15.2f}".format(reference_fps) if compare else ""))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Forward-only CPU renderer benchmark")
+    parser.add_argument("--counts", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[320, 240, 640, 480, 1280, 720], help="width height pairs")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--frames", default=8, type=int)
+    parser.add_argument("--sh_degree", default=3, type=int)
+    parser.add_argument("--compare", action="store_true", help="also time the pure PyTorch reference rasterizer")
+    args = parser.parse_args()
+
+    cpu_renderer(args.counts, list(zip(args.resolutions[0::2], args.resolutions[1::2])), args.threads, args.dtype, args.frames, args.sh_degree, args.compare)
@@ -0,0 +1,128 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+# Trains the same scene once per view sampler (uniform epochs vs loss-aware
+# importance sampling) and reports the PSNR curve on held-out views and the
+# number of iterations each sampler needs to reach the target PSNR. The loop is
+# train.py's photometric optimization and densification, without pose refinement,
+# GUI, logging or saving, so the samplers are the only difference between runs.
+# Run from the repository root:
+# python -m benchmarks.importance_sampling -s <path to dataset> --eval --target_psnr 25
+
+import sys
+import tempfile
+import torch
+from copy import copy
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, OptimizationParams
+from scene import Scene, GaussianModel
+from gaussian_renderer import render
+from utils.loss_utils import l1_loss, ssim
+from utils.image_utils import psnr
+from utils.prefetch_utils import ViewPrefetcher
+from utils.sampler_utils import make_sampler
+
+@torch.no_grad()
+def evaluate(cameras, gaussians, pipe, background, prefetcher):
+    psnr_total = 0.0
+    for camera in cameras:
+        image = torch.clamp(render(camera, gaussians, pipe, background)["render"], 0.0, 1.0)
+        gt_image = torch.clamp(prefetcher.get(camera)["image"], 0.0, 1.0)
+        psnr_total += psnr(image, gt_image).mean().item()
+    return psnr_total / len(cameras)
+
+def train_with_sampler(dataset, opt, pipe, eval_interval, seed):
+    torch.manual_seed(seed)
+    gaussians = GaussianModel(dataset.sh_degree, "default", dataset.device)
+    scene = Scene(dataset, gaussians, shuffle=False)
+    gaussians.training_setup(opt)
+    background = torch.tensor([1, 1, 1] if dataset.white_background else [0, 0, 0], dtype=torch.float32, device=dataset.device)
+
+    train_cameras = scene.getTrainCameras()
+    # Held-out views, or a fixed subset of the training views when the scene has no test split
+    eval_cameras = scene.getTestCameras() or train_cameras[::max(len(train_cameras) // 16, 1)]
+    sampler = make_sampler(opt, len(train_cameras))
+    prefetcher = ViewPrefetcher(dataset.device, enabled=False)
+
+    curve = []
+    for iteration in range(1, opt.iterations + 1):
+        gaussians.update_learning_rate(iteration)
+        if iteration % 1000 == 0:
+            gaussians.oneupSHdegree()
+
+        vind = sampler.draw()
+        viewpoint_cam = train_cameras[vind]
+        view_data = prefetcher.get(viewpoint_cam)
+        render_pkg = render(viewpoint_cam, gaussians, pipe, background)
+        image = render_pkg["render"]
+        if view_data["alpha_mask"] is not None:
+            image = image * view_data["alpha_mask"]
+
+        gt_image = view_data["image"]
+        loss = (1.0 - opt.lambda_dssim) * l1_loss(image, gt_image) + opt.lambda_dssim * (1.0 - ssim(image, gt_image))
+        loss.backward()
+
+        with torch.no_grad():
+            if sampler.needs_losses:
+                sampler.update([vind], [loss.item()])
+
+            if iteration < opt.densify_until_iter:
+                visibility_filter = render_pkg["visibility_filter"]
+                gaussians.max_radii2D[visibility_filter] = torch.max(gaussians.max_radii2D[visibility_filter], render_pkg["radii"][visibility_filter])
+                gaussians.add_densification_stats(render_pkg["viewspace_points"], visibility_filter)
+                if iteration > opt.densify_from_iter and iteration % opt.densification_interval == 0:
+                    size_threshold = 20 if iteration > opt.opacity_reset_interval else None
+                    gaussians.densify_and_prune(opt.densify_grad_threshold, 0.005, scene.cameras_extent, size_threshold, render_pkg["radii"])
+                if iteration % opt.opacity_reset_interval == 0 or (dataset.white_background and iteration == opt.densify_from_iter):
+                    gaussians.reset_opacity()
+
+            gaussians.exposure_optimizer.step()
+            gaussians.exposure_optimizer.zero_grad(set_to_none = True)
+            gaussians.optimizer.step()
+            gaussians.optimizer.zero_grad(set_to_none = True)
+
+            if iteration % eval_interval == 0 or iteration == opt.iterations:
+                curve.append((iteration, evaluate(eval_cameras, gaussians, pipe, background, prefetcher)))
+                print("[{} ITER {}] PSNR {:.2f}".format(opt.sampler, iteration, curve[-1][1]))
+    return curve
+
+def iterations_to_psnr(curve, target_psnr):
+    return next((iteration for iteration, value in curve if value >= target_psnr), None)
+
+def importance_sampling(dataset, opt, pipe, samplers, target_psnr, eval_interval, seed):
+    curves = {}
+    for sampler in samplers:
+        sampler_opt = copy(opt)
+        sampler_opt.sampler = sampler
+        with tempfile.TemporaryDirectory() as model_path:
+            sampler_dataset = copy(dataset)
+            sampler_dataset.model_path = model_path
+            curves[sampler] = train_with_sampler(sampler_dataset, sampler_opt, pipe, eval_interval, seed)
+
+    print("\nScene            : {}".format(dataset.source_path))
+    print("Target PSNR      : {:.2f} dB".format(target_psnr))
+    print("{:<12} {:>20} {:>16}".format("sampler", "iterations to PSNR", "final PSNR (dB)"))
+    for sampler, curve in curves.items():
+        reached = iterations_to_psnr(curve, target_psnr)
+        print("{:<12} {:>20} {:>16.2f}".format(sampler, reached if reached is not None else "not reached", curve[-1][1]))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Importance sampling vs uniform view sampling benchmark")
+    lp = ModelParams(parser)
+    op = OptimizationParams(parser)
+    pp = PipelineParams(parser)
+    parser.add_argument("--samplers", nargs="+", default=["epoch", "importance"])
+    parser.add_argument("--target_psnr", default=25.0, type=float)
+    parser.add_argument("--eval_interval", default=500, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args(sys.argv[1:])
+
+    importance_sampling(lp.extract(args), op.extract(args), pp.extract(args), args.samplers, args.target_psnr, args.eval_interval, args.seed)
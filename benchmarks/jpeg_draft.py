@@ -0,0 +1,84 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+# Compares full JPEG decoding + resize with reduced-size (draft) decoding + resize
+# on a synthetic image set: load time per image and PSNR of the draft result
+# against the full decode, for every loading resolution.
+# Run from the repository root: python -m benchmarks.jpeg_draft
+
+import os
+import time
+import tempfile
+import numpy as np
+import cv2
+import torch
+from PIL import Image
+from argparse import ArgumentParser, Namespace
+from utils.camera_utils import getResolution, draftImage
+from utils.image_utils import psnr
+
+def synthetic_image(width, height, rng):
+    # Smooth content at several frequencies plus a little sensor noise, closer to photographs than white noise
+    image = np.zeros((height, width, 3), dtype=np.float32)
+    for cells, amplitude in ((4, 0.5), (32, 0.3), (256, 0.15)):
+        coarse = rng.random((max(cells * height // width, 1), cells, 3), dtype=np.float32)
+        image += amplitude * cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    image += rng.normal(0, 0.02, image.shape).astype(np.float32)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+def load(path, resolution_arg, draft):
+    image = Image.open(path)
+    resolution = getResolution(Namespace(resolution=resolution_arg), image.size[0], image.size[1], 1.0)
+    if draft:
+        draftImage(image, resolution)
+    return np.array(image.resize(resolution))
+
+def to_tensor(image):
+    return torch.from_numpy(image).permute(2, 0, 1).float() / 255.0
+
+def jpeg_draft(num_images, width, height, quality, resolutions, repeats):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as image_dir:
+        paths = []
+        for idx in range(num_images):
+            path = os.path.join(image_dir, "{:03d}.jpg".format(idx))
+            Image.fromarray(synthetic_image(width, height, rng)).save(path, quality=quality)
+            paths.append(path)
+
+        print("\nImages           : {} x {}x{} JPEG (quality {})".format(num_images, width, height, quality))
+        print("{:<10} {:>12} {:>12} {:>12} {:>10} {:>10}".format("-r", "size", "full (ms)", "draft (ms)", "speedup", "PSNR (dB)"))
+        for resolution_arg in resolutions:
+            timings = {}
+            results = {}
+            for draft in (False, True):
+                results[draft] = [load(path, resolution_arg, draft) for path in paths]
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    for path in paths:
+                        load(path, resolution_arg, draft)
+                timings[draft] = (time.perf_counter() - start) * 1000 / (repeats * len(paths))
+
+            psnr_draft = np.mean([psnr(to_tensor(d), to_tensor(f)).mean().item() for d, f in zip(results[True], results[False])])
+            size = "{}x{}".format(results[False][0].shape[1], results[False][0].shape[0])
+            print("{:<10} {:>12} {:>12.2f} {:>12.2f} {:>9.2f}x {:>10.2f}".format(resolution_arg, size, timings[False], timings[True],
+                                                                            timings[False] / timings[True], psnr_draft))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="JPEG reduced-size decoding benchmark")
+    parser.add_argument("--num_images", default=8, type=int)
+    parser.add_argument("--width", default=4000, type=int)
+    parser.add_argument("--height", default=3000, type=int)
+    parser.add_argument("--quality", default=95, type=int)
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[1, 2, 4, 8, -1])
+    parser.add_argument("--repeats", default=3, type=int)
+    args = parser.parse_args()
+
+    jpeg_draft(args.num_images, args.width, args.height, args.quality, args.resolutions, args.repeats)
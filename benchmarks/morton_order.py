@@ -0,0 +1,93 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+# Compares a trained model in random and in Morton order: render time, training
+# step time (render + loss + backward + Adam step) and zlib-compressed PLY size.
+# Run from the repository root: python -m benchmarks.morton_order -m <model_path>
+
+import zlib
+import torch
+from scene import Scene
+from gaussian_renderer import render, GaussianModel
+from utils.general_utils import safe_state
+from utils.loss_utils import l1_loss
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, OptimizationParams, get_combined_args
+
+def time_ms(fn, views, repeats):
+    start = torch.cuda.Event(enable_timing = True)
+    end = torch.cuda.Event(enable_timing = True)
+    for view in views[:2]:
+        fn(view)
+    torch.cuda.synchronize()
+    start.record()
+    for _ in range(repeats):
+        for view in views:
+            fn(view)
+    end.record()
+    torch.cuda.synchronize()
+    return start.elapsed_time(end) / (repeats * len(views))
+
+def benchmark(gaussians, views, pipeline, background, repeats):
+    def render_only(view):
+        with torch.no_grad():
+            render(view, gaussians, pipeline, background)
+
+    def train_step(view):
+        image = render(view, gaussians, pipeline, background)["render"]
+        loss = l1_loss(image, view.get_gt_image("cuda"))
+        loss.backward()
+        gaussians.optimizer.step()
+        gaussians.optimizer.zero_grad(set_to_none = True)
+
+    render_ms = time_ms(render_only, views, repeats)
+    step_ms = time_ms(train_step, views, repeats)
+    compressed = len(zlib.compress(gaussians.construct_vertex_array().tobytes(), 6))
+    return render_ms, step_ms, compressed
+
+def morton_order(dataset : ModelParams, opt : OptimizationParams, pipeline : PipelineParams, iteration : int, num_views : int, repeats : int):
+    gaussians = GaussianModel(dataset.sh_degree)
+    scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+    gaussians.training_setup(opt)
+    gaussians.max_radii2D = torch.zeros((gaussians.get_xyz.shape[0]), device="cuda")
+
+    bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
+    background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+    views = scene.getTrainCameras()[:num_views]
+
+    # Shuffle first so the baseline does not benefit from any locality already present in the saved model
+    gaussians.reorder_points(torch.randperm(gaussians.get_xyz.shape[0], device="cuda"))
+    random_results = benchmark(gaussians, views, pipeline, background, repeats)
+    gaussians.sort_by_morton()
+    morton_results = benchmark(gaussians, views, pipeline, background, repeats)
+
+    num_points = gaussians.get_xyz.shape[0]
+    print("\nGaussians        : {}".format(num_points))
+    print("{:<17}: {:>12} {:>12}".format("", "random", "morton"))
+    print("{:<17}: {:>12.3f} {:>12.3f}".format("Render (ms)", random_results[0], morton_results[0]))
+    print("{:<17}: {:>12.3f} {:>12.3f}".format("Train step (ms)", random_results[1], morton_results[1]))
+    print("{:<17}: {:>12.2f} {:>12.2f}".format("PLY zlib (MB)", random_results[2] / 2**20, morton_results[2] / 2**20))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Morton reordering benchmark")
+    model = ModelParams(parser, sentinel=True)
+    op = OptimizationParams(parser)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--num_views", default=20, type=int)
+    parser.add_argument("--repeats", default=5, type=int)
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Benchmarking " + args.model_path)
+
+    safe_state(args.quiet)
+
+    morton_order(model.extract(args), op.extract(args), pipeline.extract(args), args.iteration, args.num_views, args.repeats)
@@ -0,0 +1,83 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+# Throughput of the pure PyTorch rasterizer backend (--rasterizer torch) on the
+# CPU: forward and forward + backward time per frame for random Gaussian clouds
+# in front of the camera, for every Gaussian count and resolution.
+# Run from the repository root: python -m benchmarks.torch_rasterizer
+
+import math
+import time
+import torch
+from argparse import ArgumentParser
+from gaussian_renderer.torch_rasterizer import GaussianRasterizationSettings, GaussianRasterizer
+from utils.graphics_utils import getProjectionMatrix
+
+def random_gaussians(num_gaussians, sh_degree, generator):
+    means3D = torch.randn((num_gaussians, 3), generator=generator) * torch.tensor([1.0, 1.0, 0.5]) + torch.tensor([0.0, 0.0, 4.0])
+    # Sizes shrink with the count so that the depth complexity stays comparable
+    scales = torch.rand((num_gaussians, 3), generator=generator) * 0.3 / num_gaussians ** (1 / 3) + 0.005
+    rotations = torch.nn.functional.normalize(torch.randn((num_gaussians, 4), generator=generator), dim=1)
+    opacities = torch.rand((num_gaussians, 1), generator=generator) * 0.9 + 0.05
+    shs = torch.randn((num_gaussians, (sh_degree + 1) ** 2, 3), generator=generator) * 0.2
+    return [means3D, scales, rotations, opacities, shs]
+
+def settings_for(width, height, sh_degree):
+    fovx = math.radians(60)
+    fovy = 2 * math.atan(math.tan(fovx / 2) * height / width)
+    viewmatrix = torch.eye(4)
+    projmatrix_raw = getProjectionMatrix(0.01, 100.0, fovx, fovy).transpose(0, 1)
+    return GaussianRasterizationSettings(image_height=height, image_width=width, tanfovx=math.tan(fovx / 2), tanfovy=math.tan(fovy / 2),
+                                         bg=torch.zeros(3), scale_modifier=1.0, viewmatrix=viewmatrix, projmatrix=viewmatrix @ projmatrix_raw,
+                                         projmatrix_raw=projmatrix_raw, sh_degree=sh_degree, campos=torch.zeros(3), prefiltered=False, debug=False)
+
+def time_frame(rasterizer, gaussians, backward, repeats):
+    means3D, scales, rotations, opacities, shs = [t.detach().requires_grad_(backward) for t in gaussians]
+    theta = torch.zeros(3, requires_grad=backward)
+    rho = torch.zeros(3, requires_grad=backward)
+    elapsed = []
+    for _ in range(repeats + 1):
+        start = time.perf_counter()
+        means2D = torch.zeros_like(means3D, requires_grad=backward)
+        image, radii, invdepth, opacity, n_touched = rasterizer(means3D=means3D, means2D=means2D, opacities=opacities, shs=shs,
+                                                                scales=scales, rotations=rotations, theta=theta, rho=rho)
+        if backward:
+            (image.sum() + invdepth.sum()).backward()
+        elapsed.append(time.perf_counter() - start)
+    # The first frame warms up the allocator
+    return sum(elapsed[1:]) / repeats, int((radii > 0).sum())
+
+def torch_rasterizer(counts, resolutions, sh_degree, repeats, threads):
+    if threads > 0:
+        torch.set_num_threads(threads)
+    generator = torch.Generator().manual_seed(0)
+    print("\nTorch threads    : {}".format(torch.get_num_threads()))
+    print("{:>10} {:>12} {:>10} {:>14} {:>12} {:>20} {:>12}".format("Gaussians", "resolution", "visible", "forward (ms)", "forward FPS", "forward+backward (ms)", "train FPS"))
+    for num_gaussians in counts:
+        gaussians = random_gaussians(num_gaussians, sh_degree, generator)
+        for width, height in resolutions:
+            rasterizer = GaussianRasterizer(settings_for(width, height, sh_degree))
+            with torch.no_grad():
+                forward, visible = time_frame(rasterizer, gaussians, False, repeats)
+            train, _ = time_frame(rasterizer, gaussians, True, repeats)
+            print("{:>10} {:>12} {:>10} {:>14.1f} {:>12.2f} {:>20.1f} {:>12.2f}".format(num_gaussians, "{}x{}".format(width, height), visible,
+                                                                                      forward * 1000, 1 / forward, train * 1000, 1 / train))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Pure PyTorch rasterizer CPU throughput benchmark")
+    parser.add_argument("--counts", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[128, 128, 256, 256, 512, 512], help="width height pairs")
+    parser.add_argument("--sh_degree", default=3, type=int)
+    parser.add_argument("--repeats", default=3, type=int)
+    parser.add_argument("--threads", default=0, type=int, help="torch threads, 0 for the default")
+    args = parser.parse_args()
+
+    torch_rasterizer(args.counts, list(zip(args.resolutions[0::2], args.resolutions[1::2])), args.sh_degree, args.repeats, args.threads)
@@ -0,0 +1,81 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import torch
+from scene import Scene
+from tqdm import tqdm
+from gaussian_renderer import render
+from utils.general_utils import safe_state
+from utils.image_utils import psnr
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, get_combined_args
+from gaussian_renderer import GaussianModel
+
+def evaluate_psnr(views, gaussians, pipeline, background, train_test_exp):
+    psnr_total = 0.0
+    for view in tqdm(views, desc="Evaluation progress"):
+        rendering = render(view, gaussians, pipeline, background, use_trained_exp=train_test_exp)["render"]
+        gt = view.get_gt_image(gaussians.device)[0:3, :, :]
+        if train_test_exp:
+            rendering = rendering[..., rendering.shape[-1] // 2:]
+            gt = gt[..., gt.shape[-1] // 2:]
+        psnr_total += psnr(rendering, gt).mean().double()
+    return psnr_total / max(len(views), 1)
+
+def compress(dataset : ModelParams, iteration : int, pipeline : PipelineParams, xyz_dtype : str, attribute_bits : int, sh_codebook_size : int, kmeans_iters : int):
+    with torch.no_grad():
+        gaussians = GaussianModel(dataset.sh_degree, device=dataset.device)
+        scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+
+        point_cloud_path = os.path.join(dataset.model_path, "point_cloud", "iteration_{}".format(scene.loaded_iter))
+        ply_path = os.path.join(point_cloud_path, "point_cloud.ply")
+        compact_path = os.path.join(point_cloud_path, "point_cloud.compact")
+        gaussians.save_compact(compact_path, xyz_dtype, attribute_bits, sh_codebook_size, kmeans_iters)
+
+        compact_gaussians = GaussianModel(dataset.sh_degree, device=dataset.device)
+        compact_gaussians.load_compact(compact_path, dataset.train_test_exp)
+
+        bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
+        background = torch.tensor(bg_color, dtype=torch.float32, device=dataset.device)
+
+        views = scene.getTestCameras() if len(scene.getTestCameras()) > 0 else scene.getTrainCameras()
+        psnr_float = evaluate_psnr(views, gaussians, pipeline, background, dataset.train_test_exp)
+        psnr_compact = evaluate_psnr(views, compact_gaussians, pipeline, background, dataset.train_test_exp)
+
+        num_points = gaussians.get_xyz.shape[0]
+        ply_size = os.path.getsize(ply_path) if os.path.exists(ply_path) else 0
+        compact_size = os.path.getsize(compact_path)
+        print("\nGaussians      : {}".format(num_points))
+        print("PLY size       : {:.2f} MB ({:.1f} bytes/Gaussian)".format(ply_size / 2**20, ply_size / max(num_points, 1)))
+        print("Compact size   : {:.2f} MB ({:.1f} bytes/Gaussian)".format(compact_size / 2**20, compact_size / max(num_points, 1)))
+        print("PSNR float     : {:>12.7f}".format(psnr_float))
+        print("PSNR compact   : {:>12.7f}".format(psnr_compact))
+        print("PSNR delta     : {:>12.7f}".format(psnr_compact - psnr_float))
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Compact model conversion parameters")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--xyz_dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--attribute_bits", default=16, type=int, choices=[8, 16])
+    parser.add_argument("--sh_codebook_size", default=4096, type=int)
+    parser.add_argument("--kmeans_iters", default=10, type=int)
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Compressing " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    compress(model.extract(args), args.iteration, pipeline.extract(args), args.xyz_dtype, args.attribute_bits, args.sh_codebook_size, args.kmeans_iters)
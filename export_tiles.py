@@ -0,0 +1,42 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import torch
+from scene import Scene
+from scene.tiled_export import export_tiles
+from utils.general_utils import safe_state
+from argparse import ArgumentParser
+from arguments import ModelParams, get_combined_args
+from gaussian_renderer import GaussianModel
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Tiled level-of-detail export parameters")
+    model = ModelParams(parser, sentinel=True)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--grid_size", default=8, type=int)
+    parser.add_argument("--num_levels", default=4, type=int)
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Exporting tiles for " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    dataset = model.extract(args)
+    with torch.no_grad():
+        gaussians = GaussianModel(dataset.sh_degree, device=dataset.device)
+        scene = Scene(dataset, gaussians, load_iteration=args.iteration, shuffle=False)
+        tiles_path = os.path.join(dataset.model_path, "point_cloud", "iteration_{}".format(scene.loaded_iter), "tiles")
+        index = export_tiles(gaussians, tiles_path, args.grid_size, args.num_levels)
+
+    print("Wrote {} tiles with {} levels to {}".format(len(index["tiles"]), index["num_levels"], tiles_path))
@@ -11,19 +11,81 @@
 
 import torch
 import math
-from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
 from scene.gaussian_model import GaussianModel
 from utils.sh_utils import eval_sh
+from gaussian_renderer import torch_rasterizer
+
+try:
+    import diff_gaussian_rasterization
+    CUDA_RASTERIZER_AVAILABLE = True
+except ImportError:
+    CUDA_RASTERIZER_AVAILABLE = False
+
+def rasterizer_backend(pipe):
+    """ (GaussianRasterizationSettings, GaussianRasterizer) of the backend selected by pipe.rasterizer """
+    if pipe.rasterizer == "torch":
+        return torch_rasterizer.GaussianRasterizationSettings, torch_rasterizer.GaussianRasterizer
+    if pipe.rasterizer != "cuda":
+        raise ValueError("Unknown rasterizer '{}', expected 'cuda' or 'torch'".format(pipe.rasterizer))
+    if not CUDA_RASTERIZER_AVAILABLE:
+        raise ImportError("diff_gaussian_rasterization is not installed, install it or use --rasterizer torch")
+    return diff_gaussian_rasterization.GaussianRasterizationSettings, diff_gaussian_rasterization.GaussianRasterizer
 
 def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, separate_sh = False, override_color = None, use_trained_exp=False):
     """
     Render the scene. 
     
-    Background tensor (bg_color) must be on GPU!
+    Background tensor (bg_color) must be on the device of the Gaussians!
+    """
+    return render_batch([viewpoint_camera], pc, pipe, bg_color, scaling_modifier, separate_sh, override_color, use_trained_exp)[0]
+
+def render_batch(viewpoint_cameras, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, separate_sh = False, override_color = None, use_trained_exp=False):
     """
- 
+    Render the scene from several cameras, returning one output dict per camera.
+    The activated Gaussian attributes are computed once and shared by all views,
+    so their backward pass also runs once for the whole batch.
+
+    Background tensor (bg_color) must be on the device of the Gaussians!
+    """
+
+    means3D = pc.get_xyz
+    opacity = pc.get_opacity
+
+    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
+    # scaling / rotation by the rasterizer.
+    scales = None
+    rotations = None
+    cov3D_precomp = None
+
+    if pipe.compute_cov3D_python:
+        cov3D_precomp = pc.get_covariance(scaling_modifier)
+    else:
+        scales = pc.get_scaling
+        rotations = pc.get_rotation
+
+    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
+    # from SHs in Python, do it per view. If not, then SH -> RGB conversion will be done by rasterizer.
+    dc = None
+    shs = None
+    colors_precomp = None
+    if override_color is None:
+        if pipe.convert_SHs_python:
+            shs = pc.get_features
+        elif separate_sh:
+            dc, shs = pc.get_features_dc, pc.get_features_rest
+        else:
+            shs = pc.get_features
+    else:
+        colors_precomp = override_color
+
+    return [_render_view(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, separate_sh, use_trained_exp,
+                         means3D, opacity, scales, rotations, cov3D_precomp, dc, shs, colors_precomp)
+            for viewpoint_camera in viewpoint_cameras]
+
+def _render_view(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, separate_sh, use_trained_exp,
+                 means3D, opacity, scales, rotations, cov3D_precomp, dc, shs, colors_precomp):
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(means3D, dtype=means3D.dtype, requires_grad=True) + 0
     try:
         screenspace_points.retain_grad()
     except:
@@ -33,6 +95,12 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
     tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
 
+    # Cameras cache these on the device, read them once for the whole call
+    world_view_transform = viewpoint_camera.world_view_transform
+    full_proj_transform = viewpoint_camera.full_proj_transform
+    camera_center = viewpoint_camera.camera_center
+
+    GaussianRasterizationSettings, GaussianRasterizer = rasterizer_backend(pipe)
     raster_settings = GaussianRasterizationSettings(
         image_height=int(viewpoint_camera.image_height),
         image_width=int(viewpoint_camera.image_width),
@@ -40,11 +108,11 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         tanfovy=tanfovy,
         bg=bg_color,
         scale_modifier=scaling_modifier,
-        viewmatrix=viewpoint_camera.world_view_transform,
-        projmatrix=viewpoint_camera.full_proj_transform,
+        viewmatrix=world_view_transform,
+        projmatrix=full_proj_transform,
         projmatrix_raw=viewpoint_camera.projection_matrix,
         sh_degree=pc.active_sh_degree,
-        campos=viewpoint_camera.camera_center,
+        campos=camera_center,
         prefiltered=False,
         debug=pipe.debug,
         # antialiasing=pipe.antialiasing
@@ -52,40 +120,15 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
 
     rasterizer = GaussianRasterizer(raster_settings=raster_settings)
 
-    means3D = pc.get_xyz
     means2D = screenspace_points
-    opacity = pc.get_opacity
 
-    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-    # scaling / rotation by the rasterizer.
-    scales = None
-    rotations = None
-    cov3D_precomp = None
-
-    if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
-    else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
-
-    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
-    # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
-    shs = None
-    colors_precomp = None
-    if override_color is None:
-        if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
-            dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
-            sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
-            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
-        else:
-            if separate_sh:
-                dc, shs = pc.get_features_dc, pc.get_features_rest
-            else:
-                shs = pc.get_features
-    else:
-        colors_precomp = override_color
+    if pipe.convert_SHs_python and colors_precomp is None:
+        shs_view = shs.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
+        dir_pp = (means3D - camera_center.repeat(shs.shape[0], 1))
+        dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
+        sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
+        colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
+        shs = None
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     if separate_sh:
@@ -125,7 +168,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     out = {
         "render": rendered_image,
         "viewspace_points": screenspace_points,
-        "visibility_filter" : (radii > 0).nonzero(),
+        "visibility_filter" : radii > 0,
         "radii": radii,
         "depth" : depth_image,
         "opacity": opacity,
@@ -0,0 +1,181 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import math
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from gaussian_renderer.torch_rasterizer import GaussianRasterizationSettings, BLOCK_X, BLOCK_Y, preprocess, bin_gaussians
+from utils.general_utils import build_scaling_rotation
+from utils.sh_utils import eval_sh
+
+# Gaussians blended per tile in one step; saturated tiles stop between steps
+GAUSSIANS_PER_STEP = 32
+# Screen-space radii include a low-pass dilation of about two pixels, kept around the culling frustum
+CULLING_MARGIN_PIXELS = 3
+
+# Gaussian exponents are quadratic in the pixel position inside a tile: with (u, v) the
+# pixel offset from the tile corner, every exponent of a step is one product of these
+# (u, v) monomials with per Gaussian and tile coefficients, see _exponent_coefficients
+_local_u = (torch.arange(BLOCK_X * BLOCK_Y) % BLOCK_X).float()
+_local_v = (torch.arange(BLOCK_X * BLOCK_Y) // BLOCK_X).float()
+PIXEL_MONOMIALS = torch.stack([torch.ones_like(_local_u), _local_u, _local_v, _local_u * _local_u, _local_v * _local_v, _local_u * _local_v], dim=-1)
+
+def _exponent_coefficients(xy, conics, log_opacities, origins, valid):
+    """
+    Coefficients of PIXEL_MONOMIALS giving power + log(opacity) of CUDA's renderer
+    for Gaussians at offset (a, b) = xy - origins from their tile corner, (..., 6).
+    Invalid entries get an exponent far below the 1/255 alpha threshold.
+    """
+    a = xy[..., 0] - origins[..., 0]
+    b = xy[..., 1] - origins[..., 1]
+    con_a, con_b, con_c = conics.unbind(dim=-1)
+    constant = -0.5 * (con_a * a * a + con_c * b * b) - con_b * a * b + log_opacities
+    coefficients = torch.stack([torch.where(valid, constant, torch.full_like(constant, -1e10)),
+                                con_a * a + con_b * b, con_c * b + con_b * a,
+                                -0.5 * con_a, -0.5 * con_c, -con_b], dim=-2)
+    return coefficients
+
+def composite_tiles_forward(tiles, tiles_x, xy, conics, log_opacities, colors, gaussian_ids, tile_starts, tile_counts, bg, dtype):
+    """
+    (tiles, pixels, 3) colors of a group of tiles, blended front to back like the
+    CUDA rasterizer. Gaussian exponents are evaluated in float32, alphas and
+    transmittances, which stay in [0, 1], are blended in dtype.
+    """
+    pixels = BLOCK_X * BLOCK_Y
+    origins = torch.stack([(tiles % tiles_x) * BLOCK_X, (tiles // tiles_x) * BLOCK_Y], dim=-1).float()
+    starts, counts = tile_starts[tiles], tile_counts[tiles]
+
+    T = torch.ones((tiles.shape[0], pixels), dtype=dtype)
+    color = torch.zeros((tiles.shape[0], pixels, colors.shape[1]))
+    done = torch.zeros((tiles.shape[0], pixels), dtype=torch.bool)
+    active = (counts > 0).nonzero()[:, 0]
+    slots = torch.arange(GAUSSIANS_PER_STEP)
+    offset = 0
+    while active.shape[0] > 0:
+        in_range = (offset + slots)[None] < counts[active, None]
+        entries = torch.where(in_range, starts[active, None] + offset + slots, torch.zeros_like(slots))
+        ids = gaussian_ids[entries]
+
+        coefficients = _exponent_coefficients(xy[ids], conics[ids], log_opacities[ids], origins[active, None], in_range)
+        # Exponents below -10 give alphas far under 1/255; clamping them avoids slow denormal exp results
+        alpha = torch.clamp_max(torch.exp(torch.clamp_min(torch.matmul(PIXEL_MONOMIALS, coefficients), -10.0)), 0.99)
+        alpha.masked_fill_((alpha < 1.0 / 255.0) | done[active][..., None], 0)
+        alpha = alpha.to(dtype)
+
+        # A pixel stops before the Gaussian that would bring its transmittance below 1e-4
+        T_active = T[active]
+        transmittance = torch.cumprod(torch.cat([T_active[..., None], 1 - alpha], dim=-1), dim=-1)
+        saturated = transmittance[..., 1:] < 0.0001
+        if saturated.any():
+            alpha.masked_fill_(saturated, 0)
+            transmittance = torch.cumprod(torch.cat([T_active[..., None], 1 - alpha], dim=-1), dim=-1)
+            done[active] |= saturated.any(dim=-1)
+
+        color[active] += torch.bmm((alpha * transmittance[..., :-1]).float(), colors[ids])
+        T[active] = transmittance[..., -1]
+
+        offset += GAUSSIANS_PER_STEP
+        active = active[(counts[active] > offset) & ~done[active].all(dim=1)]
+
+    return color + T[..., None].float() * bg
+
+class CPURenderer:
+    """
+    Forward-only renderer of a trained GaussianModel on the CPU, for batch rendering
+    on machines without a GPU (load the model with device="cpu"). The activated
+    Gaussian attributes are computed, and copied to the CPU if needed, once. Every frame culls the Gaussians against the view frustum before
+    projecting them, bins them into tiles (see torch_rasterizer) and composites
+    groups of tiles in parallel on a thread pool into a uint8 frame.
+    """
+    def __init__(self, gaussians, num_threads=0, dtype=torch.float32, tiles_per_task=16):
+        self.gaussians = gaussians
+        self.num_threads = num_threads if num_threads > 0 else os.cpu_count()
+        self.dtype = dtype
+        self.tiles_per_task = tiles_per_task
+        self.pool = ThreadPoolExecutor(self.num_threads)
+        with torch.no_grad():
+            self.means3D = gaussians.get_xyz.detach().float().cpu().contiguous()
+            self.opacities = gaussians.get_opacity.detach().float().cpu()[:, 0].contiguous()
+            self.scales = gaussians.get_scaling.detach().float().cpu().contiguous()
+            self.rotations = gaussians.get_rotation.detach().float().cpu().contiguous()
+            self.shs = gaussians.get_features.detach().float().cpu().contiguous()
+            # Radius of the 3 sigma bounding sphere of every Gaussian, at scaling modifier 1
+            self.extents = 3.0 * self.scales.max(dim=1).values
+        self.sh_degree = gaussians.active_sh_degree
+
+    def cull(self, viewmatrix, tanfovx, tanfovy, width, height, scaling_modifier):
+        """ Indices of the Gaussians in front of the near plane whose bounding sphere reaches the view frustum """
+        p_view = self.means3D @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+        x, y, z = p_view.unbind(dim=1)
+        extents = self.extents * scaling_modifier
+        keep = z > 0.2
+        for coordinate, tanfov, size in ((x, tanfovx, width), (y, tanfovy, height)):
+            slope = tanfov * (1.0 + 2.0 * CULLING_MARGIN_PIXELS / size)
+            # Signed distance to the side planes of the frustum, |c| = slope * z
+            keep &= (coordinate.abs() - slope * z) < extents * math.sqrt(1.0 + slope * slope)
+        return keep.nonzero()[:, 0]
+
+    @torch.no_grad()
+    def render(self, viewpoint_camera, bg_color, scaling_modifier=1.0, use_trained_exp=False):
+        """ Same output as gaussian_renderer.render(...)["render"], 8 bit quantized, under "render" """
+        width, height = int(viewpoint_camera.image_width), int(viewpoint_camera.image_height)
+        tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
+        tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
+        viewmatrix = viewpoint_camera.world_view_transform.float().cpu()
+        campos = viewpoint_camera.camera_center.float().cpu()
+        bg = bg_color.float().cpu()
+        settings = GaussianRasterizationSettings(image_height=height, image_width=width, tanfovx=tanfovx, tanfovy=tanfovy, bg=bg,
+                                                 scale_modifier=scaling_modifier, viewmatrix=viewmatrix,
+                                                 projmatrix=viewpoint_camera.full_proj_transform.float().cpu(),
+                                                 projmatrix_raw=viewpoint_camera.projection_matrix.float().cpu(),
+                                                 sh_degree=self.sh_degree, campos=campos, prefiltered=False, debug=False)
+
+        # Culled Gaussians are neither projected nor shaded
+        ids = self.cull(viewmatrix, tanfovx, tanfovy, width, height, scaling_modifier)
+        means3D = self.means3D[ids]
+        L = build_scaling_rotation(scaling_modifier * self.scales[ids], self.rotations[ids])
+        dirs = means3D - campos
+        dirs = dirs / dirs.norm(dim=1, keepdim=True)
+        colors = torch.clamp_min(eval_sh(self.sh_degree, self.shs[ids].transpose(1, 2), dirs) + 0.5, 0.0)
+
+        xy, depths, conics, radii, rect = preprocess(settings, means3D, torch.zeros_like(means3D), L @ L.transpose(1, 2),
+                                                     viewmatrix, settings.projmatrix)
+        gaussian_ids, tile_starts, tile_counts = bin_gaussians(settings, depths, radii, rect)
+        log_opacities = torch.log(self.opacities[ids])
+
+        exposure = None
+        if use_trained_exp:
+            exposure = self.gaussians.get_exposure_from_name(viewpoint_camera.image_name).detach().float().cpu()
+
+        tiles_x = (width + BLOCK_X - 1) // BLOCK_X
+        tiles_y = (height + BLOCK_Y - 1) // BLOCK_Y
+        frame = torch.empty((tiles_y, BLOCK_Y, tiles_x, BLOCK_X, 3), dtype=torch.uint8)
+
+        def composite(tiles):
+            color = composite_tiles_forward(tiles, tiles_x, xy, conics, log_opacities, colors, gaussian_ids, tile_starts, tile_counts, bg, self.dtype)
+            if exposure is not None:
+                color = color @ exposure[:3, :3] + exposure[:3, 3]
+            # Quantized as torchvision.utils.save_image does
+            color = (color.clamp(0, 1) * 255 + 0.5).clamp(0, 255).to(torch.uint8)
+            frame[tiles // tiles_x, :, tiles % tiles_x] = color.view(-1, BLOCK_Y, BLOCK_X, 3)
+
+        # Parallelism comes from the tile groups, every worker runs single-threaded torch ops
+        num_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        try:
+            tiles = torch.arange(tiles_x * tiles_y)
+            list(self.pool.map(composite, tiles.split(self.tiles_per_task)))
+        finally:
+            torch.set_num_threads(num_threads)
+
+        image = frame.view(tiles_y * BLOCK_Y, tiles_x * BLOCK_X, 3)[:height, :width]
+        return {"render": image.permute(2, 0, 1).float() / 255.0, "visible": int((radii > 0).sum())}
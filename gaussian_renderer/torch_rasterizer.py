@@ -0,0 +1,270 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import torch
+from torch import nn
+from typing import NamedTuple
+from scene.cameras import SE3_exp
+from utils.general_utils import build_scaling_rotation
+from utils.sh_utils import eval_sh
+
+# Reference implementation of the diff_gaussian_rasterization forward pass in
+# plain PyTorch, differentiated by autograd. It follows the CUDA kernels step by
+# step (EWA projection, 16x16 tile binning, per-tile depth sorting and front to
+# back alpha compositing with early termination) with the same thresholds, so
+# it runs on any device and serves as a readable reference for the extension.
+
+BLOCK_X = 16
+BLOCK_Y = 16
+# Gaussians composited per tile in one step; tiles whose pixels are all saturated are dropped between steps
+GAUSSIANS_PER_STEP = 32
+# Bound on the (tiles, pixels, Gaussians) intermediates of one step
+MAX_STEP_ELEMENTS = 1 << 22
+
+class GaussianRasterizationSettings(NamedTuple):
+    image_height: int
+    image_width: int
+    tanfovx : float
+    tanfovy : float
+    bg : torch.Tensor
+    scale_modifier : float
+    viewmatrix : torch.Tensor
+    projmatrix : torch.Tensor
+    projmatrix_raw : torch.Tensor
+    sh_degree : int
+    campos : torch.Tensor
+    prefiltered : bool
+    debug : bool
+    antialiasing : bool = False
+
+def _unstrip_symmetric(cov):
+    return torch.stack([cov[:, 0], cov[:, 1], cov[:, 2],
+                        cov[:, 1], cov[:, 3], cov[:, 4],
+                        cov[:, 2], cov[:, 4], cov[:, 5]], dim=-1).view(-1, 3, 3)
+
+def _view_transforms(settings, theta, rho):
+    viewmatrix = settings.viewmatrix
+    if theta is None or rho is None:
+        return viewmatrix, settings.projmatrix
+    # The pose deltas act on the world-to-view transform as in CameraPoseStore.update_poses.
+    # They are zero when rendering, but differentiating through them yields the pose gradients.
+    delta = SE3_exp(torch.cat([rho, theta]).to(viewmatrix.dtype))
+    viewmatrix = (delta @ viewmatrix.transpose(0, 1)).transpose(0, 1)
+    return viewmatrix, viewmatrix @ settings.projmatrix_raw
+
+def preprocess(settings, means3D, means2D, cov3D, viewmatrix, projmatrix):
+    """
+    Project the Gaussians: pixel positions, view depths, 2D conics, integer radii
+    (0 for culled Gaussians) and covered tile rectangles, as preprocessCUDA.
+    """
+    height, width = settings.image_height, settings.image_width
+    tiles_x = (width + BLOCK_X - 1) // BLOCK_X
+    tiles_y = (height + BLOCK_Y - 1) // BLOCK_Y
+
+    p_hom = torch.cat([means3D, torch.ones_like(means3D[:, :1])], dim=1)
+    p_view = p_hom @ viewmatrix
+    p_proj = p_hom @ projmatrix
+    p_proj = p_proj[:, :3] / (p_proj[:, 3:4] + 0.0000001)
+    depths = p_view[:, 2]
+    in_frustum = depths > 0.2
+
+    # EWA splatting: Jacobian of the perspective projection, evaluated with the same 1.3 x FoV clamping
+    focal_x = width / (2.0 * settings.tanfovx)
+    focal_y = height / (2.0 * settings.tanfovy)
+    safe_depths = torch.where(in_frustum, depths, torch.ones_like(depths))
+    tx = (p_view[:, 0] / safe_depths).clamp(-1.3 * settings.tanfovx, 1.3 * settings.tanfovx) * safe_depths
+    ty = (p_view[:, 1] / safe_depths).clamp(-1.3 * settings.tanfovy, 1.3 * settings.tanfovy) * safe_depths
+    zero = torch.zeros_like(safe_depths)
+    J = torch.stack([
+        torch.stack([focal_x / safe_depths, zero, -(focal_x * tx) / (safe_depths * safe_depths)], dim=-1),
+        torch.stack([zero, focal_y / safe_depths, -(focal_y * ty) / (safe_depths * safe_depths)], dim=-1),
+    ], dim=-2)
+    T = J @ viewmatrix[:3, :3].transpose(0, 1)
+    cov2D = T @ cov3D @ T.transpose(1, 2)
+    # Low-pass filter, every Gaussian covers at least about one pixel
+    a = cov2D[:, 0, 0] + 0.3
+    b = cov2D[:, 0, 1]
+    c = cov2D[:, 1, 1] + 0.3
+
+    det = a * c - b * b
+    visible = in_frustum & (det != 0)
+    safe_det = torch.where(visible, det, torch.ones_like(det))
+    conics = torch.stack([c / safe_det, -b / safe_det, a / safe_det], dim=-1)
+
+    # The gradient of means2D is the gradient of the NDC position, as in the CUDA backward pass
+    p_ndc = p_proj[:, :2] + means2D[:, :2]
+    xy = torch.stack([((p_ndc[:, 0] + 1.0) * width - 1.0) * 0.5, ((p_ndc[:, 1] + 1.0) * height - 1.0) * 0.5], dim=-1)
+
+    with torch.no_grad():
+        mid = 0.5 * (a + c)
+        lambda1 = mid + torch.sqrt(torch.clamp_min(mid * mid - det, 0.1))
+        radii = torch.ceil(3.0 * torch.sqrt(lambda1))
+        # Covered tiles, [min, max) per axis; the int casts of getRect truncate towards zero
+        rect_min_x = torch.trunc((xy[:, 0] - radii) / BLOCK_X).clamp(0, tiles_x).long()
+        rect_min_y = torch.trunc((xy[:, 1] - radii) / BLOCK_Y).clamp(0, tiles_y).long()
+        rect_max_x = torch.trunc((xy[:, 0] + radii + BLOCK_X - 1) / BLOCK_X).clamp(0, tiles_x).long()
+        rect_max_y = torch.trunc((xy[:, 1] + radii + BLOCK_Y - 1) / BLOCK_Y).clamp(0, tiles_y).long()
+        visible = visible & ((rect_max_x - rect_min_x) * (rect_max_y - rect_min_y) > 0)
+        radii = torch.where(visible, radii, torch.zeros_like(radii)).int()
+        rect = torch.stack([rect_min_x, rect_min_y, rect_max_x, rect_max_y], dim=-1)
+
+    return xy, depths, conics, radii, rect
+
+def bin_gaussians(settings, depths, radii, rect):
+    """
+    Duplicate every visible Gaussian once per covered tile and sort the copies by
+    tile, then depth. Returns the sorted Gaussian indices and the start and count
+    of every tile's range in them.
+    """
+    tiles_x = (settings.image_width + BLOCK_X - 1) // BLOCK_X
+    tiles_y = (settings.image_height + BLOCK_Y - 1) // BLOCK_Y
+    with torch.no_grad():
+        ids = (radii > 0).nonzero()[:, 0]
+        rect = rect[ids]
+        rect_width = rect[:, 2] - rect[:, 0]
+        counts = rect_width * (rect[:, 3] - rect[:, 1])
+
+        gaussian_ids = ids.repeat_interleave(counts)
+        first = torch.cumsum(counts, 0) - counts
+        local = torch.arange(gaussian_ids.shape[0], device=ids.device) - first.repeat_interleave(counts)
+        rect_width = rect_width.repeat_interleave(counts)
+        tile_x = rect[:, 0].repeat_interleave(counts) + local % rect_width
+        tile_y = rect[:, 1].repeat_interleave(counts) + local // rect_width
+        tile_ids = tile_y * tiles_x + tile_x
+
+        # Two stable sorts give the order of the CUDA (tile | depth) keys
+        _, order = torch.sort(depths.detach()[gaussian_ids], stable=True)
+        tile_ids, gaussian_ids = tile_ids[order], gaussian_ids[order]
+        tile_ids, order = torch.sort(tile_ids, stable=True)
+        gaussian_ids = gaussian_ids[order]
+
+        tile_counts = torch.bincount(tile_ids, minlength=tiles_x * tiles_y)
+        tile_starts = torch.cumsum(tile_counts, 0) - tile_counts
+    return gaussian_ids, tile_starts, tile_counts
+
+def composite_tiles(settings, xy, depths, conics, opacities, colors, gaussian_ids, tile_starts, tile_counts):
+    """
+    Front to back alpha compositing of every tile, as renderCUDA: Gaussians with
+    alpha below 1/255 are skipped and a pixel stops once its transmittance would
+    fall below 1e-4. Returns the color, inverse depth and accumulated opacity images
+    and the number of pixels every Gaussian contributed to.
+    """
+    height, width = settings.image_height, settings.image_width
+    tiles_x = (width + BLOCK_X - 1) // BLOCK_X
+    tiles_y = (height + BLOCK_Y - 1) // BLOCK_Y
+    num_tiles = tiles_x * tiles_y
+    pixels = BLOCK_X * BLOCK_Y
+    device = xy.device
+
+    # Everything the pixels blend, gathered per tile entry below: color, inverse depth
+    features = torch.cat([colors, 1.0 / torch.where(depths > 0.2, depths, torch.ones_like(depths))[:, None]], dim=1)
+    pixel_offsets = torch.arange(pixels, device=device)
+    n_touched = torch.zeros(xy.shape[0], dtype=torch.int32, device=device)
+
+    tiles_per_batch = max(MAX_STEP_ELEMENTS // (pixels * GAUSSIANS_PER_STEP), 1)
+    outputs = []
+    for first_tile in range(0, num_tiles, tiles_per_batch):
+        tiles = torch.arange(first_tile, min(first_tile + tiles_per_batch, num_tiles), device=device)
+        pix_x = (tiles % tiles_x)[:, None] * BLOCK_X + pixel_offsets % BLOCK_X
+        pix_y = (tiles // tiles_x)[:, None] * BLOCK_Y + pixel_offsets // BLOCK_X
+        inside = (pix_x < width) & (pix_y < height)
+        pix = torch.stack([pix_x, pix_y], dim=-1).to(xy.dtype)
+        starts, counts = tile_starts[tiles], tile_counts[tiles]
+
+        T = torch.ones((tiles.shape[0], pixels), dtype=xy.dtype, device=device)
+        blended = torch.zeros((tiles.shape[0], pixels, features.shape[1]), dtype=xy.dtype, device=device)
+        done = torch.zeros((tiles.shape[0], pixels), dtype=torch.bool, device=device)
+        max_count = int(counts.max()) if counts.numel() > 0 else 0
+        for offset in range(0, max_count, GAUSSIANS_PER_STEP):
+            # Early termination: tiles whose pixels are all saturated take no further steps
+            active = ((counts > offset) & ~done.all(dim=1)).nonzero()[:, 0]
+            if active.shape[0] == 0:
+                break
+            slots = offset + torch.arange(GAUSSIANS_PER_STEP, device=device)
+            in_range = slots[None] < counts[active, None]
+            entries = torch.where(in_range, starts[active, None] + slots[None], torch.zeros_like(slots[None]))
+            ids = gaussian_ids[entries]
+
+            d = xy[ids][:, None] - pix[active][:, :, None]
+            conic = conics[ids][:, None]
+            power = -0.5 * (conic[..., 0] * d[..., 0] * d[..., 0] + conic[..., 2] * d[..., 1] * d[..., 1]) - conic[..., 1] * d[..., 0] * d[..., 1]
+            alpha = torch.clamp_max(opacities[ids][:, None] * torch.exp(power), 0.99)
+            contributes = in_range[:, None] & (power <= 0) & (alpha >= 1.0 / 255.0) & ~done[active][..., None]
+            alpha = torch.where(contributes, alpha, torch.zeros_like(alpha))
+
+            T_active = T[active]
+            with torch.no_grad():
+                # Transmittance only decreases along the list, so the kept Gaussians are a prefix
+                test_T = T_active[..., None] * torch.cumprod(1 - alpha, dim=-1)
+                keep = contributes & (test_T >= 0.0001)
+                terminated = (contributes & (test_T < 0.0001)).any(dim=-1)
+            alpha = torch.where(keep, alpha, torch.zeros_like(alpha))
+            transmittance = torch.cumprod(torch.cat([T_active[..., None], 1 - alpha], dim=-1), dim=-1)
+            weights = alpha * transmittance[..., :-1]
+
+            blended = blended.index_put((active,), blended[active] + torch.bmm(weights, features[ids]))
+            T = T.index_put((active,), transmittance[..., -1])
+            done[active] |= terminated
+            n_touched.index_add_(0, ids.flatten(), (keep & inside[active][..., None]).sum(dim=1).flatten().int())
+
+        outputs.append(torch.cat([blended, (1 - T)[..., None], T[..., None]], dim=-1))
+
+    # (tile, pixel, channel) -> (channel, row, column), cropped to the image
+    tiled = torch.cat(outputs, dim=0).view(tiles_y, tiles_x, BLOCK_Y, BLOCK_X, -1)
+    image = tiled.permute(4, 0, 2, 1, 3).reshape(-1, tiles_y * BLOCK_Y, tiles_x * BLOCK_X)[:, :height, :width]
+    channels = colors.shape[1]
+    color = image[:channels] + image[-1:] * settings.bg[:, None, None]
+    return color, image[channels:channels + 1], image[channels + 1:channels + 2], n_touched
+
+def rasterize_gaussians(settings, means3D, means2D, opacities, dc=None, shs=None, colors_precomp=None,
+                        scales=None, rotations=None, cov3D_precomp=None, theta=None, rho=None):
+    viewmatrix, projmatrix = _view_transforms(settings, theta, rho)
+
+    if cov3D_precomp is not None:
+        cov3D = _unstrip_symmetric(cov3D_precomp)
+    else:
+        L = build_scaling_rotation(settings.scale_modifier * scales, rotations)
+        cov3D = L @ L.transpose(1, 2)
+
+    if colors_precomp is None:
+        if dc is not None:
+            shs = torch.cat([dc, shs], dim=1)
+        dirs = means3D - settings.campos
+        dirs = dirs / dirs.norm(dim=1, keepdim=True)
+        colors = torch.clamp_min(eval_sh(settings.sh_degree, shs.transpose(1, 2), dirs) + 0.5, 0.0)
+    else:
+        colors = colors_precomp
+
+    xy, depths, conics, radii, rect = preprocess(settings, means3D, means2D, cov3D, viewmatrix, projmatrix)
+    gaussian_ids, tile_starts, tile_counts = bin_gaussians(settings, depths, radii, rect)
+    color, invdepth, opacity, n_touched = composite_tiles(settings, xy, depths, conics, opacities[:, 0], colors,
+                                                          gaussian_ids, tile_starts, tile_counts)
+    return color, radii, invdepth, opacity, n_touched
+
+class GaussianRasterizer(nn.Module):
+    """ Drop-in replacement of diff_gaussian_rasterization.GaussianRasterizer """
+    def __init__(self, raster_settings):
+        super().__init__()
+        self.raster_settings = raster_settings
+
+    def markVisible(self, positions):
+        with torch.no_grad():
+            p_hom = torch.cat([positions, torch.ones_like(positions[:, :1])], dim=1)
+            return (p_hom @ self.raster_settings.viewmatrix)[:, 2] > 0.2
+
+    def forward(self, means3D, means2D, opacities, dc=None, shs=None, colors_precomp=None, scales=None, rotations=None, cov3D_precomp=None, theta=None, rho=None):
+        if (shs is None and colors_precomp is None) or (shs is not None and colors_precomp is not None):
+            raise Exception('Please provide exactly one of either SHs or precomputed colors!')
+        if ((scales is None or rotations is None) and cov3D_precomp is None) or ((scales is not None or rotations is not None) and cov3D_precomp is not None):
+            raise Exception('Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!')
+
+        return rasterize_gaussians(self.raster_settings, means3D, means2D, opacities, dc, shs, colors_precomp,
+                                   scales, rotations, cov3D_precomp, theta, rho)
@@ -20,6 +20,8 @@ from utils.general_utils import safe_state
 from argparse import ArgumentParser
 from arguments import ModelParams, PipelineParams, get_combined_args
 from gaussian_renderer import GaussianModel
+from gaussian_renderer.cpu_renderer import CPURenderer
+from scene.tiled_export import load_tiles
 try:
     from diff_gaussian_rasterization import SparseGaussianAdam
     SPARSE_ADAM_AVAILABLE = True
@@ -27,7 +29,7 @@ except:
     SPARSE_ADAM_AVAILABLE = False
 
 
-def render_set(model_path, name, iteration, views, gaussians, pipeline, background, train_test_exp, separate_sh):
+def render_set(model_path, name, iteration, views, gaussians, pipeline, background, train_test_exp, separate_sh, cpu_renderer=None):
     render_path = os.path.join(model_path, name, "ours_{}".format(iteration), "renders")
     gts_path = os.path.join(model_path, name, "ours_{}".format(iteration), "gt")
 
@@ -35,7 +37,10 @@ def render_set(model_path, name, iteration, views, gaussians, pipeline, backgrou
     makedirs(gts_path, exist_ok=True)
 
     for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
-        rendering = render(view, gaussians, pipeline, background, use_trained_exp=train_test_exp, separate_sh=separate_sh)["render"]
+        if cpu_renderer is not None:
+            rendering = cpu_renderer.render(view, background, use_trained_exp=train_test_exp)["render"]
+        else:
+            rendering = render(view, gaussians, pipeline, background, use_trained_exp=train_test_exp, separate_sh=separate_sh)["render"]
         gt = view.original_image[0:3, :, :]
 
         if args.train_test_exp:
@@ -45,19 +50,34 @@ def render_set(model_path, name, iteration, views, gaussians, pipeline, backgrou
         torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
         torchvision.utils.save_image(gt, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
 
-def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, separate_sh: bool):
+def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, separate_sh: bool, tiles : str = "", lod_level : int = -1, cpu : bool = False, cpu_threads : int = 0, cpu_dtype : str = "float32"):
+    if cpu:
+        # Batch rendering on CPU servers: nothing is loaded on a GPU
+        dataset.device = "cpu"
+        dataset.data_device = "cpu"
+
     with torch.no_grad():
-        gaussians = GaussianModel(dataset.sh_degree)
+        gaussians = GaussianModel(dataset.sh_degree, device=dataset.device)
         scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False)
+        method_iteration = scene.loaded_iter
+
+        if tiles:
+            # Replace the full model by a level-of-detail subset of a tiled export
+            bytes_loaded = load_tiles(gaussians, tiles, max_level=lod_level)
+            print("Loaded {} Gaussians ({:.2f} MB) up to level {} from {}".format(gaussians.get_xyz.shape[0], bytes_loaded / 2**20, lod_level, tiles))
+            method_iteration = "{}_lod{}".format(scene.loaded_iter, lod_level)
 
         bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
-        background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+        background = torch.tensor(bg_color, dtype=torch.float32, device=dataset.device)
+
+        # Forward-only multi-core CPU renderer, reading the loaded Gaussians once
+        cpu_renderer = CPURenderer(gaussians, cpu_threads, getattr(torch, cpu_dtype)) if cpu else None
 
         if not skip_train:
-             render_set(dataset.model_path, "train", scene.loaded_iter, scene.getTrainCameras(), gaussians, pipeline, background, dataset.train_test_exp, separate_sh)
+             render_set(dataset.model_path, "train", method_iteration, scene.getTrainCameras(), gaussians, pipeline, background, dataset.train_test_exp, separate_sh, cpu_renderer)
 
         if not skip_test:
-             render_set(dataset.model_path, "test", scene.loaded_iter, scene.getTestCameras(), gaussians, pipeline, background, dataset.train_test_exp, separate_sh)
+             render_set(dataset.model_path, "test", method_iteration, scene.getTestCameras(), gaussians, pipeline, background, dataset.train_test_exp, separate_sh, cpu_renderer)
 
 if __name__ == "__main__":
     # Set up command line argument parser
@@ -68,10 +88,15 @@ if __name__ == "__main__":
     parser.add_argument("--skip_train", action="store_true")
     parser.add_argument("--skip_test", action="store_true")
     parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--tiles", default="", type=str)
+    parser.add_argument("--lod_level", default=-1, type=int)
+    parser.add_argument("--cpu", action="store_true")
+    parser.add_argument("--cpu_threads", default=0, type=int)
+    parser.add_argument("--cpu_dtype", default="float32", choices=["float32", "float16"])
     args = get_combined_args(parser)
     print("Rendering " + args.model_path)
 
     # Initialize system state (RNG)
     safe_state(args.quiet)
 
-    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test, SPARSE_ADAM_AVAILABLE)
\ No newline at end of file
+    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test, SPARSE_ADAM_AVAILABLE, args.tiles, args.lod_level, args.cpu, args.cpu_threads, args.cpu_dtype)
\ No newline at end of file
@@ -12,11 +12,15 @@
 import os
 import random
 import json
+import torch
+import numpy as np
 from utils.system_utils import searchForMaxIteration
-from scene.dataset_readers import sceneLoadTypeCallbacks
+from scene.scene_info_cache import read_scene_info
 from scene.gaussian_model import GaussianModel
+from scene.image_store import ImageStore
+from scene.cameras import CameraPoseStore
 from arguments import ModelParams
-from utils.camera_utils import cameraList_from_camInfos, camera_to_JSON
+from utils.camera_utils import cameraPyramid_from_camInfos, camera_to_JSON
 
 class Scene:
 
@@ -37,14 +41,11 @@ class Scene:
                 self.loaded_iter = load_iteration
             print("Loading trained model at iteration {}".format(self.loaded_iter))
 
-        self.train_cameras = {}
-        self.test_cameras = {}
-
         if os.path.exists(os.path.join(args.source_path, "sparse")):
-            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.depths, args.eval, args.train_test_exp)
+            scene_info = read_scene_info("Colmap", (args.source_path, args.images, args.depths, args.eval, args.train_test_exp), args.scene_info_cache)
         elif os.path.exists(os.path.join(args.source_path, "transforms_train.json")):
             print("Found transforms_train.json file, assuming Blender data set!")
-            scene_info = sceneLoadTypeCallbacks["Blender"](args.source_path, args.white_background, args.depths, args.eval)
+            scene_info = read_scene_info("Blender", (args.source_path, args.white_background, args.depths, args.eval), args.scene_info_cache)
         else:
             assert False, "Could not recognize scene type!"
 
@@ -68,30 +69,64 @@ class Scene:
 
         self.cameras_extent = scene_info.nerf_normalization["radius"]
 
-        for resolution_scale in resolution_scales:
-            print("Loading Training Cameras")
-            self.train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args, scene_info.is_nerf_synthetic, False)
-            print("Loading Test Cameras")
-            self.test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args, scene_info.is_nerf_synthetic, True)
+        # A non-negative budget decodes images on demand and keeps at most that many MB of them resident
+        self.image_store = None
+        if args.image_cache_mb is not None and args.image_cache_mb >= 0:
+            self.image_store = ImageStore(args.image_cache_mb * 2**20)
+
+        # The cameras of all resolution scales share their poses
+        print("Loading Training Cameras")
+        self.train_pose_store = CameraPoseStore.from_cam_infos(scene_info.train_cameras, args.device)
+        self.train_cameras = cameraPyramid_from_camInfos(scene_info.train_cameras, resolution_scales, args, scene_info.is_nerf_synthetic, False, self.image_store, self.train_pose_store)
+        print("Loading Test Cameras")
+        self.test_cameras = cameraPyramid_from_camInfos(scene_info.test_cameras, resolution_scales, args, scene_info.is_nerf_synthetic, True, self.image_store)
 
         if self.loaded_iter:
-            self.gaussians.load_ply(os.path.join(self.model_path,
-                                                           "point_cloud",
-                                                           "iteration_" + str(self.loaded_iter),
-                                                           "point_cloud.ply"), args.train_test_exp)
+            point_cloud_path = os.path.join(self.model_path, "point_cloud", "iteration_" + str(self.loaded_iter))
+            if os.path.exists(os.path.join(point_cloud_path, "point_cloud.ply")):
+                self.gaussians.load_ply(os.path.join(point_cloud_path, "point_cloud.ply"), args.train_test_exp)
+            else:
+                self.gaussians.load_compact(os.path.join(point_cloud_path, "point_cloud.compact"), args.train_test_exp)
         else:
             self.gaussians.create_from_pcd(scene_info.point_cloud, scene_info.train_cameras, self.cameras_extent)
 
-    def save(self, iteration):
+    def save(self, iteration, snapshot_writer=None):
+        if snapshot_writer is None:
+            self.save_gaussians(self.gaussians, iteration)
+        else:
+            # Only the device copy happens here, serialization runs on the writer thread
+            gaussians = self.gaussians.snapshot()
+            snapshot_writer.submit("point_cloud", iteration, lambda: self.save_gaussians(gaussians, iteration))
+
+    def save_gaussians(self, gaussians, iteration):
         point_cloud_path = os.path.join(self.model_path, "point_cloud/iteration_{}".format(iteration))
-        self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"))
+        gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"))
         exposure_dict = {
-            image_name: self.gaussians.get_exposure_from_name(image_name).detach().cpu().numpy().tolist()
-            for image_name in self.gaussians.exposure_mapping
+            image_name: gaussians.get_exposure_from_name(image_name).detach().cpu().numpy().tolist()
+            for image_name in gaussians.exposure_mapping
         }
 
-        with open(os.path.join(self.model_path, "exposure.json"), "w") as f:
+        exposure_path = os.path.join(self.model_path, "exposure.json")
+        with open(exposure_path + ".tmp", "w") as f:
             json.dump(exposure_dict, f, indent=2)
+        os.replace(exposure_path + ".tmp", exposure_path)
+
+    def capture_cameras(self):
+        state = self.getTrainPoseStore().capture()
+        state["image_names"] = [camera.image_name for camera in self.getTrainCameras()]
+        return state
+
+    def restore_cameras(self, camera_args):
+        indices = {camera.image_name: camera.pose_index for camera in self.getTrainCameras()}
+        rows = list(range(len(camera_args["image_names"])))
+        if "delta" not in camera_args:
+            # Checkpoints written before the pose store kept separate rotation and translation deltas
+            camera_args = dict(camera_args, delta=torch.cat([torch.as_tensor(camera_args["trans_delta"]), torch.as_tensor(camera_args["rot_delta"])], dim=1))
+        self.getTrainPoseStore().restore([indices[name] for name in camera_args["image_names"]], camera_args, rows)
+
+    def getTrainPoseStore(self, scale=1.0):
+        # Shared by the train cameras of every scale
+        return self.train_pose_store
 
     def getTrainCameras(self, scale=1.0):
         return self.train_cameras[scale]
@@ -13,7 +13,6 @@ import torch
 from torch import nn
 import numpy as np
 from utils.graphics_utils import getWorld2View2, getProjectionMatrix
-from utils.general_utils import PILtoTorch
 import cv2
 
 def rt2mat(R, T):
@@ -24,126 +23,271 @@ def rt2mat(R, T):
 
 
 def skew_sym_mat(x):
-    device = x.device
-    dtype = x.dtype
-    ssm = torch.zeros(3, 3, device=device, dtype=dtype)
-    ssm[0, 1] = -x[2]
-    ssm[0, 2] = x[1]
-    ssm[1, 0] = x[2]
-    ssm[1, 2] = -x[0]
-    ssm[2, 0] = -x[1]
-    ssm[2, 1] = x[0]
-    return ssm
+    """ Skew-symmetric matrices of (..., 3) vectors, shape (..., 3, 3) """
+    zero = torch.zeros_like(x[..., 0])
+    return torch.stack([
+        torch.stack([zero, -x[..., 2], x[..., 1]], dim=-1),
+        torch.stack([x[..., 2], zero, -x[..., 0]], dim=-1),
+        torch.stack([-x[..., 1], x[..., 0], zero], dim=-1),
+    ], dim=-2)
+
+def _rodrigues_coefficients(theta):
+    # Coefficients of W and W^2 in SO3_exp and V, with Taylor expansions for small angles
+    angle = torch.norm(theta, dim=-1)[..., None, None]
+    small = angle < 1e-5
+    safe_angle = torch.where(small, torch.ones_like(angle), angle)
+    a = torch.where(small, torch.ones_like(angle), torch.sin(safe_angle) / safe_angle)
+    b = torch.where(small, torch.full_like(angle, 0.5), (1 - torch.cos(safe_angle)) / (safe_angle**2))
+    c = torch.where(small, torch.full_like(angle, 1.0 / 6.0), (safe_angle - torch.sin(safe_angle)) / (safe_angle**3))
+    return a, b, c
 
 def SO3_exp(theta):
-    device = theta.device
-    dtype = theta.dtype
-
+    """ Rotation matrices (..., 3, 3) of axis-angle vectors (..., 3) """
     W = skew_sym_mat(theta)
     W2 = W @ W
-    angle = torch.norm(theta)
-    I = torch.eye(3, device=device, dtype=dtype)
-    if angle < 1e-5:
-        return I + W + 0.5 * W2
-    else:
-        return (
-            I
-            + (torch.sin(angle) / angle) * W
-            + ((1 - torch.cos(angle)) / (angle**2)) * W2
-        )
+    I = torch.eye(3, device=theta.device, dtype=theta.dtype)
+    a, b, _ = _rodrigues_coefficients(theta)
+    return I + a * W + b * W2
 
 
 def V(theta):
-    dtype = theta.dtype
-    device = theta.device
-    I = torch.eye(3, device=device, dtype=dtype)
     W = skew_sym_mat(theta)
     W2 = W @ W
-    angle = torch.norm(theta)
-    if angle < 1e-5:
-        V = I + 0.5 * W + (1.0 / 6.0) * W2
-    else:
-        V = (
-            I
-            + W * ((1.0 - torch.cos(angle)) / (angle**2))
-            + W2 * ((angle - torch.sin(angle)) / (angle**3))
-        )
-    return V
+    I = torch.eye(3, device=theta.device, dtype=theta.dtype)
+    _, b, c = _rodrigues_coefficients(theta)
+    return I + b * W + c * W2
 
 def SE3_exp(tau):
-    dtype = tau.dtype
-    device = tau.device
-
-    rho = tau[:3]
-    theta = tau[3:]
-    R = SO3_exp(theta)
-    t = V(theta) @ rho
-
-    T = torch.eye(4, device=device, dtype=dtype)
-    T[:3, :3] = R
-    T[:3, 3] = t
+    """ Rigid transforms (..., 4, 4) of twists (..., 6) laid out as (translation, rotation) """
+    rho = tau[..., :3]
+    theta = tau[..., 3:]
+    T = torch.eye(4, device=tau.device, dtype=tau.dtype).repeat(tau.shape[:-1] + (1, 1))
+    T[..., :3, :3] = SO3_exp(theta)
+    T[..., :3, 3] = (V(theta) @ rho[..., None])[..., 0]
     return T
 
+class CameraPoseStore:
+    """
+    World-to-camera poses and pose refinement deltas of a camera list, kept as
+    (N, ...) tensors on one device. Cameras hold an index into the store. The
+    deltas (translation, rotation twists) are one (N, 6) parameter optimized with
+    a row-wise Adam, so a step only touches the given cameras, as a per-camera
+    optimizer would, but runs as a single batched update.
+    """
+    def __init__(self, R, T, device="cuda", lr=0.001, betas=(0.9, 0.999), eps=1e-8):
+        self.device = torch.device(device)
+        num_cameras = len(R)
+        self.R = torch.tensor(np.asarray(R, dtype=np.float64).reshape(num_cameras, 3, 3), device=self.device)
+        self.T = torch.tensor(np.asarray(T, dtype=np.float64).reshape(num_cameras, 3), device=self.device)
+        self.delta = nn.Parameter(torch.zeros((num_cameras, 6), device=self.device, requires_grad=True))
+        # Host-side counters, bumped on every pose change of a camera
+        self.versions = np.zeros(num_cameras, dtype=np.int64)
+
+        self.lr = lr
+        self.betas = betas
+        self.eps = eps
+        self.exp_avg = torch.zeros((num_cameras, 6), device=self.device)
+        self.exp_avg_sq = torch.zeros((num_cameras, 6), device=self.device)
+        self.steps = torch.zeros((num_cameras, 1), device=self.device)
+
+    @classmethod
+    def from_cam_infos(cls, cam_infos, device="cuda"):
+        R = np.stack([c.R.transpose() for c in cam_infos]) if cam_infos else np.zeros((0, 3, 3))
+        T = np.stack([c.T for c in cam_infos]) if cam_infos else np.zeros((0, 3))
+        return cls(R, T, device)
+
+    def __len__(self):
+        return self.R.shape[0]
+
+    def _rows(self, indices):
+        return torch.as_tensor(indices, dtype=torch.long, device=self.device)
+
+    def set_pose(self, indices, R, T):
+        rows = self._rows(indices)
+        with torch.no_grad():
+            self.R[rows] = torch.as_tensor(R, dtype=torch.float64, device=self.device).reshape(-1, 3, 3)
+            self.T[rows] = torch.as_tensor(T, dtype=torch.float64, device=self.device).reshape(-1, 3)
+        self.versions[np.asarray(indices)] += 1
+
+    def zero_grad(self):
+        self.delta.grad = None
+
+    def step(self, indices=None):
+        """ Adam step on the deltas of the given cameras (default: every camera with a non-zero gradient) """
+        grad = self.delta.grad
+        if grad is None:
+            return
+        with torch.no_grad():
+            rows = self._rows(indices) if indices is not None else grad.abs().sum(dim=1).nonzero()[:, 0]
+            grad = grad[rows]
+            beta1, beta2 = self.betas
+            steps = self.steps[rows] + 1
+            exp_avg = self.exp_avg[rows].lerp_(grad, 1 - beta1)
+            exp_avg_sq = self.exp_avg_sq[rows].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            self.steps[rows] = steps
+            self.exp_avg[rows] = exp_avg
+            self.exp_avg_sq[rows] = exp_avg_sq
+
+            bias_correction1 = 1 - beta1 ** steps
+            bias_correction2 = 1 - beta2 ** steps
+            denom = (exp_avg_sq.sqrt() / bias_correction2.sqrt()).add_(self.eps)
+            self.delta[rows] -= self.lr / bias_correction1 * exp_avg / denom
+
+    def update_poses(self, indices, converged_threshold=1e-4):
+        """ Fold the deltas of the given cameras into their poses and reset them; returns per-camera convergence """
+        rows = self._rows(indices)
+        with torch.no_grad():
+            tau = self.delta[rows]
+
+            T_w2c = torch.eye(4, device=self.device, dtype=tau.dtype).repeat(rows.shape[0], 1, 1)
+            T_w2c[:, 0:3, 0:3] = self.R[rows].to(tau.dtype)
+            T_w2c[:, 0:3, 3] = self.T[rows].to(tau.dtype)
+
+            new_w2c = SE3_exp(tau) @ T_w2c
+
+            self.R[rows] = new_w2c[:, 0:3, 0:3].double()
+            self.T[rows] = new_w2c[:, 0:3, 3].double()
+            self.delta[rows] = 0
+        self.versions[np.asarray(indices)] += 1
+        return tau.norm(dim=1) < converged_threshold
+
+    def capture(self):
+        return {
+            "R": self.R.cpu().numpy(),
+            "T": self.T.cpu().numpy(),
+            "delta": self.delta.detach(),
+        }
+
+    def restore(self, indices, pose_args, rows):
+        """ Copy rows of a captured state (pose_args) into the given cameras """
+        self.set_pose(indices, pose_args["R"][rows], pose_args["T"][rows])
+        with torch.no_grad():
+            self.delta[self._rows(indices)] = pose_args["delta"][self._rows(rows)].to(self.device)
+
+    def optimizer_state_dict(self):
+        return {"exp_avg": self.exp_avg, "exp_avg_sq": self.exp_avg_sq, "steps": self.steps}
+
+    def load_optimizer_state_dict(self, state_dict):
+        self.exp_avg.copy_(state_dict["exp_avg"])
+        self.exp_avg_sq.copy_(state_dict["exp_avg_sq"])
+        self.steps.copy_(state_dict["steps"])
+
+def get_data_device(data_device):
+    try:
+        return torch.device(data_device)
+    except Exception as e:
+        print(e)
+        print(f"[Warning] Custom device {data_device} failed, fallback to default cuda device" )
+        return torch.device("cuda")
+
+def depth_scale_outlier(depth_params):
+    return depth_params["scale"] < 0.2 * depth_params["med_scale"] or depth_params["scale"] > 5 * depth_params["med_scale"]
+
+def resize_image_data(image, invdepthmap, resolution):
+    """ Resize a decoded PIL image and raw inverse depth map, returned as uint8 (H, W[, C]) and float32 arrays """
+    resized_image = np.array(image.resize(resolution))
+    if invdepthmap is not None:
+        invdepthmap = cv2.resize(invdepthmap, resolution)
+    return resized_image, invdepthmap
+
+def image_data_from_arrays(image, invdepthmap, depth_params, data_device, train_test_exp, is_test_dataset, is_test_view):
+    """
+    Build the camera tensors on data_device from resized arrays (see resize_image_data).
+    Images and alpha masks stay uint8 (the mask is None when it would be all ones) and
+    are only converted to float when consumed, see Camera.get_gt_image.
+    """
+    resized_image = torch.from_numpy(np.array(image))
+    if len(resized_image.shape) == 3:
+        resized_image = resized_image.permute(2, 0, 1)
+    else:
+        resized_image = resized_image.unsqueeze(dim=-1).permute(2, 0, 1)
+    gt_image = resized_image[:3, ...].contiguous()
+    alpha_mask = None
+    if resized_image.shape[0] == 4:
+        alpha_mask = resized_image[3:4, ...].contiguous()
+
+    if train_test_exp and is_test_view:
+        if alpha_mask is None:
+            alpha_mask = torch.full_like(resized_image[0:1, ...], 255)
+        if is_test_dataset:
+            alpha_mask[..., :alpha_mask.shape[-1] // 2] = 0
+        else:
+            alpha_mask[..., alpha_mask.shape[-1] // 2:] = 0
+
+    data = {
+        "image": gt_image.to(data_device),
+        "alpha_mask": alpha_mask.to(data_device) if alpha_mask is not None else None,
+        "invdepthmap": None,
+    }
+
+    if invdepthmap is not None:
+        invdepthmap = np.array(invdepthmap)
+        invdepthmap[invdepthmap < 0] = 0
+
+        if depth_params is not None and depth_params["scale"] > 0:
+            invdepthmap = invdepthmap * depth_params["scale"] + depth_params["offset"]
+
+        if invdepthmap.ndim != 2:
+            invdepthmap = invdepthmap[..., 0]
+        data["invdepthmap"] = torch.from_numpy(invdepthmap[None]).to(data_device)
+    return data
+
+def prepare_image_data(image, invdepthmap, resolution, depth_params, data_device, train_test_exp, is_test_dataset, is_test_view):
+    """ Resize a decoded image and inverse depth map to the camera resolution and move them to data_device """
+    return image_data_from_arrays(*resize_image_data(image, invdepthmap, resolution), depth_params, data_device,
+                                  train_test_exp, is_test_dataset, is_test_view)
+
 class Camera(nn.Module):
     def __init__(self, resolution, colmap_id, R, T, FoVx, FoVy, depth_params, image, invdepthmap,
                  image_name, uid,
                  trans=np.array([0.0, 0.0, 0.0]), scale=1.0, data_device = "cuda",
-                 train_test_exp = False, is_test_dataset = False, is_test_view = False
+                 train_test_exp = False, is_test_dataset = False, is_test_view = False,
+                 image_loader = None, image_store = None, has_depth = False, image_data = None,
+                 pose_store = None, pose_index = 0, device = "cuda"
                  ):
         super(Camera, self).__init__()
 
         self.uid = uid
         self.colmap_id = colmap_id
-        self.R = R.transpose()
-        self.T = T
+        # Transforms are built on device, where the Gaussians are rendered
+        self.device = torch.device(device)
+        # The pose and its refinement delta live in a (shared) CameraPoseStore
+        if pose_store is None:
+            pose_store = CameraPoseStore(R.transpose()[None], T[None], self.device)
+            pose_index = 0
+        self.pose_store = pose_store
+        self.pose_index = pose_index
+        self._transforms_version = -1
+        self._transforms = None
         self.FoVx = FoVx
         self.FoVy = FoVy
         self.image_name = image_name
 
-        try:
-            self.data_device = torch.device(data_device)
-        except Exception as e:
-            print(e)
-            print(f"[Warning] Custom device {data_device} failed, fallback to default cuda device" )
-            self.data_device = torch.device("cuda")
-
-        resized_image_rgb = PILtoTorch(image, resolution)
-        gt_image = resized_image_rgb[:3, ...]
-        self.alpha_mask = None
-        if resized_image_rgb.shape[0] == 4:
-            self.alpha_mask = resized_image_rgb[3:4, ...].to(self.data_device)
-        else: 
-            self.alpha_mask = torch.ones_like(resized_image_rgb[0:1, ...].to(self.data_device))
-
-        if train_test_exp and is_test_view:
-            if is_test_dataset:
-                self.alpha_mask[..., :self.alpha_mask.shape[-1] // 2] = 0
+        self.data_device = get_data_device(data_device)
+
+        self.resolution = resolution
+        self.depth_params = depth_params
+        self.train_test_exp = train_test_exp
+        self.is_test_dataset = is_test_dataset
+        self.is_test_view = is_test_view
+        self.image_width = resolution[0]
+        self.image_height = resolution[1]
+
+        # image_loader returns the image and inverse depth already resized (see resize_image_data).
+        # With an image store, image data is built on demand through it and may be evicted again.
+        # Otherwise it is built here, unless already prepared by the caller (image_data)
+        self.image_loader = image_loader
+        self.image_store = image_store
+        has_depth = has_depth or invdepthmap is not None
+        self.depth_reliable = has_depth and not (depth_params is not None and depth_scale_outlier(depth_params))
+        self._image_data = None
+        if image_store is None:
+            if image_data is not None:
+                self._image_data = image_data
+            elif image_loader is not None:
+                self._image_data = self.load_image_data()
             else:
-                self.alpha_mask[..., self.alpha_mask.shape[-1] // 2:] = 0
-
-        self.original_image = gt_image.clamp(0.0, 1.0).to(self.data_device)
-        self.image_width = self.original_image.shape[2]
-        self.image_height = self.original_image.shape[1]
-
-        self.invdepthmap = None
-        self.depth_reliable = False
-        if invdepthmap is not None:
-            self.depth_mask = torch.ones_like(self.alpha_mask)
-            self.invdepthmap = cv2.resize(invdepthmap, resolution)
-            self.invdepthmap[self.invdepthmap < 0] = 0
-            self.depth_reliable = True
-
-            if depth_params is not None:
-                if depth_params["scale"] < 0.2 * depth_params["med_scale"] or depth_params["scale"] > 5 * depth_params["med_scale"]:
-                    self.depth_reliable = False
-                    self.depth_mask *= 0
-                
-                if depth_params["scale"] > 0:
-                    self.invdepthmap = self.invdepthmap * depth_params["scale"] + depth_params["offset"]
-
-            if self.invdepthmap.ndim != 2:
-                self.invdepthmap = self.invdepthmap[..., 0]
-            self.invdepthmap = torch.from_numpy(self.invdepthmap[None]).to(self.data_device)
+                self._image_data = self.prepare_image_data(image, invdepthmap)
 
         self.zfar = 100.0
         self.znear = 0.01
@@ -152,55 +296,125 @@ class Camera(nn.Module):
         self.scale = scale
 
         # self.world_view_transform = torch.tensor(getWorld2View2(R, T, trans, scale)).transpose(0, 1).cuda()
-        self.projection_matrix = getProjectionMatrix(znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy).transpose(0,1).cuda()
+        self.projection_matrix = getProjectionMatrix(znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy).transpose(0,1).to(self.device)
         # self.full_proj_transform = (self.world_view_transform.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
         # self.camera_center = self.world_view_transform.inverse()[3, :3]
 
-        self.cam_rot_delta = nn.Parameter(
-            torch.zeros(3, requires_grad=True, device="cuda:0")
-        )
-        self.cam_trans_delta = nn.Parameter(
-            torch.zeros(3, requires_grad=True, device="cuda:0")
-        )
     
+    def prepare_image_data(self, image, invdepthmap):
+        return prepare_image_data(image, invdepthmap, self.resolution, self.depth_params, self.data_device,
+                                  self.train_test_exp, self.is_test_dataset, self.is_test_view)
+
+    def load_image_data(self):
+        return image_data_from_arrays(*self.image_loader(), self.depth_params, self.data_device,
+                                      self.train_test_exp, self.is_test_dataset, self.is_test_view)
+
+    @property
+    def image_data(self):
+        if self.image_store is None:
+            return self._image_data
+        return self.image_store.get(self, self.load_image_data)
+
+    def get_gt_image(self, device=None):
+        """ Ground truth image in [0, 1], moved to device (data_device by default) as uint8 before conversion """
+        image = self.image_data["image"].to(device if device is not None else self.data_device, non_blocking=True)
+        return image.float() / 255.0
+
+    def get_alpha_mask(self, device=None):
+        """ Alpha mask in [0, 1] on device, or None when the camera has no mask (all ones) """
+        alpha_mask = self.image_data["alpha_mask"]
+        if alpha_mask is None:
+            return None
+        return alpha_mask.to(device if device is not None else self.data_device, non_blocking=True).float() / 255.0
+
+    @property
+    def original_image(self):
+        return self.get_gt_image()
+
+    @property
+    def alpha_mask(self):
+        alpha_mask = self.get_alpha_mask()
+        if alpha_mask is None:
+            return torch.ones((1, self.image_height, self.image_width), device=self.data_device)
+        return alpha_mask
+
+    @property
+    def invdepthmap(self):
+        return self.image_data["invdepthmap"]
+
+    @property
+    def depth_mask(self):
+        invdepthmap = self.invdepthmap
+        if invdepthmap is None:
+            return None
+        return torch.full_like(invdepthmap, 1.0 if self.depth_reliable else 0.0)
+
+    @property
+    def R(self):
+        return self.pose_store.R[self.pose_index].cpu().numpy()
+
+    @R.setter
+    def R(self, R):
+        self.pose_store.set_pose([self.pose_index], R, self.pose_store.T[self.pose_index])
+
+    @property
+    def T(self):
+        return self.pose_store.T[self.pose_index].cpu().numpy()
+
+    @T.setter
+    def T(self, T):
+        self.pose_store.set_pose([self.pose_index], self.pose_store.R[self.pose_index], T)
+
+    @property
+    def pose_version(self):
+        return self.pose_store.versions[self.pose_index]
+
+    @property
+    def cam_rot_delta(self):
+        return self.pose_store.delta[self.pose_index, 3:]
+
+    @property
+    def cam_trans_delta(self):
+        return self.pose_store.delta[self.pose_index, :3]
+
+    def get_transforms(self):
+        """ World-to-view, full projection and camera center on the camera device, recomputed only after a pose change """
+        if self._transforms_version != self.pose_version:
+            # Same as getWorld2View2, on the pose store device
+            store = self.pose_store
+            Rt = torch.eye(4, dtype=torch.float64, device=store.device)
+            Rt[:3, :3] = store.R[self.pose_index]
+            Rt[:3, 3] = store.T[self.pose_index]
+            C2W = torch.linalg.inv(Rt)
+            C2W[:3, 3] = (C2W[:3, 3] + torch.as_tensor(self.trans, dtype=torch.float64, device=store.device)) * self.scale
+            world_view_transform = torch.linalg.inv(C2W).float().transpose(0, 1).to(self.device)
+            full_proj_transform = (
+                world_view_transform.unsqueeze(0).bmm(
+                    self.projection_matrix.unsqueeze(0)
+                )
+            ).squeeze(0)
+            camera_center = world_view_transform.inverse()[3, :3]
+            self._transforms = (world_view_transform, full_proj_transform, camera_center)
+            self._transforms_version = self.pose_version
+        return self._transforms
+
     @property
     def world_view_transform(self):
-        return torch.tensor(getWorld2View2(self.R, self.T, self.trans, self.scale)).transpose(0, 1).cuda()
+        return self.get_transforms()[0]
 
     @property
     def full_proj_transform(self):
-        return (
-            self.world_view_transform.unsqueeze(0).bmm(
-                self.projection_matrix.unsqueeze(0)
-            )
-        ).squeeze(0)
+        return self.get_transforms()[1]
 
     @property
     def camera_center(self):
-        return self.world_view_transform.inverse()[3, :3]
+        return self.get_transforms()[2]
 
     def update_RT(self, R, t):
-        self.R = R.to(device=self.data_device).detach().numpy()
-        self.T = t.to(device=self.data_device).detach().numpy()
+        self.pose_store.set_pose([self.pose_index], R, t)
     
     def update_pose(self, converged_threshold=1e-4):
-        tau = torch.cat([self.cam_trans_delta, self.cam_rot_delta], axis=0)
-
-        T_w2c = torch.eye(4, device=tau.device)
-        T_w2c[0:3, 0:3] = torch.tensor(self.R, device=tau.device, dtype=tau.dtype)
-        T_w2c[0:3, 3] = torch.tensor(self.T, device=tau.device, dtype=tau.dtype)
-
-        new_w2c = SE3_exp(tau) @ T_w2c
-
-        new_R = new_w2c[0:3, 0:3]
-        new_T = new_w2c[0:3, 3]
-
-        converged = tau.norm() < converged_threshold
-        self.update_RT(new_R, new_T)
-
-        self.cam_rot_delta.data.fill_(0)
-        self.cam_trans_delta.data.fill_(0)
-        return converged
+        return self.pose_store.update_poses([self.pose_index], converged_threshold)[0]
         
 class MiniCam:
     def __init__(self, width, height, fovy, fovx, znear, zfar, world_view_transform, full_proj_transform):
@@ -12,6 +12,7 @@
 import numpy as np
 import collections
 import struct
+import mmap
 
 CameraModel = collections.namedtuple(
     "CameraModel", ["model_id", "model_name", "num_params"])
@@ -122,35 +123,49 @@ def read_points3D_text(path):
 
     return xyzs, rgbs, errors
 
+# Fixed-size parts of the records of images.bin and points3D.bin
+IMAGE_PROPERTIES = struct.Struct("<idddddddi")
+POINT2D_DTYPE = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
+POINT3D_PROPERTIES_DTYPE = np.dtype([("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3), ("error", "<f8"), ("track_length", "<u8")])
+POINT3D_TRACK_ELEM_SIZE = 8
+
+def read_binary_buffer(path):
+    """ Memory-map a binary file; pages that are skipped over are never read from disk. Use as a context manager """
+    with open(path, "rb") as fid:
+        return mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
 def read_points3D_binary(path_to_model_file):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
+    with read_binary_buffer(path_to_model_file) as buffer:
+        num_points = struct.unpack_from("<Q", buffer, 0)[0]
+        if num_points == 0:
+            return np.empty((0, 3)), np.empty((0, 3)), np.empty((0, 1))
 
+        # Tracks make the records variable-length, and every record starts where the previous
+        # one ends: the walk over the track lengths is the only sequential part
+        starts = []
+        add_start = starts.append
+        offset = 8
+        track_length_offset = POINT3D_PROPERTIES_DTYPE.fields["track_length"][1]
+        record_size = POINT3D_PROPERTIES_DTYPE.itemsize
+        unpack_track_length = struct.Struct("<Q").unpack_from
+        for _ in range(num_points):
+            add_start(offset)
+            offset += record_size + POINT3D_TRACK_ELEM_SIZE * unpack_track_length(buffer, offset + track_length_offset)[0]
 
-    with open(path_to_model_file, "rb") as fid:
-        num_points = read_next_bytes(fid, 8, "Q")[0]
-
-        xyzs = np.empty((num_points, 3))
-        rgbs = np.empty((num_points, 3))
-        errors = np.empty((num_points, 1))
+        # Then copy the fixed-size part of every record at once, through a view of the
+        # buffer with one record-sized window per byte
+        windows = np.lib.stride_tricks.sliding_window_view(np.frombuffer(buffer, dtype=np.uint8), record_size)
+        records = windows[np.array(starts, dtype=np.int64)].view(POINT3D_PROPERTIES_DTYPE)[:, 0]
+        del windows
 
-        for p_id in range(num_points):
-            binary_point_line_properties = read_next_bytes(
-                fid, num_bytes=43, format_char_sequence="QdddBBBd")
-            xyz = np.array(binary_point_line_properties[1:4])
-            rgb = np.array(binary_point_line_properties[4:7])
-            error = np.array(binary_point_line_properties[7])
-            track_length = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q")[0]
-            track_elems = read_next_bytes(
-                fid, num_bytes=8*track_length,
-                format_char_sequence="ii"*track_length)
-            xyzs[p_id] = xyz
-            rgbs[p_id] = rgb
-            errors[p_id] = error
+    xyzs = records["xyz"].astype(np.float64)
+    rgbs = records["rgb"].astype(np.float64)
+    errors = records["error"].astype(np.float64)[:, None]
     return xyzs, rgbs, errors
 
 def read_intrinsics_text(path):
@@ -177,34 +192,39 @@ def read_intrinsics_text(path):
                                             params=params)
     return cameras
 
-def read_extrinsics_binary(path_to_model_file):
+def read_extrinsics_binary(path_to_model_file, read_points2D=True):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
+
+    With read_points2D=False only poses are read: the 2D observations are skipped
+    and xys / point3D_ids are None.
     """
     images = {}
-    with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
+    with read_binary_buffer(path_to_model_file) as buffer:
+        num_reg_images = struct.unpack_from("<Q", buffer, 0)[0]
+        offset = 8
         for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
+            binary_image_properties = IMAGE_PROPERTIES.unpack_from(buffer, offset)
+            offset += IMAGE_PROPERTIES.size
             image_id = binary_image_properties[0]
             qvec = np.array(binary_image_properties[1:5])
             tvec = np.array(binary_image_properties[5:8])
             camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
+            name_end = buffer.find(b"\x00", offset)   # look for the ASCII 0 entry
+            image_name = buffer[offset:name_end].decode("utf-8")
+            offset = name_end + 1
+            num_points2D = struct.unpack_from("<Q", buffer, offset)[0]
+            offset += 8
+            xys = None
+            point3D_ids = None
+            if read_points2D:
+                # Slicing the mmap copies the observations, so no view outlives the mapping
+                x_y_id_s = np.frombuffer(buffer[offset:offset + POINT2D_DTYPE.itemsize * num_points2D], dtype=POINT2D_DTYPE)
+                xys = x_y_id_s["xy"].astype(np.float64)
+                point3D_ids = x_y_id_s["point3D_id"].astype(np.int64)
+            offset += POINT2D_DTYPE.itemsize * num_points2D
             images[image_id] = Image(
                 id=image_id, qvec=qvec, tvec=tvec,
                 camera_id=camera_id, name=image_name,
@@ -278,17 +298,16 @@ def read_colmap_bin_array(path):
     :return: nd array with the floating point values in the value
     """
     with open(path, "rb") as fid:
-        width, height, channels = np.genfromtxt(fid, delimiter="&", max_rows=1,
-                                                usecols=(0, 1, 2), dtype=int)
-        fid.seek(0)
-        num_delimiter = 0
-        byte = fid.read(1)
-        while True:
-            if byte == b"&":
-                num_delimiter += 1
-                if num_delimiter >= 3:
-                    break
-            byte = fid.read(1)
+        # The header is "width&height&channels&", the float32 values follow
+        header = b""
+        while header.count(b"&") < 3:
+            chunk = fid.read(64)
+            if not chunk:
+                raise ValueError("Truncated COLMAP array header in " + path)
+            header += chunk
+        fields = header.split(b"&", 3)
+        width, height, channels = (int(field) for field in fields[:3])
+        fid.seek(len(header) - len(fields[3]))
         array = np.fromfile(fid, np.float32)
     array = array.reshape((width, height, channels), order="F")
     return np.transpose(array, (1, 0, 2)).squeeze()
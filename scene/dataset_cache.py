@@ -0,0 +1,115 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# A dataset cache is a directory holding data.bin, the resized uint8 images and
+# float32 inverse depth maps of a camera list back to back, and manifest.json
+# with the key the cache was built for and the offset/shape of every array.
+# Directories are named after a hash of the key, which covers the source path,
+# the size and mtime of every input file, the loading resolution and decoding mode.
+CACHE_DATA_NAME = "data.bin"
+CACHE_MANIFEST_NAME = "manifest.json"
+CACHE_ALIGNMENT = 64
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def dataset_cache_key(source_path, cam_infos, resolution, resolution_scale, jpeg_draft=False):
+    key = {
+        "version": 1,
+        "source_path": os.path.abspath(source_path),
+        "resolution": resolution,
+        "resolution_scale": resolution_scale,
+        "jpeg_draft": jpeg_draft,
+        "files": [[_file_stat(c.image_path), _file_stat(c.depth_path) if c.depth_path != "" else None] for c in cam_infos],
+    }
+    return key, hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class DatasetCache:
+    """ Read side of a dataset cache; arrays are memory-mapped views into data.bin """
+    def __init__(self, path):
+        with open(os.path.join(path, CACHE_MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+        self.key = manifest["key"]
+        self.entries = manifest["entries"]
+        data_path = os.path.join(path, CACHE_DATA_NAME)
+        self.data = np.memmap(data_path, dtype=np.uint8, mode="r") if os.path.getsize(data_path) > 0 else np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _array(self, entry):
+        count = int(np.prod(entry["shape"]))
+        dtype = np.dtype(entry["dtype"])
+        return self.data[entry["offset"]:entry["offset"] + count * dtype.itemsize].view(dtype).reshape(entry["shape"])
+
+    def resolution(self, idx):
+        return tuple(self.entries[idx]["resolution"])
+
+    def arrays(self, idx):
+        """ Resized image and inverse depth map (or None) of camera idx, as in resize_image_data """
+        entry = self.entries[idx]
+        depth = self._array(entry["depth"]) if entry["depth"] is not None else None
+        return self._array(entry["image"]), depth
+
+def write_dataset_cache(path, key, items):
+    """
+    Write a dataset cache from (resolution, image, invdepthmap) tuples. The cache
+    is assembled in a temporary directory and renamed into place, so concurrent
+    jobs building the same cache never see a partial one.
+    """
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    entries = []
+    offset = 0
+    with open(os.path.join(tmp_path, CACHE_DATA_NAME), "wb") as fid:
+        def write_array(array):
+            nonlocal offset
+            array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+            offset = (offset + CACHE_ALIGNMENT - 1) // CACHE_ALIGNMENT * CACHE_ALIGNMENT
+            fid.seek(offset)
+            array.tofile(fid)
+            entry = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            offset += array.nbytes
+            return entry
+
+        for resolution, image, invdepthmap in items:
+            entries.append({
+                "resolution": list(resolution),
+                "image": write_array(image),
+                "depth": write_array(invdepthmap) if invdepthmap is not None else None,
+            })
+        fid.truncate(offset)
+
+    with open(os.path.join(tmp_path, CACHE_MANIFEST_NAME), "w") as f:
+        json.dump({"key": key, "entries": entries}, f)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another job finished the same cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def open_dataset_cache(cache_dir, key, digest):
+    """ The cache for key if it exists and matches, else None """
+    path = os.path.join(cache_dir, digest)
+    if not os.path.isfile(os.path.join(path, CACHE_MANIFEST_NAME)):
+        return None
+    cache = DatasetCache(path)
+    return cache if cache.key == key else None
@@ -19,7 +19,7 @@ from utils.graphics_utils import getWorld2View2, focal2fov, fov2focal
 import numpy as np
 import json
 from pathlib import Path
-from plyfile import PlyData, PlyElement
+from utils.ply_utils import read_ply_vertices, write_ply_vertices, ply_columns
 from utils.sh_utils import SH2RGB
 from scene.gaussian_model import BasicPointCloud
 
@@ -118,11 +118,10 @@ def readColmapCameras(cam_extrinsics, cam_intrinsics, depths_params, images_fold
     return cam_infos
 
 def fetchPly(path):
-    plydata = PlyData.read(path)
-    vertices = plydata['vertex']
-    positions = np.vstack([vertices['x'], vertices['y'], vertices['z']]).T
-    colors = np.vstack([vertices['red'], vertices['green'], vertices['blue']]).T / 255.0
-    normals = np.vstack([vertices['nx'], vertices['ny'], vertices['nz']]).T
+    vertices = read_ply_vertices(path)
+    positions = ply_columns(vertices, ['x', 'y', 'z'])
+    colors = ply_columns(vertices, ['red', 'green', 'blue'], dtype=np.float64) / 255.0
+    normals = ply_columns(vertices, ['nx', 'ny', 'nz'])
     return BasicPointCloud(points=positions, colors=colors, normals=normals)
 
 def storePly(path, xyz, rgb):
@@ -130,23 +129,21 @@ def storePly(path, xyz, rgb):
     dtype = [('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
             ('nx', 'f4'), ('ny', 'f4'), ('nz', 'f4'),
             ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
-    
-    normals = np.zeros_like(xyz)
 
-    elements = np.empty(xyz.shape[0], dtype=dtype)
-    attributes = np.concatenate((xyz, normals, rgb), axis=1)
-    elements[:] = list(map(tuple, attributes))
+    elements = np.zeros(xyz.shape[0], dtype=dtype)
+    for idx, name in enumerate(['x', 'y', 'z']):
+        elements[name] = xyz[:, idx]
+    for idx, name in enumerate(['red', 'green', 'blue']):
+        elements[name] = rgb[:, idx]
 
-    # Create the PlyData object and write to file
-    vertex_element = PlyElement.describe(elements, 'vertex')
-    ply_data = PlyData([vertex_element])
-    ply_data.write(path)
+    write_ply_vertices(path, elements)
 
 def readColmapSceneInfo(path, images, depths, eval, train_test_exp, llffhold=8):
     try:
         cameras_extrinsic_file = os.path.join(path, "sparse/0", "images.bin")
         cameras_intrinsic_file = os.path.join(path, "sparse/0", "cameras.bin")
-        cam_extrinsics = read_extrinsics_binary(cameras_extrinsic_file)
+        # Only poses are used, 2D observations are skipped
+        cam_extrinsics = read_extrinsics_binary(cameras_extrinsic_file, read_points2D=False)
         cam_intrinsics = read_intrinsics_binary(cameras_intrinsic_file)
     except:
         cameras_extrinsic_file = os.path.join(path, "sparse/0", "images.txt")
@@ -233,40 +230,38 @@ def readCamerasFromTransforms(path, transformsfile, depths_folder, white_backgro
         fovx = contents["camera_angle_x"]
 
         frames = contents["frames"]
-        for idx, frame in enumerate(frames):
-            cam_name = os.path.join(path, frame["file_path"] + extension)
+        if len(frames) == 0:
+            return cam_infos
 
-            # NeRF 'transform_matrix' is a camera-to-world transform
-            c2w = np.array(frame["transform_matrix"])
-            # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
-            c2w[:3, 1:3] *= -1
+        # NeRF 'transform_matrix' is a camera-to-world transform
+        c2w = np.array([frame["transform_matrix"] for frame in frames], dtype=np.float64)
+        # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
+        c2w[:, :3, 1:3] *= -1
 
-            # get the world-to-camera transform and set R, T
-            w2c = np.linalg.inv(c2w)
-            R = np.transpose(w2c[:3,:3])  # R is stored transposed due to 'glm' in CUDA code
-            T = w2c[:3, 3]
+        # get the world-to-camera transforms and set R, T
+        w2c = np.linalg.inv(c2w)
+        Rs = np.transpose(w2c[:, :3, :3], (0, 2, 1))  # R is stored transposed due to 'glm' in CUDA code
+        Ts = w2c[:, :3, 3]
 
+        for idx, frame in enumerate(frames):
+            cam_name = os.path.join(path, frame["file_path"] + extension)
             image_path = os.path.join(path, cam_name)
             image_name = Path(cam_name).stem
-            image = Image.open(image_path)
 
-            im_data = np.array(image.convert("RGBA"))
+            # Only the header is read here. The image is decoded once when its camera is loaded, where
+            # its alpha channel becomes the camera's alpha mask (see image_data_from_arrays)
+            with Image.open(image_path) as image:
+                width, height = image.size
 
-            bg = np.array([1,1,1]) if white_background else np.array([0, 0, 0])
-
-            norm_data = im_data / 255.0
-            arr = norm_data[:,:,:3] * norm_data[:, :, 3:4] + bg * (1 - norm_data[:, :, 3:4])
-            image = Image.fromarray(np.array(arr*255.0, dtype=np.byte), "RGB")
-
-            fovy = focal2fov(fov2focal(fovx, image.size[0]), image.size[1])
+            fovy = focal2fov(fov2focal(fovx, width), height)
             FovY = fovy 
             FovX = fovx
 
             depth_path = os.path.join(depths_folder, f"{image_name}.png") if depths_folder != "" else ""
 
-            cam_infos.append(CameraInfo(uid=idx, R=R, T=T, FovY=FovY, FovX=FovX,
+            cam_infos.append(CameraInfo(uid=idx, R=Rs[idx], T=Ts[idx], FovY=FovY, FovX=FovX,
                             image_path=image_path, image_name=image_name,
-                            width=image.size[0], height=image.size[1], depth_path=depth_path, depth_params=None, is_test=is_test))
+                            width=width, height=height, depth_path=depth_path, depth_params=None, is_test=is_test))
             
     return cam_infos
 
@@ -309,7 +304,33 @@ def readNerfSyntheticInfo(path, white_background, depths, eval, extension=".png"
                            is_nerf_synthetic=True)
     return scene_info
 
+def colmapSourceFiles(path, images, depths, eval, train_test_exp, llffhold=8):
+    """ Where the scene info cache of readColmapSceneInfo lives, and the files it reads """
+    sparse_path = os.path.join(path, "sparse/0")
+    source_files = [os.path.join(sparse_path, name) for name in
+                    ["images.bin", "cameras.bin", "images.txt", "cameras.txt", "test.txt",
+                     "points3D.ply", "points3D.bin", "points3D.txt"]]
+    if depths != "":
+        source_files.append(os.path.join(sparse_path, "depth_params.json"))
+    return os.path.join(sparse_path, "scene_info_cache.npz"), source_files
+
+def nerfSyntheticSourceFiles(path, white_background, depths, eval, extension=".png"):
+    """ Where the scene info cache of readNerfSyntheticInfo lives, and the files it reads """
+    source_files = [os.path.join(path, "points3d.ply")]
+    for transformsfile in ["transforms_train.json", "transforms_test.json"]:
+        source_files.append(os.path.join(path, transformsfile))
+        with open(os.path.join(path, transformsfile)) as json_file:
+            frames = json.load(json_file)["frames"]
+        # Image sizes are read from the image headers
+        source_files.extend(os.path.join(path, frame["file_path"] + extension) for frame in frames)
+    return os.path.join(path, "scene_info_cache.npz"), source_files
+
 sceneLoadTypeCallbacks = {
     "Colmap": readColmapSceneInfo,
     "Blender" : readNerfSyntheticInfo
-}
\ No newline at end of file
+}
+
+sceneSourceFiles = {
+    "Colmap": colmapSourceFiles,
+    "Blender" : nerfSyntheticSourceFiles
+}
@@ -11,15 +11,19 @@
 
 import torch
 import numpy as np
-from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation
+from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation, morton_codes
 from torch import nn
 import os
 import json
 from utils.system_utils import mkdir_p
-from plyfile import PlyData, PlyElement
+from utils.ply_utils import read_ply_vertices, write_ply_vertices, ply_columns, sorted_property_names
+from utils.compact_utils import write_compact, CompactReader, quantize_uint8, kmeans
 from utils.sh_utils import RGB2SH
-from simple_knn._C import distCUDA2
-from utils.graphics_utils import BasicPointCloud
+try:
+    from simple_knn._C import distCUDA2
+except ImportError:
+    distCUDA2 = None
+from utils.graphics_utils import BasicPointCloud, knn_mean_dist2
 from utils.general_utils import strip_symmetric, build_scaling_rotation
 
 try:
@@ -47,7 +51,8 @@ class GaussianModel:
         self.rotation_activation = torch.nn.functional.normalize
 
 
-    def __init__(self, sh_degree, optimizer_type="default"):
+    def __init__(self, sh_degree, optimizer_type="default", device="cuda"):
+        self.device = torch.device(device)
         self.active_sh_degree = 0
         self.optimizer_type = optimizer_type
         self.max_sh_degree = sh_degree  
@@ -99,6 +104,18 @@ class GaussianModel:
         self.denom = denom
         self.optimizer.load_state_dict(opt_dict)
 
+    def capture_exposure(self):
+        return (
+            self._exposure,
+            self.exposure_optimizer.state_dict(),
+        )
+
+    def restore_exposure(self, exposure_args):
+        (exposure, opt_dict) = exposure_args
+        with torch.no_grad():
+            self._exposure.copy_(exposure)
+        self.exposure_optimizer.load_state_dict(opt_dict)
+
     @property
     def get_scaling(self):
         return self.scaling_activation(self._scaling)
@@ -148,20 +165,22 @@ class GaussianModel:
 
     def create_from_pcd(self, pcd : BasicPointCloud, cam_infos : int, spatial_lr_scale : float):
         self.spatial_lr_scale = spatial_lr_scale
-        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().cuda()
-        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().cuda())
-        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().cuda()
+        fused_point_cloud = torch.tensor(np.asarray(pcd.points)).float().to(self.device)
+        fused_color = RGB2SH(torch.tensor(np.asarray(pcd.colors)).float().to(self.device))
+        features = torch.zeros((fused_color.shape[0], 3, (self.max_sh_degree + 1) ** 2)).float().to(self.device)
         features[:, :3, 0 ] = fused_color
         features[:, 3:, 1:] = 0.0
 
         print("Number of points at initialisation : ", fused_point_cloud.shape[0])
 
-        dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(pcd.points)).float().cuda()), 0.0000001)
+        points = torch.from_numpy(np.asarray(pcd.points)).float().to(self.device)
+        # Same initial scales without the CUDA extension or off the GPU
+        dist2 = torch.clamp_min(distCUDA2(points) if distCUDA2 is not None and points.is_cuda else knn_mean_dist2(points), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
-        rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
+        rots = torch.zeros((fused_point_cloud.shape[0], 4), device=self.device)
         rots[:, 0] = 1
 
-        opacities = self.inverse_opacity_activation(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device="cuda"))
+        opacities = self.inverse_opacity_activation(0.1 * torch.ones((fused_point_cloud.shape[0], 1), dtype=torch.float, device=self.device))
 
         self._xyz = nn.Parameter(fused_point_cloud.requires_grad_(False))
         self._features_dc = nn.Parameter(features[:,:,0:1].transpose(1, 2).contiguous().requires_grad_(True))
@@ -169,16 +188,16 @@ class GaussianModel:
         self._scaling = nn.Parameter(scales.requires_grad_(True))
         self._rotation = nn.Parameter(rots.requires_grad_(True))
         self._opacity = nn.Parameter(opacities.requires_grad_(True))
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
         self.exposure_mapping = {cam_info.image_name: idx for idx, cam_info in enumerate(cam_infos)}
         self.pretrained_exposures = None
-        exposure = torch.eye(3, 4, device="cuda")[None].repeat(len(cam_infos), 1, 1)
+        exposure = torch.eye(3, 4, device=self.device)[None].repeat(len(cam_infos), 1, 1)
         self._exposure = nn.Parameter(exposure.requires_grad_(True))
 
     def training_setup(self, training_args):
         self.percent_dense = training_args.percent_dense
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
 
         l = [
             {'params': [self._xyz], 'lr': training_args.position_lr_init * self.spatial_lr_scale, "name": "xyz"},
@@ -236,82 +255,172 @@ class GaussianModel:
             l.append('rot_{}'.format(i))
         return l
 
-    def save_ply(self, path):
-        mkdir_p(os.path.dirname(path))
+    def construct_vertex_array(self):
+        xyz = self._xyz.detach()
+        normals = torch.zeros_like(xyz)
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1)
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1)
+        opacities = self._opacity.detach()
+        scale = self._scaling.detach()
+        rotation = self._rotation.detach()
 
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
+        dtype_full = np.dtype([(attribute, '<f4') for attribute in self.construct_list_of_attributes()])
 
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
+        # Concatenate on the device and reinterpret the float32 rows as PLY records, no per-row copies
+        attributes = torch.cat((xyz, normals, f_dc, f_rest, opacities, scale, rotation), dim=1).float().contiguous().cpu().numpy()
+        return attributes.view(dtype_full).reshape(-1)
 
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
+    def save_ply(self, path):
+        mkdir_p(os.path.dirname(path))
+        # Write next to the destination and rename once complete, so readers never see a partial file
+        write_ply_vertices(path + ".tmp", self.construct_vertex_array())
+        os.replace(path + ".tmp", path)
+
+    def snapshot(self):
+        """
+        Detached device-side copy of the model parameters and exposures, unaffected
+        by later optimizer steps. Enough to call save_ply on from another thread.
+        """
+        snapshot = GaussianModel(self.max_sh_degree, self.optimizer_type, self.device)
+        snapshot.active_sh_degree = self.active_sh_degree
+        snapshot._xyz = self._xyz.detach().clone()
+        snapshot._features_dc = self._features_dc.detach().clone()
+        snapshot._features_rest = self._features_rest.detach().clone()
+        snapshot._opacity = self._opacity.detach().clone()
+        snapshot._scaling = self._scaling.detach().clone()
+        snapshot._rotation = self._rotation.detach().clone()
+        snapshot.exposure_mapping = self.exposure_mapping
+        snapshot.pretrained_exposures = self.pretrained_exposures
+        snapshot._exposure = self._exposure.detach().clone()
+        return snapshot
 
     def reset_opacity(self):
         opacities_new = self.inverse_opacity_activation(torch.min(self.get_opacity, torch.ones_like(self.get_opacity)*0.01))
         optimizable_tensors = self.replace_tensor_to_optimizer(opacities_new, "opacity")
         self._opacity = optimizable_tensors["opacity"]
 
+    def load_pretrained_exposures(self, path):
+        exposure_file = os.path.join(os.path.dirname(path), os.pardir, os.pardir, "exposure.json")
+        if os.path.exists(exposure_file):
+            with open(exposure_file, "r") as f:
+                exposures = json.load(f)
+            self.pretrained_exposures = {image_name: torch.FloatTensor(exposures[image_name]).requires_grad_(False).to(self.device) for image_name in exposures}
+            print(f"Pretrained exposures loaded.")
+        else:
+            print(f"No exposure to be loaded at {exposure_file}")
+            self.pretrained_exposures = None
+
     def load_ply(self, path, use_train_test_exp = False):
-        plydata = PlyData.read(path)
+        vertices = read_ply_vertices(path)
         if use_train_test_exp:
-            exposure_file = os.path.join(os.path.dirname(path), os.pardir, os.pardir, "exposure.json")
-            if os.path.exists(exposure_file):
-                with open(exposure_file, "r") as f:
-                    exposures = json.load(f)
-                self.pretrained_exposures = {image_name: torch.FloatTensor(exposures[image_name]).requires_grad_(False).cuda() for image_name in exposures}
-                print(f"Pretrained exposures loaded.")
+            self.load_pretrained_exposures(path)
+
+        self.load_vertex_array(vertices)
+
+        self.active_sh_degree = self.max_sh_degree
+
+    def save_compact(self, path, xyz_dtype="float32", attribute_bits=16, sh_codebook_size=4096, kmeans_iters=10):
+        """
+        Save a quantized model: xyz as float32/float16, opacity/scaling/rotation as
+        float16 or 8 bits per channel, DC colour as float16 and the higher-order SH
+        coefficients through a k-means codebook with one index per Gaussian.
+        """
+        mkdir_p(os.path.dirname(path))
+
+        xyz = self._xyz.detach().cpu().numpy().astype(xyz_dtype)
+        f_dc = self._features_dc.detach().flatten(start_dim=1).cpu().numpy()
+        opacities = self.get_opacity.detach().cpu().numpy()
+        scale = self._scaling.detach().cpu().numpy()
+        rotation = self.get_rotation.detach().cpu().numpy()
+
+        sections = {
+            "xyz": (xyz, {}),
+            "f_dc": (f_dc.astype(np.float16), {}),
+        }
+        for name, attribute in (("opacity", opacities), ("scaling", scale), ("rotation", rotation)):
+            if attribute_bits == 8:
+                sections[name] = quantize_uint8(attribute)
             else:
-                print(f"No exposure to be loaded at {exposure_file}")
-                self.pretrained_exposures = None
+                sections[name] = (attribute.astype(np.float16), {})
+
+        if self.max_sh_degree > 0:
+            f_rest = self._features_rest.detach().flatten(start_dim=1)
+            codebook, indices = kmeans(f_rest, sh_codebook_size, kmeans_iters)
+            index_dtype = np.uint16 if codebook.shape[0] <= 2**16 else np.uint32
+            sections["f_rest_codebook"] = (codebook.cpu().numpy().astype(np.float16), {})
+            sections["f_rest_indices"] = (indices.cpu().numpy().astype(index_dtype), {})
+
+        write_compact(path, sections, {"num_points": xyz.shape[0], "sh_degree": self.max_sh_degree})
+
+    def load_compact(self, path, use_train_test_exp = False, attributes = None):
+        """
+        Load a model written by save_compact. Only the sections needed for the
+        requested attributes (subset of xyz, f_dc, f_rest, opacity, scaling, rotation)
+        are read; the others get neutral defaults, e.g. attributes=("xyz", "f_dc",
+        "opacity", "scaling", "rotation") loads a DC-colour-only model.
+        """
+        reader = CompactReader(path)
+        if use_train_test_exp:
+            self.load_pretrained_exposures(path)
+        if attributes is None:
+            attributes = ("xyz", "f_dc", "f_rest", "opacity", "scaling", "rotation")
+
+        num_points = reader.meta["num_points"]
+        n_rest = (self.max_sh_degree + 1) ** 2 - 1
+        assert reader.meta["sh_degree"] == self.max_sh_degree or "f_rest" not in attributes
+
+        xyz = reader.read_decoded("xyz")
+        features_dc = np.zeros((num_points, 3), dtype=np.float32)
+        if "f_dc" in attributes:
+            features_dc = reader.read_decoded("f_dc")
+        features_extra = np.zeros((num_points, 3 * n_rest), dtype=np.float32)
+        if "f_rest" in attributes and "f_rest_codebook" in reader:
+            codebook = reader.read_decoded("f_rest_codebook")
+            features_extra = codebook[np.asarray(reader.read("f_rest_indices"), dtype=np.int64)]
+        opacities = np.ones((num_points, 1), dtype=np.float32)
+        if "opacity" in attributes:
+            opacities = reader.read_decoded("opacity")
+        scales = np.full((num_points, 3), 0.01, dtype=np.float32)
+        if "scaling" in attributes:
+            scales = reader.read_decoded("scaling")
+        else:
+            scales = np.log(scales)
+        rots = np.zeros((num_points, 4), dtype=np.float32)
+        rots[:, 0] = 1
+        if "rotation" in attributes:
+            rots = reader.read_decoded("rotation")
+
+        opacities = torch.from_numpy(opacities).to(self.device).clamp(1 / 510, 1 - 1 / 510)
+        self._xyz = nn.Parameter(torch.from_numpy(xyz).to(self.device).requires_grad_(False))
+        self._features_dc = nn.Parameter(torch.from_numpy(features_dc).to(self.device).view(num_points, 1, 3).contiguous().requires_grad_(True))
+        self._features_rest = nn.Parameter(torch.from_numpy(features_extra).to(self.device).view(num_points, n_rest, 3).contiguous().requires_grad_(True))
+        self._opacity = nn.Parameter(self.inverse_opacity_activation(opacities).requires_grad_(True))
+        self._scaling = nn.Parameter(torch.from_numpy(scales).to(self.device).requires_grad_(True))
+        self._rotation = nn.Parameter(torch.from_numpy(rots).to(self.device).requires_grad_(True))
 
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+        self.active_sh_degree = self.max_sh_degree if "f_rest" in attributes else 0
 
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
+    def load_vertex_array(self, vertices):
+        xyz = ply_columns(vertices, ["x", "y", "z"])
+        opacities = ply_columns(vertices, ["opacity"])
 
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
-        extra_f_names = sorted(extra_f_names, key = lambda x: int(x.split('_')[-1]))
+        features_dc = ply_columns(vertices, ["f_dc_0", "f_dc_1", "f_dc_2"]).reshape((xyz.shape[0], 3, 1))
+
+        extra_f_names = sorted_property_names(vertices, "f_rest_")
         assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        features_extra = ply_columns(vertices, extra_f_names)
         # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
         features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
 
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(False))
-        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
+        scales = ply_columns(vertices, sorted_property_names(vertices, "scale_"))
+        rots = ply_columns(vertices, sorted_property_names(vertices, "rot"))
 
-        self.active_sh_degree = self.max_sh_degree
+        self._xyz = nn.Parameter(torch.from_numpy(xyz).to(self.device).requires_grad_(False))
+        self._features_dc = nn.Parameter(torch.from_numpy(features_dc).to(self.device).transpose(1, 2).contiguous().requires_grad_(True))
+        self._features_rest = nn.Parameter(torch.from_numpy(features_extra).to(self.device).transpose(1, 2).contiguous().requires_grad_(True))
+        self._opacity = nn.Parameter(torch.from_numpy(opacities).to(self.device).requires_grad_(True))
+        self._scaling = nn.Parameter(torch.from_numpy(scales).to(self.device).requires_grad_(True))
+        self._rotation = nn.Parameter(torch.from_numpy(rots).to(self.device).requires_grad_(True))
 
     def replace_tensor_to_optimizer(self, tensor, name):
         optimizable_tensors = {}
@@ -363,6 +472,32 @@ class GaussianModel:
         self.max_radii2D = self.max_radii2D[valid_points_mask]
         self.tmp_radii = self.tmp_radii[valid_points_mask]
 
+    def reorder_points(self, order):
+        """ Permute all per-Gaussian tensors, their pending gradients and Adam moments by an index tensor """
+        grads = {group["name"]: group["params"][0].grad for group in self.optimizer.param_groups}
+        optimizable_tensors = self._prune_optimizer(order)
+        for name, grad in grads.items():
+            if grad is not None:
+                optimizable_tensors[name].grad = grad[order]
+
+        self._xyz = optimizable_tensors["xyz"]
+        self._features_dc = optimizable_tensors["f_dc"]
+        self._features_rest = optimizable_tensors["f_rest"]
+        self._opacity = optimizable_tensors["opacity"]
+        self._scaling = optimizable_tensors["scaling"]
+        self._rotation = optimizable_tensors["rotation"]
+
+        self.xyz_gradient_accum = self.xyz_gradient_accum[order]
+        self.denom = self.denom[order]
+        self.max_radii2D = self.max_radii2D[order]
+        if getattr(self, "tmp_radii", None) is not None:
+            self.tmp_radii = self.tmp_radii[order]
+
+    def sort_by_morton(self):
+        # Neighbouring Gaussians end up in neighbouring memory, which helps rasterizer
+        # cache locality and makes saved attributes more compressible
+        self.reorder_points(torch.argsort(morton_codes(self.get_xyz.detach())))
+
     def cat_tensors_to_optimizer(self, tensors_dict):
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
@@ -402,21 +537,21 @@ class GaussianModel:
         self._rotation = optimizable_tensors["rotation"]
 
         self.tmp_radii = torch.cat((self.tmp_radii, new_tmp_radii))
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=self.device)
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=self.device)
 
     def densify_and_split(self, grads, grad_threshold, scene_extent, N=2):
         n_init_points = self.get_xyz.shape[0]
         # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((n_init_points), device="cuda")
+        padded_grad = torch.zeros((n_init_points), device=self.device)
         padded_grad[:grads.shape[0]] = grads.squeeze()
         selected_pts_mask = torch.where(padded_grad >= grad_threshold, True, False)
         selected_pts_mask = torch.logical_and(selected_pts_mask,
                                               torch.max(self.get_scaling, dim=1).values > self.percent_dense*scene_extent)
 
         stds = self.get_scaling[selected_pts_mask].repeat(N,1)
-        means =torch.zeros((stds.size(0), 3),device="cuda")
+        means =torch.zeros((stds.size(0), 3),device=self.device)
         samples = torch.normal(mean=means, std=stds)
         rots = build_rotation(self._rotation[selected_pts_mask]).repeat(N,1,1)
         new_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[selected_pts_mask].repeat(N, 1)
@@ -429,7 +564,7 @@ class GaussianModel:
 
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacity, new_scaling, new_rotation, new_tmp_radii)
 
-        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device="cuda", dtype=bool)))
+        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device=self.device, dtype=bool)))
         self.prune_points(prune_filter)
 
     def densify_and_clone(self, grads, grad_threshold, scene_extent):
@@ -468,6 +603,12 @@ class GaussianModel:
 
         torch.cuda.empty_cache()
 
-    def add_densification_stats(self, viewspace_point_tensor, update_filter):
+    def add_densification_stats(self, viewspace_point_tensor, update_filter, dense=False):
+        if dense:
+            # Masked update of every point instead of boolean indexing, which waits for the GPU to count the selection
+            update_mask = update_filter.view(-1, 1)
+            self.xyz_gradient_accum += torch.norm(viewspace_point_tensor.grad[:,:2], dim=-1, keepdim=True) * update_mask
+            self.denom += update_mask
+            return
         self.xyz_gradient_accum[update_filter] += torch.norm(viewspace_point_tensor.grad[update_filter,:2], dim=-1, keepdim=True)
         self.denom[update_filter] += 1
@@ -0,0 +1,60 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import threading
+import torch
+from collections import OrderedDict
+
+def _nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return 0
+
+class ImageStore:
+    """
+    Least-recently-used cache of decoded camera images bounded by a byte budget.
+    Entries that fall out of the cache are dropped and decoded again from disk
+    the next time they are requested.
+    """
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+
+        # Decode outside the lock so other threads can keep hitting the cache
+        value = loader()
+        nbytes = _nbytes(value)
+        with self.lock:
+            if key not in self.entries and nbytes <= self.budget_bytes:
+                self.entries[key] = (value, nbytes)
+                self.size_bytes += nbytes
+                while self.size_bytes > self.budget_bytes:
+                    _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                    self.size_bytes -= evicted_bytes
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_bytes = 0
@@ -0,0 +1,129 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import json
+import numpy as np
+from scene.dataset_readers import CameraInfo, SceneInfo, sceneLoadTypeCallbacks, sceneSourceFiles
+from scene.gaussian_model import BasicPointCloud
+
+# A scene info cache is a single uncompressed .npz file next to the scene's source
+# files: the cameras of both splits as stacked arrays, the point cloud as raw
+# float32 / uint8 arrays and the key it was written for. The key covers the
+# reader arguments and the size and mtime of every source file the reader uses.
+SCENE_INFO_CACHE_VERSION = 1
+
+def _file_stat(path):
+    if not os.path.exists(path):
+        return [os.path.abspath(path), None, None]
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def scene_info_cache_key(scene_type, reader_args, source_files):
+    return json.dumps({
+        "version": SCENE_INFO_CACHE_VERSION,
+        "scene_type": scene_type,
+        "reader_args": list(reader_args),
+        "files": [_file_stat(path) for path in source_files],
+    }, sort_keys=True)
+
+def _camera_arrays(cam_infos, prefix):
+    return {
+        prefix + "uid": np.array([c.uid for c in cam_infos], dtype=np.int64),
+        prefix + "R": np.array([c.R for c in cam_infos], dtype=np.float64).reshape(-1, 3, 3),
+        prefix + "T": np.array([c.T for c in cam_infos], dtype=np.float64).reshape(-1, 3),
+        prefix + "FovY": np.array([c.FovY for c in cam_infos], dtype=np.float64),
+        prefix + "FovX": np.array([c.FovX for c in cam_infos], dtype=np.float64),
+        prefix + "width": np.array([c.width for c in cam_infos], dtype=np.int64),
+        prefix + "height": np.array([c.height for c in cam_infos], dtype=np.int64),
+        prefix + "is_test": np.array([c.is_test for c in cam_infos], dtype=bool),
+        prefix + "image_path": np.array([c.image_path for c in cam_infos], dtype=str),
+        prefix + "image_name": np.array([c.image_name for c in cam_infos], dtype=str),
+        prefix + "depth_path": np.array([c.depth_path for c in cam_infos], dtype=str),
+        prefix + "depth_params": np.array(json.dumps([c.depth_params for c in cam_infos])),
+    }
+
+def _camera_infos(arrays, prefix):
+    # Every access to an npz member reads it again, so read each one once
+    fields = {name[len(prefix):]: arrays[name] for name in arrays.files if name.startswith(prefix)}
+    depth_params = json.loads(str(fields["depth_params"]))
+    return [CameraInfo(uid=int(fields["uid"][idx]), R=fields["R"][idx], T=fields["T"][idx],
+                       FovY=float(fields["FovY"][idx]), FovX=float(fields["FovX"][idx]),
+                       depth_params=depth_params[idx], image_path=str(fields["image_path"][idx]),
+                       image_name=str(fields["image_name"][idx]), depth_path=str(fields["depth_path"][idx]),
+                       width=int(fields["width"][idx]), height=int(fields["height"][idx]),
+                       is_test=bool(fields["is_test"][idx]))
+            for idx in range(len(depth_params))]
+
+def write_scene_info_cache(path, key, scene_info):
+    arrays = {"key": np.array(key)}
+    arrays.update(_camera_arrays(scene_info.train_cameras, "train_"))
+    arrays.update(_camera_arrays(scene_info.test_cameras, "test_"))
+    arrays["translate"] = np.asarray(scene_info.nerf_normalization["translate"], dtype=np.float64)
+    arrays["radius"] = np.array(scene_info.nerf_normalization["radius"], dtype=np.float64)
+    arrays["ply_path"] = np.array(scene_info.ply_path)
+    arrays["is_nerf_synthetic"] = np.array(scene_info.is_nerf_synthetic)
+
+    pcd = scene_info.point_cloud
+    if pcd is not None:
+        arrays["points"] = np.asarray(pcd.points)
+        arrays["normals"] = np.asarray(pcd.normals)
+        # Colors come from 8 bit PLY colors divided by 255, store them as such when that is exact
+        colors = np.asarray(pcd.colors)
+        colors_u8 = np.clip(np.round(colors * 255.0), 0, 255).astype(np.uint8)
+        arrays["colors"] = colors_u8 if np.array_equal(colors_u8.astype(np.float64) / 255.0, colors) else colors
+
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def read_scene_info_cache(path, key):
+    """ The SceneInfo cached at path if it was written for key, else None """
+    if not os.path.isfile(path):
+        return None
+    with np.load(path, allow_pickle=False) as arrays:
+        if str(arrays["key"]) != key:
+            return None
+        pcd = None
+        if "points" in arrays:
+            colors = arrays["colors"]
+            if colors.dtype == np.uint8:
+                colors = colors.astype(np.float64) / 255.0
+            pcd = BasicPointCloud(points=arrays["points"], colors=colors, normals=arrays["normals"])
+        return SceneInfo(point_cloud=pcd,
+                         train_cameras=_camera_infos(arrays, "train_"),
+                         test_cameras=_camera_infos(arrays, "test_"),
+                         nerf_normalization={"translate": arrays["translate"], "radius": float(arrays["radius"])},
+                         ply_path=str(arrays["ply_path"]),
+                         is_nerf_synthetic=bool(arrays["is_nerf_synthetic"]))
+
+def read_scene_info(scene_type, reader_args, use_cache=False):
+    """
+    sceneLoadTypeCallbacks[scene_type](*reader_args), served from the scene info cache
+    when use_cache is set and the cache matches the arguments and source files.
+    """
+    if not use_cache:
+        return sceneLoadTypeCallbacks[scene_type](*reader_args)
+
+    cache_path, source_files = sceneSourceFiles[scene_type](*reader_args)
+    scene_info = read_scene_info_cache(cache_path, scene_info_cache_key(scene_type, reader_args, source_files))
+    if scene_info is not None:
+        print("Loaded scene info from cache {}".format(cache_path))
+        return scene_info
+
+    scene_info = sceneLoadTypeCallbacks[scene_type](*reader_args)
+    # Readers may create source files (points3D.ply), so the key is taken after reading
+    try:
+        write_scene_info_cache(cache_path, scene_info_cache_key(scene_type, reader_args, source_files), scene_info)
+    except OSError as e:
+        print("[ WARNING ] Could not write scene info cache {}: {}".format(cache_path, e))
+    return scene_info
@@ -0,0 +1,129 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import json
+import torch
+import numpy as np
+from utils.system_utils import mkdir_p
+from scene.gaussian_model import GaussianModel
+
+# A tiled export is a directory with tiles.bin and index.json. tiles.bin holds
+# PLY vertex records (same properties as point_cloud.ply) grouped level-major:
+# all tiles of level 0, then all tiles of level 1, ... so a prefix of the file is
+# a coarse version of the whole scene. Inside a tile, Gaussians are sorted by
+# decreasing importance and level l holds twice as many Gaussians as level l-1.
+# index.json gives the byte range of every (tile, level) chunk.
+TILES_DATA_NAME = "tiles.bin"
+TILES_INDEX_NAME = "index.json"
+
+def gaussian_importance(gaussians : GaussianModel):
+    # View-independent stand-in for opacity x projected size: opacity x world-space footprint area
+    area = torch.prod(gaussians.get_scaling, dim=1) ** (2.0 / 3.0)
+    return (gaussians.get_opacity.squeeze(-1) * area).detach().cpu().numpy()
+
+def level_boundaries(count, num_levels):
+    # Level sizes double: level l ends at count * (2^(l+1) - 1) / (2^num_levels - 1)
+    ends = [int(np.ceil(count * (2 ** (l + 1) - 1) / (2 ** num_levels - 1))) for l in range(num_levels)]
+    return [0] + ends
+
+def export_tiles(gaussians : GaussianModel, path, grid_size=8, num_levels=4):
+    mkdir_p(path)
+    vertices = gaussians.construct_vertex_array()
+    xyz = gaussians.get_xyz.detach().cpu().numpy()
+    importance = gaussian_importance(gaussians)
+
+    # Grid over the bulk of the scene; far-away background Gaussians are clamped into the border tiles
+    lo = np.quantile(xyz, 0.01, axis=0) if xyz.shape[0] else np.zeros(3)
+    hi = np.quantile(xyz, 0.99, axis=0) if xyz.shape[0] else np.ones(3)
+    cells = np.clip(np.floor((xyz - lo) / np.maximum(hi - lo, 1e-9) * grid_size), 0, grid_size - 1).astype(np.int64)
+    tile_ids = cells[:, 0] + grid_size * (cells[:, 1] + grid_size * cells[:, 2])
+
+    order = np.lexsort((-importance, tile_ids))
+    sorted_ids = tile_ids[order]
+    unique_ids, starts, counts = np.unique(sorted_ids, return_index=True, return_counts=True)
+
+    tiles = []
+    for tile_id, start, count in zip(unique_ids, starts, counts):
+        tile_xyz = xyz[order[start:start + count]]
+        tiles.append({
+            "id": int(tile_id),
+            "cell": [int(tile_id % grid_size), int(tile_id // grid_size % grid_size), int(tile_id // grid_size ** 2)],
+            "bounds": [tile_xyz.min(axis=0).tolist(), tile_xyz.max(axis=0).tolist()],
+            "levels": [],
+        })
+
+    record_size = vertices.dtype.itemsize
+    offset = 0
+    with open(os.path.join(path, TILES_DATA_NAME), "wb") as fid:
+        for level in range(num_levels):
+            for tile, start, count in zip(tiles, starts, counts):
+                bounds = level_boundaries(count, num_levels)
+                chunk = order[start + bounds[level]:start + bounds[level + 1]]
+                vertices[chunk].tofile(fid)
+                tile["levels"].append({"offset": offset, "count": int(chunk.shape[0])})
+                offset += chunk.shape[0] * record_size
+
+    index = {
+        "properties": list(vertices.dtype.names),
+        "record_size": record_size,
+        "sh_degree": gaussians.max_sh_degree,
+        "grid_size": grid_size,
+        "num_levels": num_levels,
+        "grid_bounds": [lo.tolist(), hi.tolist()],
+        "tiles": tiles,
+    }
+    with open(os.path.join(path, TILES_INDEX_NAME), "w") as f:
+        json.dump(index, f)
+    return index
+
+def read_tile_index(path):
+    with open(os.path.join(path, TILES_INDEX_NAME), "r") as f:
+        return json.load(f)
+
+def visible_tiles(index, viewpoint_camera):
+    """ Ids of the tiles whose bounding box intersects the view frustum """
+    full_proj = viewpoint_camera.full_proj_transform.detach().cpu().numpy()
+    visible = []
+    for tile in index["tiles"]:
+        lo, hi = tile["bounds"]
+        corners = np.array([[x, y, z, 1.0] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+        clip = corners @ full_proj
+        w = clip[:, 3]
+        outside = [clip[:, 0] < -w, clip[:, 0] > w, clip[:, 1] < -w, clip[:, 1] > w, clip[:, 2] < 0, clip[:, 2] > w]
+        if not any(plane.all() for plane in outside):
+            visible.append(tile["id"])
+    return visible
+
+def load_tiles(gaussians : GaussianModel, path, tiles=None, max_level=None):
+    """
+    Reconstruct the Gaussians of a tiled export from a subset of tiles (ids, all by
+    default) and levels (0..max_level, all by default).
+    :return: number of bytes of Gaussian records read
+    """
+    index = read_tile_index(path)
+    dtype = np.dtype([(name, '<f4') for name in index["properties"]])
+    data = np.memmap(os.path.join(path, TILES_DATA_NAME), dtype=np.uint8, mode="r")
+    max_level = index["num_levels"] - 1 if max_level is None or max_level < 0 else max_level
+    tiles = None if tiles is None else set(tiles)
+
+    chunks = []
+    for tile in index["tiles"]:
+        if tiles is not None and tile["id"] not in tiles:
+            continue
+        for level in tile["levels"][:max_level + 1]:
+            if level["count"] > 0:
+                chunks.append(data[level["offset"]:level["offset"] + level["count"] * dtype.itemsize].view(dtype))
+    vertices = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+    gaussians.load_vertex_array(vertices)
+    gaussians.active_sh_degree = gaussians.max_sh_degree
+    return vertices.nbytes
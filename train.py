@@ -10,13 +10,19 @@
 #
 
 import os
+import time
 import torch
-from random import randint
 from utils.loss_utils import l1_loss, ssim
-from gaussian_renderer import render, network_gui
+from gaussian_renderer import render, render_batch, network_gui
 import sys
 from scene import Scene, GaussianModel
-from utils.general_utils import safe_state, get_expon_lr_func
+from utils.general_utils import safe_state, get_expon_lr_func, capture_rng_state, restore_rng_state
+from utils.checkpoint_utils import DeltaCheckpointer, load_checkpoint, is_checkpoint_dir
+from utils.snapshot_utils import SnapshotWriter, clone_state
+from utils.prefetch_utils import ViewPrefetcher
+from utils.metrics_utils import DeviceMetricLog
+from utils.sampler_utils import make_sampler
+from functools import partial
 from utils.camera_utils import camera_to_colmap
 import uuid
 from tqdm import tqdm
@@ -45,74 +51,107 @@ except:
     SPARSE_ADAM_AVAILABLE = False
 
 
-def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from):
+def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, async_save=False, snapshot_queue_size=2, checkpoint_keyframe_interval=1, checkpoint_delta="xor"):
 
     if not SPARSE_ADAM_AVAILABLE and opt.optimizer_type == "sparse_adam":
         sys.exit(f"Trying to use sparse adam but it is not installed, please install the correct rasterizer using pip install [3dgs_accel].")
 
     first_iter = 0
     tb_writer = prepare_output_and_logger(dataset)
-    gaussians = GaussianModel(dataset.sh_degree, opt.optimizer_type)
-    scene = Scene(dataset, gaussians)
+    snapshot_writer = SnapshotWriter(snapshot_queue_size, tb_writer) if async_save else None
+    checkpointer = DeltaCheckpointer(checkpoint_keyframe_interval, checkpoint_delta)
+    gaussians = GaussianModel(dataset.sh_degree, opt.optimizer_type, dataset.device)
+    # Coarse-to-fine: levels of a resolution pyramid, each half the resolution of the previous one
+    resolution_scales = [2.0 ** level for level in range(max(opt.coarse_to_fine_levels, 1))]
+    scene = Scene(dataset, gaussians, resolution_scales=resolution_scales)
     gaussians.training_setup(opt)
+    checkpoint_state = None
     if checkpoint:
-        (model_params, first_iter) = torch.load(checkpoint)
-        gaussians.restore(model_params, opt)
+        if is_checkpoint_dir(checkpoint):
+            checkpoint_state = load_checkpoint(checkpoint)
+            first_iter = checkpoint_state["iteration"]
+            gaussians.restore(checkpoint_state["gaussians"], opt)
+            gaussians.restore_exposure(checkpoint_state["exposure"])
+            scene.restore_cameras(checkpoint_state["cameras"])
+        else:
+            (model_params, first_iter) = torch.load(checkpoint)
+            gaussians.restore(model_params, opt)
 
     bg_color = [1, 1, 1] if dataset.white_background else [0, 0, 0]
-    background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+    background = torch.tensor(bg_color, dtype=torch.float32, device=dataset.device)
 
-    iter_start = torch.cuda.Event(enable_timing = True)
-    iter_end = torch.cuda.Event(enable_timing = True)
+    # Losses and iteration times stay on the device and are read back every metrics_interval
+    # iterations with --sync_free, otherwise after every iteration
+    metrics = DeviceMetricLog(["loss", "l1", "depth_loss"], max(opt.metrics_interval, 1) if opt.sync_free else 1, dataset.device)
+    steps_per_sec = 0.0
 
     use_sparse_adam = opt.optimizer_type == "sparse_adam" and SPARSE_ADAM_AVAILABLE 
     depth_l1_weight = get_expon_lr_func(opt.depth_l1_weight_init, opt.depth_l1_weight_final, max_steps=opt.iterations)
 
-    viewpoint_stack = scene.getTrainCameras().copy()
-    viewpoint_indices = list(range(len(viewpoint_stack)))
+    train_cameras = scene.getTrainCameras()
+    sampler = make_sampler(opt, len(train_cameras))
     ema_loss_for_log = 0.0
     ema_Ll1depth_for_log = 0.0
     last_save_name = None
 
-    data_map = { "gs": [], "pose": [] }
-    opt_params = []
-    for i in range(len(viewpoint_stack)):
-        viewpoint_cam = viewpoint_stack[i]
-
+    # Camera roles as sets of uids, for O(1) lookups
+    data_map = { "gs": set(), "pose": set() }
+    for i, viewpoint_cam in enumerate(train_cameras):
         if i % 2 == 0:
-            data_map["gs"].append(viewpoint_cam.uid)
+            data_map["gs"].add(viewpoint_cam.uid)
         else:
-            data_map["pose"].append(viewpoint_cam.uid)
-
-        opt_params.append(
-            {
-                "params": [viewpoint_cam.cam_rot_delta],
-                "lr": 0.001,
-                "name": "rot_{}".format(viewpoint_cam.uid),
-            }
-        )
-        opt_params.append(
-            {
-                "params": [viewpoint_cam.cam_trans_delta],
-                "lr": 0.001,
-                "name": "trans_{}".format(viewpoint_cam.uid),
-            }
-        )
-    pose_optimizer = torch.optim.Adam(opt_params, lr=0.001)
-    pose_opt_iter = len(viewpoint_stack) // 10 * 1000
+            data_map["pose"].add(viewpoint_cam.uid)
+
+    # Poses and their deltas of all training cameras, optimized with one batched Adam
+    pose_store = scene.getTrainPoseStore()
+    pose_opt_iter = len(train_cameras) // 10 * 1000
     print(f"pose_opt_iter: {pose_opt_iter}")
 
+    if checkpoint_state is not None:
+        # Pose optimizer groups follow the train camera order, only restore them if it matches
+        if checkpoint_state["cameras"]["image_names"] != [cam.image_name for cam in scene.getTrainCameras()]:
+            print("[ WARNING ] Train camera order differs from the checkpoint, pose optimizer state not restored")
+        elif "steps" not in checkpoint_state["pose_optimizer"]:
+            print("[ WARNING ] Checkpoint predates the camera pose store, pose optimizer state not restored")
+        else:
+            pose_store.load_optimizer_state_dict(checkpoint_state["pose_optimizer"])
+        if "sampler" in checkpoint_state:
+            sampler.load_state_dict(checkpoint_state["sampler"])
+        else:
+            # Older checkpoints only kept the views left in the current epoch
+            sampler.load_remaining(checkpoint_state["viewpoint_indices"])
+        (ema_loss_for_log, ema_Ll1depth_for_log) = checkpoint_state["ema"]
+        restore_rng_state(checkpoint_state["rng"])
+
+    def train_scale(iteration):
+        # The first coarse_to_fine_until_iter iterations are split evenly over the coarser levels, coarsest first
+        if len(resolution_scales) == 1 or iteration > opt.coarse_to_fine_until_iter:
+            return 1.0
+        coarse_levels = len(resolution_scales) - 1
+        return resolution_scales[coarse_levels - max(iteration - 1, 0) * coarse_levels // opt.coarse_to_fine_until_iter]
+
+    def pick_viewpoint(iteration):
+        vind = sampler.draw()
+        # Same view at the resolution scheduled for this iteration
+        return scene.getTrainCameras(train_scale(iteration))[vind], vind
+
+    prefetcher = ViewPrefetcher(dataset.device, enabled=opt.prefetch_views)
+    next_viewpoints = []
+    # (view index, training loss) of rendered views, fed to loss-aware samplers when metrics are read back
+    view_losses = []
+
     progress_bar = tqdm(range(first_iter, opt.iterations), desc="Training progress")
+    log_start_iter, log_start_time = first_iter, time.time()
     first_iter += 1
     for iteration in range(first_iter, opt.iterations + 1):
-        pose_optimizer.zero_grad(set_to_none = True)
+        pose_store.zero_grad()
 
         if network_gui.conn == None:
             network_gui.try_connect()
         while network_gui.conn != None:
             try:
                 net_image_bytes = None
-                custom_cam, do_training, pipe.convert_SHs_python, pipe.compute_cov3D_python, keep_alive, scaling_modifer = network_gui.receive()
+                custom_cam, do_training, pipe.convert_SHs_python, pipe.compute_cov3D_python, keep_alive, scaling_modifer = network_gui.receive(dataset.device)
                 if custom_cam != None:
                     # net_image = render(custom_cam, gaussians, pipe, background, scaling_modifier=scaling_modifer, use_trained_exp=dataset.train_test_exp, separate_sh=SPARSE_ADAM_AVAILABLE)["render"]
                     net_image = render(custom_cam, gaussians, pipe, background, scaling_modifier=scaling_modifer, use_trained_exp=dataset.train_test_exp)["render"]
@@ -123,7 +162,7 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
             except Exception as e:
                 network_gui.conn = None
 
-        iter_start.record()
+        metrics.start()
 
         gaussians.update_learning_rate(iteration)
 
@@ -131,97 +170,152 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
         if iteration % 1000 == 0:
             gaussians.oneupSHdegree()
 
-        # Pick a random Camera
-        if not viewpoint_stack:
-            viewpoint_stack = scene.getTrainCameras().copy()
-            viewpoint_indices = list(range(len(viewpoint_stack)))
-        rand_idx = randint(0, len(viewpoint_indices) - 1)
-        viewpoint_cam = viewpoint_stack.pop(rand_idx)
-        vind = viewpoint_indices.pop(rand_idx)
+        if len(resolution_scales) > 1 and train_scale(iteration) != train_scale(iteration - 1):
+            print("\n[ITER {}] Training at resolution scale {}".format(iteration, train_scale(iteration)))
+
+        # Pick random Cameras, unless they were already picked and prefetched at the end of the previous iteration
+        viewpoints = next_viewpoints if next_viewpoints else [pick_viewpoint(iteration) for _ in range(opt.batch_size)]
+        next_viewpoints = []
+        viewpoint_cams = [viewpoint_cam for viewpoint_cam, _ in viewpoints]
+        views_data = [prefetcher.get(viewpoint_cam) for viewpoint_cam in viewpoint_cams]
 
         # Render
         if (iteration - 1) == debug_from:
             pipe.debug = True
 
-        bg = torch.rand((3), device="cuda") if opt.random_background else background
-
-        # render_pkg = render(viewpoint_cam, gaussians, pipe, bg, use_trained_exp=dataset.train_test_exp, separate_sh=SPARSE_ADAM_AVAILABLE)
-        render_pkg = render(viewpoint_cam, gaussians, pipe, bg, use_trained_exp=dataset.train_test_exp)
-        image, viewspace_point_tensor, visibility_filter, radii = render_pkg["render"], render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["radii"]
-
-        if viewpoint_cam.alpha_mask is not None:
-            alpha_mask = viewpoint_cam.alpha_mask.cuda()
-            image *= alpha_mask
-
-        # if viewpoint_cam != None and (last_save_name is None or viewpoint_cam.image_name == last_save_name):
-        #     image_cpu = image.detach().cpu().numpy()
-        #     image_cpu = np.clip(image_cpu, 0, 1)
-        #     image_uint8 = (image_cpu * 255).astype(np.uint8)
-            
-        #     image_uint8 = np.transpose(image_uint8, (1, 2, 0))
-        #     image_uint8 = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR)
-        #     last_save_name = viewpoint_cam.image_name
-        #     cv2.imwrite(f"{last_save_name}", image_uint8)
-
-        # Loss
-        gt_image = viewpoint_cam.original_image.cuda()
-        Ll1 = l1_loss(image, gt_image)
-        if FUSED_SSIM_AVAILABLE:
-            ssim_value = fused_ssim(image.unsqueeze(0), gt_image.unsqueeze(0))
-        else:
-            ssim_value = ssim(image, gt_image)
+        bg = torch.rand((3), device=dataset.device) if opt.random_background else background
 
-        loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * (1.0 - ssim_value)
+        # render_pkgs = render_batch(viewpoint_cams, gaussians, pipe, bg, use_trained_exp=dataset.train_test_exp, separate_sh=SPARSE_ADAM_AVAILABLE)
+        render_pkgs = render_batch(viewpoint_cams, gaussians, pipe, bg, use_trained_exp=dataset.train_test_exp)
 
-        # Depth regularization
-        Ll1depth_pure = 0.0
-        if depth_l1_weight(iteration) > 0 and viewpoint_cam.depth_reliable:
-            invDepth = render_pkg["depth"]
-            mono_invdepth = viewpoint_cam.invdepthmap.cuda()
-            depth_mask = viewpoint_cam.depth_mask.cuda()
+        # Loss, summed (not averaged) over the batch so that every view's viewspace gradients
+        # keep the scale of single-view training and the densification thresholds still apply
+        loss = 0.0
+        Ll1 = 0.0
+        Ll1depth = 0.0
+        for (viewpoint_cam, vind), view_data, render_pkg in zip(viewpoints, views_data, render_pkgs):
+            image = render_pkg["render"]
 
-            Ll1depth_pure = torch.abs((invDepth  - mono_invdepth) * depth_mask).mean()
-            Ll1depth = depth_l1_weight(iteration) * Ll1depth_pure 
-            loss += Ll1depth
-            Ll1depth = Ll1depth.item()
-        else:
-            Ll1depth = 0
+            alpha_mask = view_data["alpha_mask"]
+            if alpha_mask is not None:
+                image *= alpha_mask
+
+            # if viewpoint_cam != None and (last_save_name is None or viewpoint_cam.image_name == last_save_name):
+            #     image_cpu = image.detach().cpu().numpy()
+            #     image_cpu = np.clip(image_cpu, 0, 1)
+            #     image_uint8 = (image_cpu * 255).astype(np.uint8)
+                
+            #     image_uint8 = np.transpose(image_uint8, (1, 2, 0))
+            #     image_uint8 = cv2.cvtColor(image_uint8, cv2.COLOR_RGB2BGR)
+            #     last_save_name = viewpoint_cam.image_name
+            #     cv2.imwrite(f"{last_save_name}", image_uint8)
+
+            gt_image = view_data["image"]
+            view_Ll1 = l1_loss(image, gt_image)
+            if FUSED_SSIM_AVAILABLE and image.is_cuda:
+                ssim_value = fused_ssim(image.unsqueeze(0), gt_image.unsqueeze(0))
+            else:
+                ssim_value = ssim(image, gt_image)
+
+            view_loss = (1.0 - opt.lambda_dssim) * view_Ll1 + opt.lambda_dssim * (1.0 - ssim_value)
+            loss = loss + view_loss
+            Ll1 = Ll1 + view_Ll1
+            if sampler.needs_losses:
+                view_losses.append((vind, view_loss.detach()))
+
+            # Depth regularization
+            if depth_l1_weight(iteration) > 0 and viewpoint_cam.depth_reliable:
+                invDepth = render_pkg["depth"]
+                mono_invdepth = view_data["invdepthmap"]
+                depth_mask = view_data["depth_mask"]
+
+                Ll1depth_pure = torch.abs((invDepth  - mono_invdepth) * depth_mask).mean()
+                view_Ll1depth = depth_l1_weight(iteration) * Ll1depth_pure 
+                loss += view_Ll1depth
+                Ll1depth = Ll1depth + view_Ll1depth.detach()
 
         loss.backward()
 
-        iter_end.record()
+        # Losses are reported per view
+        batch_views = len(viewpoint_cams)
+        metrics.push(iteration, loss=loss.detach() / batch_views, l1=Ll1.detach() / batch_views, depth_loss=Ll1depth / batch_views)
 
         with torch.no_grad():
-            # Progress bar
-            ema_loss_for_log = 0.4 * loss.item() + 0.6 * ema_loss_for_log
-            ema_Ll1depth_for_log = 0.4 * Ll1depth + 0.6 * ema_Ll1depth_for_log
-
-            if iteration % 10 == 0:
-                progress_bar.set_postfix({"Loss": f"{ema_loss_for_log:.{7}f}", "Depth Loss": f"{ema_Ll1depth_for_log:.{7}f}"})
-                progress_bar.update(10)
-            if iteration == opt.iterations:
-                progress_bar.close()
-
-            # Log and save
-            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render, (pipe, background, 1., SPARSE_ADAM_AVAILABLE, None, dataset.train_test_exp), dataset.train_test_exp)
+            # Read metrics back when the buffer is full, and before evaluations and checkpoints, which need them up to date
+            if metrics.full() or iteration in testing_iterations or iteration in checkpoint_iterations or iteration == opt.iterations:
+                logged = metrics.drain()
+                if view_losses:
+                    sampler.update([vind for vind, _ in view_losses], torch.stack([view_loss for _, view_loss in view_losses]).tolist())
+                    view_losses = []
+                if any(logged_iteration % 10 == 0 for logged_iteration, _, _ in logged):
+                    now = time.time()
+                    steps_per_sec = (iteration - log_start_iter) / (now - log_start_time)
+                    log_start_iter, log_start_time = iteration, now
+
+                for logged_iteration, elapsed, values in logged:
+                    # Progress bar
+                    ema_loss_for_log = 0.4 * values["loss"] + 0.6 * ema_loss_for_log
+                    ema_Ll1depth_for_log = 0.4 * values["depth_loss"] + 0.6 * ema_Ll1depth_for_log
+
+                    if logged_iteration % 10 == 0:
+                        progress_bar.set_postfix({"Loss": f"{ema_loss_for_log:.{7}f}", "Depth Loss": f"{ema_Ll1depth_for_log:.{7}f}", "Steps/s": f"{steps_per_sec:.1f}", "Images/s": f"{steps_per_sec * opt.batch_size:.1f}"})
+                        progress_bar.update(10)
+                        if tb_writer:
+                            tb_writer.add_scalar('throughput/steps_per_sec', steps_per_sec, logged_iteration)
+                            tb_writer.add_scalar('throughput/images_per_sec', steps_per_sec * opt.batch_size, logged_iteration)
+                    if tb_writer and sampler.needs_losses and logged_iteration % 1000 == 0:
+                        probabilities = sampler.probabilities()
+                        tb_writer.add_histogram("sampler/view_probabilities", probabilities, logged_iteration)
+                        tb_writer.add_scalar("sampler/max_over_uniform", probabilities.max() * len(probabilities), logged_iteration)
+                    if logged_iteration == opt.iterations:
+                        progress_bar.close()
+
+                    # Log, evaluations only run for the current iteration
+                    training_report(tb_writer, logged_iteration, values["l1"], values["loss"], l1_loss, elapsed, testing_iterations, scene, render, (pipe, background, 1., SPARSE_ADAM_AVAILABLE, None, dataset.train_test_exp), dataset.train_test_exp)
+
+            # Save
             if (iteration in saving_iterations):
                 print("\n[ITER {}] Saving Gaussians".format(iteration))
-                scene.save(iteration)
+                scene.save(iteration, snapshot_writer)
+
+            # Largest screen-space radius of every Gaussian over the batch
+            radii = render_pkgs[0]["radii"]
+            for render_pkg in render_pkgs[1:]:
+                radii = torch.max(radii, render_pkg["radii"])
 
             # Densification
             if iteration < opt.densify_until_iter:
-                # Keep track of max radii in image-space for pruning
-                gaussians.max_radii2D[visibility_filter] = torch.max(gaussians.max_radii2D[visibility_filter], radii[visibility_filter])
-                gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
+                # Keep track of max radii in image-space for pruning. Statistics are accumulated
+                # per view, so a Gaussian seen by several views of the batch counts once per view
+                for render_pkg in render_pkgs:
+                    visibility_filter = render_pkg["visibility_filter"]
+                    if opt.sync_free:
+                        # Radii of invisible Gaussians are 0, so a dense max leaves them untouched
+                        torch.maximum(gaussians.max_radii2D, render_pkg["radii"], out=gaussians.max_radii2D)
+                    else:
+                        gaussians.max_radii2D[visibility_filter] = torch.max(gaussians.max_radii2D[visibility_filter], render_pkg["radii"][visibility_filter])
+                    gaussians.add_densification_stats(render_pkg["viewspace_points"], visibility_filter, dense=opt.sync_free)
 
                 if iteration > opt.densify_from_iter and iteration % opt.densification_interval == 0:
                     size_threshold = 20 if iteration > opt.opacity_reset_interval else None
                     gaussians.densify_and_prune(opt.densify_grad_threshold, 0.005, scene.cameras_extent, size_threshold, radii)
+                    if opt.morton_reorder:
+                        gaussians.sort_by_morton()
                 
                 if iteration % opt.opacity_reset_interval == 0 or (dataset.white_background and iteration == opt.densify_from_iter):
                     gaussians.reset_opacity()
 
-            if viewpoint_cam.uid in data_map["gs"] and iteration < pose_opt_iter and (iteration // 1000) % 2 == 0:
+            # Until pose_opt_iter, training views alternate between refining the Gaussians and refining
+            # their own pose, the "gs" and "pose" halves swapping roles every 1000 iterations
+            if iteration < pose_opt_iter:
+                gs_phase = (iteration // 1000) % 2 == 0
+                pose_cams = [viewpoint_cam for viewpoint_cam in viewpoint_cams if (viewpoint_cam.uid in data_map["gs"]) != gs_phase]
+                step_gaussians = len(pose_cams) < len(viewpoint_cams)
+            else:
+                pose_cams = []
+                step_gaussians = iteration < opt.iterations and iteration > pose_opt_iter
+
+            if step_gaussians:
                 gaussians.exposure_optimizer.step()
                 gaussians.exposure_optimizer.zero_grad(set_to_none = True)
                 if use_sparse_adam:
@@ -231,43 +325,45 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
                 else:
                     gaussians.optimizer.step()
                     gaussians.optimizer.zero_grad(set_to_none = True)
-            
-            if viewpoint_cam.uid in data_map["pose"] and  iteration < pose_opt_iter and (iteration // 1000) % 2 == 0:
-                pose_optimizer.step()
-                viewpoint_cam.update_pose()
-                pose_optimizer.zero_grad(set_to_none = True)
 
-            if viewpoint_cam.uid in data_map["pose"] and  iteration < pose_opt_iter  and (iteration // 1000) % 2 == 1:
-                gaussians.exposure_optimizer.step()
-                gaussians.exposure_optimizer.zero_grad(set_to_none = True)
-                if use_sparse_adam:
-                    visible = radii > 0
-                    gaussians.optimizer.step(visible, radii.shape[0])
-                    gaussians.optimizer.zero_grad(set_to_none = True)
-                else:
-                    gaussians.optimizer.step()
-                    gaussians.optimizer.zero_grad(set_to_none = True)
-            
-            if viewpoint_cam.uid in data_map["gs"] and  iteration < pose_opt_iter  and (iteration // 1000) % 2 == 1:
-                pose_optimizer.step()
-                viewpoint_cam.update_pose()
-                pose_optimizer.zero_grad(set_to_none = True)
+            if pose_cams:
+                pose_indices = [viewpoint_cam.pose_index for viewpoint_cam in pose_cams]
+                pose_store.step(pose_indices)
+                pose_store.update_poses(pose_indices)
+                pose_store.zero_grad()
 
-            if iteration < opt.iterations and iteration > pose_opt_iter:
-                gaussians.exposure_optimizer.step()
-                gaussians.exposure_optimizer.zero_grad(set_to_none = True)
-                if use_sparse_adam:
-                    visible = radii > 0
-                    gaussians.optimizer.step(visible, radii.shape[0])
-                    gaussians.optimizer.zero_grad(set_to_none = True)
-                else:
-                    gaussians.optimizer.step()
-                    gaussians.optimizer.zero_grad(set_to_none = True)
- 
+            # Saved models are written in Morton order; sorting here, after the optimizer steps,
+            # keeps this iteration's radii and visibility consistent with the Gaussian order
+            if opt.morton_reorder and (iteration + 1) in saving_iterations:
+                gaussians.sort_by_morton()
 
             if (iteration in checkpoint_iterations):
                 print("\n[ITER {}] Saving Checkpoint".format(iteration))
-                torch.save((gaussians.capture(), iteration), scene.model_path + "/chkpnt" + str(iteration) + ".pth")
+                checkpoint_path = scene.model_path + "/chkpnt" + str(iteration)
+                training_state = {
+                    "iteration": iteration,
+                    "gaussians": gaussians.capture(),
+                    "exposure": gaussians.capture_exposure(),
+                    "cameras": scene.capture_cameras(),
+                    "pose_optimizer": pose_store.optimizer_state_dict(),
+                    "sampler": sampler.state_dict(),
+                    "ema": (ema_loss_for_log, ema_Ll1depth_for_log),
+                    "rng": capture_rng_state(),
+                }
+                if snapshot_writer is None:
+                    checkpointer.save(checkpoint_path, training_state)
+                else:
+                    snapshot_writer.submit("checkpoint", iteration, partial(checkpointer.save, checkpoint_path, clone_state(training_state)))
+
+            # Draw the next views now so their upload overlaps with the optimizer step still running on the GPU.
+            # This happens after the checkpoint so that saved sampling state does not include the draw
+            if prefetcher.enabled and iteration < opt.iterations:
+                next_viewpoints = [pick_viewpoint(iteration + 1) for _ in range(opt.batch_size)]
+                for viewpoint_cam, _ in next_viewpoints:
+                    prefetcher.stage(viewpoint_cam)
+
+    if snapshot_writer is not None:
+        snapshot_writer.close()
 
     camera_to_colmap(scene.model_path, scene.getTrainCameras())
 
@@ -295,8 +391,8 @@ def prepare_output_and_logger(args):
 
 def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_iterations, scene : Scene, renderFunc, renderArgs, train_test_exp):
     if tb_writer:
-        tb_writer.add_scalar('train_loss_patches/l1_loss', Ll1.item(), iteration)
-        tb_writer.add_scalar('train_loss_patches/total_loss', loss.item(), iteration)
+        tb_writer.add_scalar('train_loss_patches/l1_loss', Ll1, iteration)
+        tb_writer.add_scalar('train_loss_patches/total_loss', loss, iteration)
         tb_writer.add_scalar('iter_time', elapsed, iteration)
 
     # Report test and samples of training set
@@ -311,7 +407,7 @@ def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_i
                 psnr_test = 0.0
                 for idx, viewpoint in enumerate(config['cameras']):
                     image = torch.clamp(renderFunc(viewpoint, scene.gaussians, *renderArgs)["render"], 0.0, 1.0)
-                    gt_image = torch.clamp(viewpoint.original_image.to("cuda"), 0.0, 1.0)
+                    gt_image = torch.clamp(viewpoint.get_gt_image(scene.gaussians.device), 0.0, 1.0)
                     if train_test_exp:
                         image = image[..., image.shape[-1] // 2:]
                         gt_image = gt_image[..., gt_image.shape[-1] // 2:]
@@ -349,6 +445,10 @@ if __name__ == "__main__":
     parser.add_argument('--disable_viewer', action='store_true', default=False)
     parser.add_argument("--checkpoint_iterations", nargs="+", type=int, default=[])
     parser.add_argument("--start_checkpoint", type=str, default = None)
+    parser.add_argument("--async_save", action="store_true", default=False)
+    parser.add_argument("--snapshot_queue_size", type=int, default=2)
+    parser.add_argument("--checkpoint_keyframe_interval", type=int, default=1)
+    parser.add_argument("--checkpoint_delta", type=str, default="xor", choices=["xor", "fp16"])
     args = parser.parse_args(sys.argv[1:])
     args.save_iterations.append(args.iterations)
     
@@ -361,7 +461,7 @@ if __name__ == "__main__":
     if not args.disable_viewer:
         network_gui.init(args.ip, args.port)
     torch.autograd.set_detect_anomaly(args.detect_anomaly)
-    training(lp.extract(args), op.extract(args), pp.extract(args), args.test_iterations, args.save_iterations, args.checkpoint_iterations, args.start_checkpoint, args.debug_from)
+    training(lp.extract(args), op.extract(args), pp.extract(args), args.test_iterations, args.save_iterations, args.checkpoint_iterations, args.start_checkpoint, args.debug_from, args.async_save, args.snapshot_queue_size, args.checkpoint_keyframe_interval, args.checkpoint_delta)
 
     # All done
     print("\nTraining complete.")
@@ -9,17 +9,20 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
-from scene.cameras import Camera
+from scene.cameras import Camera, CameraPoseStore, prepare_image_data, resize_image_data, image_data_from_arrays, get_data_device
+from scene.dataset_cache import dataset_cache_key, open_dataset_cache, write_dataset_cache
 import numpy as np
 from utils.graphics_utils import fov2focal
 from PIL import Image
 import cv2
 import os
 import scipy.spatial.transform
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 WARNED = False
 
-def loadCam(args, id, cam_info, resolution_scale, is_nerf_synthetic, is_test_dataset):
+def loadImageData(cam_info, is_nerf_synthetic):
     image = Image.open(cam_info.image_path)
 
     if cam_info.depth_path != "":
@@ -40,8 +43,20 @@ def loadCam(args, id, cam_info, resolution_scale, is_nerf_synthetic, is_test_dat
             raise
     else:
         invdepthmap = None
-        
-    orig_w, orig_h = image.size
+
+    return image, invdepthmap
+
+def draftImage(image, resolution):
+    """
+    Let the JPEG decoder of a not yet loaded PIL image downscale by 1/2, 1/4 or 1/8 in the
+    DCT domain while staying at least resolution; the exact resize happens afterwards.
+    Other formats are left untouched.
+    """
+    if image.format == "JPEG":
+        image.draft(image.mode, resolution)
+    return image
+
+def getResolution(args, orig_w, orig_h, resolution_scale):
     if args.resolution in [1, 2, 4, 8]:
         resolution = round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
     else:  # should be a type that converts to float
@@ -61,21 +76,156 @@ def loadCam(args, id, cam_info, resolution_scale, is_nerf_synthetic, is_test_dat
 
         scale = float(global_down) * float(resolution_scale)
         resolution = (int(orig_w / scale), int(orig_h / scale))
+    return resolution
+
+def loadResizedImageData(cam_info, is_nerf_synthetic, resolution, jpeg_draft=False):
+    image, invdepthmap = loadImageData(cam_info, is_nerf_synthetic)
+    if jpeg_draft:
+        draftImage(image, resolution)
+    return resize_image_data(image, invdepthmap, resolution)
+
+def loadCamData(args, cam_info, resolution_scale, is_nerf_synthetic, is_test_dataset, decode=True):
+    """
+    Work of loadCam that does not need the main thread: read the image size,
+    pick the training resolution and, if decode, decode and resize the image,
+    alpha and inverse depth. Returns the resolution and image data (or None).
+    """
+    if decode:
+        image, invdepthmap = loadImageData(cam_info, is_nerf_synthetic)
+        orig_w, orig_h = image.size
+    else:
+        # Only the header is read here, pixels are decoded when the camera image is first used
+        with Image.open(cam_info.image_path) as header:
+            orig_w, orig_h = header.size
+
+    resolution = getResolution(args, orig_w, orig_h, resolution_scale)
+
+    image_data = None
+    if decode:
+        if args.jpeg_draft:
+            draftImage(image, resolution)
+        image_data = prepare_image_data(image, invdepthmap, resolution, cam_info.depth_params, get_data_device(args.data_device),
+                                        args.train_test_exp, is_test_dataset, cam_info.is_test)
+    return resolution, image_data
+
+def loadCamPyramidData(args, cam_info, resolution_scales, is_nerf_synthetic, is_test_dataset):
+    """
+    loadCamData for several resolution scales at once. The image is decoded once and
+    resized to the finest resolution as in loadCamData; coarser levels are area
+    downsampled from that level. Returns a (resolution, image data) pair per scale.
+    """
+    image, invdepthmap = loadImageData(cam_info, is_nerf_synthetic)
+    resolutions = [getResolution(args, image.size[0], image.size[1], resolution_scale) for resolution_scale in resolution_scales]
+    finest_resolution = max(resolutions, key=lambda resolution: resolution[0] * resolution[1])
+    if args.jpeg_draft:
+        draftImage(image, finest_resolution)
+    finest_image, finest_invdepthmap = resize_image_data(image, invdepthmap, finest_resolution)
+
+    data_device = get_data_device(args.data_device)
+    levels = {}
+    for resolution in resolutions:
+        if resolution in levels:
+            continue
+        if resolution == finest_resolution:
+            level_image, level_invdepthmap = finest_image, finest_invdepthmap
+        else:
+            level_image = cv2.resize(finest_image, resolution, interpolation=cv2.INTER_AREA)
+            level_invdepthmap = None
+            if finest_invdepthmap is not None:
+                level_invdepthmap = cv2.resize(finest_invdepthmap, resolution, interpolation=cv2.INTER_AREA)
+        levels[resolution] = image_data_from_arrays(level_image, level_invdepthmap, cam_info.depth_params, data_device,
+                                                    args.train_test_exp, is_test_dataset, cam_info.is_test)
+    return [(resolution, levels[resolution]) for resolution in resolutions]
+
+def loadCacheEntry(args, cam_info, resolution_scale, is_nerf_synthetic):
+    image, invdepthmap = loadImageData(cam_info, is_nerf_synthetic)
+    resolution = getResolution(args, image.size[0], image.size[1], resolution_scale)
+    if args.jpeg_draft:
+        draftImage(image, resolution)
+    return (resolution,) + resize_image_data(image, invdepthmap, resolution)
+
+def loadDatasetCache(args, cam_infos, resolution_scale, is_nerf_synthetic, num_workers):
+    key, digest = dataset_cache_key(args.source_path, cam_infos, args.resolution, resolution_scale, bool(args.jpeg_draft))
+    cache = open_dataset_cache(args.dataset_cache, key, digest)
+    if cache is None:
+        print("Building dataset cache {}".format(os.path.join(args.dataset_cache, digest)))
+        os.makedirs(args.dataset_cache, exist_ok=True)
+        load = partial(loadCacheEntry, args, resolution_scale=resolution_scale, is_nerf_synthetic=is_nerf_synthetic)
+        write_dataset_cache(os.path.join(args.dataset_cache, digest), key, mapOrdered(load, cam_infos, num_workers))
+        cache = open_dataset_cache(args.dataset_cache, key, digest)
+    return cache
+
+def mapOrdered(fn, items, num_workers):
+    if num_workers > 1 and len(items) > 1:
+        # Decoding and resizing release the GIL, so threads scale; map keeps the input order
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            yield from pool.map(fn, items)
+    else:
+        yield from map(fn, items)
+
+def loadCam(args, id, cam_info, resolution_scale, is_nerf_synthetic, is_test_dataset, image_store=None, cam_data=None, image_loader=None, pose_store=None):
+    if cam_data is None:
+        cam_data = loadCamData(args, cam_info, resolution_scale, is_nerf_synthetic, is_test_dataset, decode=image_store is None and image_loader is None)
+    resolution, image_data = cam_data
+    if image_loader is None and image_store is not None:
+        image_loader = partial(loadResizedImageData, cam_info, is_nerf_synthetic, resolution, bool(args.jpeg_draft))
 
     return Camera(resolution, colmap_id=cam_info.uid, R=cam_info.R, T=cam_info.T, 
                   FoVx=cam_info.FovX, FoVy=cam_info.FovY, depth_params=cam_info.depth_params,
-                  image=image, invdepthmap=invdepthmap,
+                  image=None, invdepthmap=None,
                   image_name=cam_info.image_name, uid=id, data_device=args.data_device,
-                  train_test_exp=args.train_test_exp, is_test_dataset=is_test_dataset, is_test_view=cam_info.is_test)
+                  train_test_exp=args.train_test_exp, is_test_dataset=is_test_dataset, is_test_view=cam_info.is_test,
+                  image_loader=image_loader, image_store=image_store, has_depth=cam_info.depth_path != "", image_data=image_data,
+                  pose_store=pose_store, pose_index=id, device=args.device)
+
+def cameraList_from_camInfos(cam_infos, resolution_scale, args, is_nerf_synthetic, is_test_dataset, image_store=None, pose_store=None):
+    # Camera i of the list is row i of the pose store
+    if pose_store is None:
+        pose_store = CameraPoseStore.from_cam_infos(cam_infos, args.device)
+    num_workers = args.load_workers if args.load_workers is not None else 1
+
+    cache = None
+    if args.dataset_cache and len(cam_infos) > 0:
+        cache = loadDatasetCache(args, cam_infos, resolution_scale, is_nerf_synthetic, num_workers)
+
+    if cache is not None:
+        # Images are read from the memory-mapped cache instead of being decoded
+        cam_datas = [(cache.resolution(idx), None) for idx in range(len(cam_infos))]
+        image_loaders = [partial(cache.arrays, idx) for idx in range(len(cam_infos))]
+    else:
+        load = partial(loadCamData, args, resolution_scale=resolution_scale, is_nerf_synthetic=is_nerf_synthetic,
+                       is_test_dataset=is_test_dataset, decode=image_store is None)
+        cam_datas = mapOrdered(load, cam_infos, num_workers)
+        image_loaders = [None] * len(cam_infos)
 
-def cameraList_from_camInfos(cam_infos, resolution_scale, args, is_nerf_synthetic, is_test_dataset):
     camera_list = []
 
-    for id, c in enumerate(cam_infos):
-        camera_list.append(loadCam(args, id, c, resolution_scale, is_nerf_synthetic, is_test_dataset))
+    for id, (c, cam_data, image_loader) in enumerate(zip(cam_infos, cam_datas, image_loaders)):
+        camera_list.append(loadCam(args, id, c, resolution_scale, is_nerf_synthetic, is_test_dataset, image_store, cam_data, image_loader, pose_store))
 
     return camera_list
 
+def cameraPyramid_from_camInfos(cam_infos, resolution_scales, args, is_nerf_synthetic, is_test_dataset, image_store=None, pose_store=None):
+    """
+    Camera lists of every resolution scale, as {scale: list}. All lists share one pose
+    store, and when images are decoded up front each one is decoded only once for all scales.
+    """
+    if pose_store is None:
+        pose_store = CameraPoseStore.from_cam_infos(cam_infos, args.device)
+    if len(resolution_scales) == 1 or image_store is not None or args.dataset_cache:
+        # Single scale, or images loaded on demand / from a per-scale dataset cache
+        return {resolution_scale: cameraList_from_camInfos(cam_infos, resolution_scale, args, is_nerf_synthetic, is_test_dataset, image_store, pose_store)
+                for resolution_scale in resolution_scales}
+
+    num_workers = args.load_workers if args.load_workers is not None else 1
+    load = partial(loadCamPyramidData, args, resolution_scales=resolution_scales, is_nerf_synthetic=is_nerf_synthetic,
+                   is_test_dataset=is_test_dataset)
+    camera_lists = {resolution_scale: [] for resolution_scale in resolution_scales}
+    for id, (c, cam_datas) in enumerate(zip(cam_infos, mapOrdered(load, cam_infos, num_workers))):
+        for resolution_scale, cam_data in zip(resolution_scales, cam_datas):
+            camera_lists[resolution_scale].append(loadCam(args, id, c, resolution_scale, is_nerf_synthetic, is_test_dataset, None, cam_data, None, pose_store))
+    return camera_lists
+
 def camera_to_JSON(id, camera : Camera):
     Rt = np.zeros((4, 4))
     # Rt[:3, :3] = camera.R.transpose()
@@ -0,0 +1,208 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import re
+import json
+import zlib
+import shutil
+import torch
+import numpy as np
+from torch import nn
+
+# A checkpoint is a directory holding one raw little-endian file per tensor and a
+# manifest.json describing the nested state (dicts, lists, tuples, scalars) with
+# references to those files. Tensors are memory-mapped on load. Delta checkpoints
+# store zlib-compressed differences (.bin.z) against the checkpoint named in "base".
+MANIFEST_NAME = "manifest.json"
+
+TORCH_DTYPES = {str(dtype).split(".")[-1]: dtype for dtype in (
+    torch.float64, torch.float32, torch.float16, torch.bfloat16,
+    torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool)}
+
+def _encode(node, key, tensors):
+    if isinstance(node, (torch.Tensor, np.ndarray)):
+        name = "{:04d}_{}".format(len(tensors), re.sub(r"[^A-Za-z0-9_.]", "_", key))[:96]
+        tensors[name] = node
+        return {"__tensor__": name}
+    if isinstance(node, dict):
+        if all(isinstance(k, str) for k in node):
+            return {"__dict__": {k: _encode(v, key + "." + k, tensors) for k, v in node.items()}}
+        return {"__items__": [[k, _encode(v, key + "." + str(k), tensors)] for k, v in node.items()]}
+    if isinstance(node, tuple):
+        return {"__tuple__": [_encode(v, key + "." + str(i), tensors) for i, v in enumerate(node)]}
+    if isinstance(node, list):
+        return [_encode(v, key + "." + str(i), tensors) for i, v in enumerate(node)]
+    if isinstance(node, np.generic):
+        return node.item()
+    return node
+
+def _decode(node, tensors):
+    if isinstance(node, list):
+        return [_decode(v, tensors) for v in node]
+    if isinstance(node, dict):
+        if "__tensor__" in node:
+            return tensors[node["__tensor__"]]
+        if "__dict__" in node:
+            return {k: _decode(v, tensors) for k, v in node["__dict__"].items()}
+        if "__items__" in node:
+            return {k: _decode(v, tensors) for k, v in node["__items__"]}
+        if "__tuple__" in node:
+            return tuple(_decode(v, tensors) for v in node["__tuple__"])
+    return node
+
+def _tensor_bytes(value):
+    """ Raw little-endian bytes of a tensor or array, plus its manifest entry """
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder("<"))
+        return array.reshape(-1).view(np.uint8), {"kind": "ndarray", "dtype": array.dtype.str, "shape": list(array.shape)}
+    tensor = value.detach()
+    raw = tensor.cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+    return raw, {"kind": "parameter" if isinstance(value, nn.Parameter) else "tensor",
+                 "dtype": str(tensor.dtype).split(".")[-1], "shape": list(tensor.shape),
+                 "device": str(tensor.device), "requires_grad": value.requires_grad}
+
+def _from_bytes(raw, entry, map_location):
+    shape = tuple(entry["shape"])
+    if entry["kind"] == "ndarray":
+        return raw.view(entry["dtype"]).reshape(shape)
+
+    tensor = torch.from_numpy(raw).view(TORCH_DTYPES[entry["dtype"]]).reshape(shape)
+    device = map_location if map_location is not None else entry["device"]
+    tensor = tensor.to(device)
+    if entry["kind"] == "parameter":
+        return nn.Parameter(tensor, requires_grad=entry["requires_grad"])
+    return tensor
+
+def _read_manifest(path):
+    with open(os.path.join(path, MANIFEST_NAME), "r") as f:
+        return json.load(f)
+
+def _shuffle(words):
+    # Group byte planes together (all high bytes, then the next...) so zlib sees long runs of zeros
+    return np.ascontiguousarray(words.view(np.uint8).reshape(-1, words.itemsize).T).tobytes()
+
+def _unshuffle(data, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(-1)
+
+def _lossy_delta(name, entry):
+    # Only large float32 tensors (parameters, Adam moments) may lose precision: scalars,
+    # 0-d tensors and optimizer step counts must round trip exactly
+    return (entry["dtype"] in ("float32", "<f4") and len(entry["shape"]) > 0 and int(np.prod(entry["shape"])) > 1
+            and not name.endswith(".step") and not name.endswith("_step"))
+
+def _encode_delta(name, raw, base_raw, entry, delta_mode):
+    if delta_mode == "fp16" and _lossy_delta(name, entry):
+        # Lossy: float16 difference to the base values
+        diff = raw.view("<f4") - base_raw.view("<f4")
+        return zlib.compress(_shuffle(diff.astype("<f2")), 1), "fp16"
+    # Lossless: values that barely changed share their high bits with the base, so the XOR is mostly zeros
+    word = "<u4" if raw.nbytes % 4 == 0 else "u1"
+    return zlib.compress(_shuffle(np.bitwise_xor(raw.view(word), base_raw.view(word))), 1), "xor"
+
+def _decode_delta(data, base_raw, delta_mode):
+    data = zlib.decompress(data)
+    if delta_mode == "fp16":
+        return (base_raw.view("<f4") + _unshuffle(data, "<f2").astype("<f4")).view(np.uint8)
+    word = "<u4" if base_raw.nbytes % 4 == 0 else "u1"
+    return np.bitwise_xor(_unshuffle(data, word), base_raw.view(word)).view(np.uint8)
+
+def _read_raw(path, name, manifest, manifests):
+    entry = manifest["tensors"][name]
+    if "delta" in entry:
+        base_path = os.path.normpath(os.path.join(path, manifest["base"]))
+        if base_path not in manifests:
+            manifests[base_path] = _read_manifest(base_path)
+        base_raw = _read_raw(base_path, name, manifests[base_path], manifests)
+        with open(os.path.join(path, name + ".bin.z"), "rb") as f:
+            return _decode_delta(f.read(), base_raw, entry["delta"])
+    if int(np.prod(entry["shape"])) == 0:
+        return np.empty(0, dtype=np.uint8)
+    # Copy-on-write mapping: pages are only read when the tensor is used
+    return np.memmap(os.path.join(path, name + ".bin"), dtype=np.uint8, mode="c")
+
+def save_checkpoint(path, state, base=None, delta_mode="xor"):
+    """
+    Save a nested state made of dicts, lists, tuples, tensors, numpy arrays and
+    JSON scalars to a checkpoint directory. The directory is written next to the
+    destination and renamed into place once complete.
+    If base is the path of an earlier checkpoint, tensors with the same name, shape
+    and dtype are stored as a compressed delta against it: "xor" is lossless,
+    "fp16" stores float32 differences of parameter and moment tensors as float16
+    (smaller, but not bit-exact); scalars and step counts are always stored exactly.
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    base_manifest = _read_manifest(base) if base is not None else None
+    manifests = {}
+    tensors = {}
+    tree = _encode(state, "state", tensors)
+    entries = {}
+    for name, value in tensors.items():
+        raw, entry = _tensor_bytes(value)
+        base_entry = base_manifest["tensors"].get(name) if base_manifest is not None else None
+        if base_entry is not None and base_entry["dtype"] == entry["dtype"] and base_entry["shape"] == entry["shape"] and raw.nbytes > 0:
+            base_raw = _read_raw(base, name, base_manifest, manifests)
+            data, entry["delta"] = _encode_delta(name, raw, base_raw, entry, delta_mode)
+            with open(os.path.join(tmp_path, name + ".bin.z"), "wb") as f:
+                f.write(data)
+        else:
+            raw.tofile(os.path.join(tmp_path, name + ".bin"))
+        entries[name] = entry
+
+    manifest = {"version": 1, "tensors": entries, "state": tree}
+    if base is not None:
+        manifest["base"] = os.path.relpath(base, path)
+    with open(os.path.join(tmp_path, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path, map_location=None):
+    """
+    Load a checkpoint directory written by save_checkpoint, replaying deltas
+    against their base checkpoints. Tensors are restored to the device they were
+    saved from unless map_location is given.
+    """
+    manifest = _read_manifest(path)
+    manifests = {}
+    tensors = {name: _from_bytes(_read_raw(path, name, manifest, manifests), entry, map_location)
+               for name, entry in manifest["tensors"].items()}
+    return _decode(manifest["state"], tensors)
+
+class DeltaCheckpointer:
+    """
+    Writes a full checkpoint every keyframe_interval checkpoints and deltas
+    against the last full one in between. Deltas are only valid as long as
+    their base checkpoint directory is kept.
+    """
+    def __init__(self, keyframe_interval=1, delta_mode="xor"):
+        self.keyframe_interval = keyframe_interval
+        self.delta_mode = delta_mode
+        self.base_path = None
+        self.count = 0
+
+    def save(self, path, state):
+        if self.base_path is None or self.keyframe_interval <= 1 or self.count % self.keyframe_interval == 0:
+            save_checkpoint(path, state)
+            self.base_path = path
+        else:
+            save_checkpoint(path, state, self.base_path, self.delta_mode)
+        self.count += 1
+
+def is_checkpoint_dir(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
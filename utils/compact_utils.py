@@ -0,0 +1,120 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import json
+import struct
+import torch
+import numpy as np
+
+# File layout: magic, u64 table of contents size, JSON table of contents, then one
+# aligned raw little-endian block per section. The table of contents stores the
+# offset, dtype and shape of every section so readers only map what they need.
+COMPACT_MAGIC = b"3DGSCMP1"
+COMPACT_ALIGNMENT = 64
+
+def _align(offset):
+    return (offset + COMPACT_ALIGNMENT - 1) // COMPACT_ALIGNMENT * COMPACT_ALIGNMENT
+
+def write_compact(path, sections, meta):
+    """
+    Write named numpy arrays to a compact model file.
+    :param sections: dict name -> (array, dict of extra decoding parameters)
+    :param meta: JSON-serializable dict stored alongside the table of contents
+    """
+    toc = {"meta": meta, "sections": {}}
+    arrays = []
+    offset = 0
+    for name, (array, params) in sections.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        entry = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        entry.update(params)
+        toc["sections"][name] = entry
+        arrays.append(array)
+        offset = _align(offset + array.nbytes)
+
+    toc_bytes = json.dumps(toc).encode("utf-8")
+    data_start = _align(len(COMPACT_MAGIC) + 8 + len(toc_bytes))
+    with open(path, "wb") as fid:
+        fid.write(COMPACT_MAGIC)
+        fid.write(struct.pack("<Q", len(toc_bytes)))
+        fid.write(toc_bytes)
+        for name, array in zip(toc["sections"], arrays):
+            fid.seek(data_start + toc["sections"][name]["offset"])
+            array.tofile(fid)
+        fid.truncate(data_start + offset)
+
+class CompactReader:
+    """
+    Lazily reads sections of a compact model file. Only the table of contents
+    is parsed on construction; sections are memory-mapped on request.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fid:
+            if fid.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+                raise ValueError("{} is not a compact Gaussian model file".format(path))
+            toc_size = struct.unpack("<Q", fid.read(8))[0]
+            toc = json.loads(fid.read(toc_size).decode("utf-8"))
+        self.data_start = _align(len(COMPACT_MAGIC) + 8 + toc_size)
+        self.meta = toc["meta"]
+        self.sections = toc["sections"]
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def read(self, name):
+        entry = self.sections[name]
+        shape = tuple(entry["shape"])
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=entry["dtype"])
+        return np.memmap(self.path, dtype=entry["dtype"], mode="r", offset=self.data_start + entry["offset"], shape=shape)
+
+    def read_decoded(self, name):
+        """ Read a section and undo its quantization, returned as float32 """
+        entry = self.sections[name]
+        array = self.read(name)
+        if entry.get("encoding") == "uint8":
+            return dequantize_uint8(array, entry["min"], entry["scale"])
+        return np.array(array, dtype=np.float32)
+
+def quantize_uint8(x):
+    """ Per-column min/max quantization of a (N, C) float array to 8 bits """
+    lo = x.min(axis=0) if x.shape[0] else np.zeros(x.shape[1], dtype=np.float32)
+    hi = x.max(axis=0) if x.shape[0] else np.zeros(x.shape[1], dtype=np.float32)
+    scale = np.maximum(hi - lo, 1e-12) / 255.0
+    q = np.clip(np.round((x - lo) / scale), 0, 255).astype(np.uint8)
+    return q, {"encoding": "uint8", "min": lo.tolist(), "scale": scale.tolist()}
+
+def dequantize_uint8(q, lo, scale):
+    return q.astype(np.float32) * np.asarray(scale, dtype=np.float32) + np.asarray(lo, dtype=np.float32)
+
+def _nearest_centroid(x, centroids, batch_size):
+    labels = torch.empty(x.shape[0], dtype=torch.long, device=x.device)
+    for start in range(0, x.shape[0], batch_size):
+        labels[start:start + batch_size] = torch.cdist(x[start:start + batch_size], centroids).argmin(dim=1)
+    return labels
+
+def kmeans(x, k, iters=10, batch_size=65536):
+    """
+    Plain Lloyd k-means on the device of x.
+    :return: (k, D) centroids and (N,) labels
+    """
+    if x.shape[0] == 0:
+        return x[:0], torch.zeros(0, dtype=torch.long, device=x.device)
+    k = min(k, x.shape[0])
+    centroids = x[torch.randperm(x.shape[0], device=x.device)[:k]].clone()
+    for _ in range(iters):
+        labels = _nearest_centroid(x, centroids, batch_size)
+        sums = torch.zeros_like(centroids).index_add_(0, labels, x)
+        counts = torch.bincount(labels, minlength=k)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None].to(x.dtype)
+    return centroids, _nearest_centroid(x, centroids, batch_size)
@@ -76,4 +76,12 @@ def fov2focal(fov, pixels):
     return pixels / (2 * math.tan(fov / 2))
 
 def focal2fov(focal, pixels):
-    return 2*math.atan(pixels/(2*focal))
\ No newline at end of file
+    return 2*math.atan(pixels/(2*focal))
+
+def knn_mean_dist2(points, k=3):
+    """ Mean squared distance of every point to its k nearest neighbours, exact (KD-tree) on the CPU """
+    from scipy.spatial import cKDTree
+    xyz = points.detach().cpu().double().numpy()
+    dists, _ = cKDTree(xyz).query(xyz, k=k + 1)
+    # The nearest neighbour of every point is itself
+    return torch.from_numpy((dists[:, 1:] ** 2).mean(axis=1)).to(points.device, points.dtype)
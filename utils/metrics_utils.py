@@ -0,0 +1,65 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import time
+import torch
+from functools import partial
+
+class HostEvent:
+    """ Wall-clock stand-in for torch.cuda.Event when metrics are kept off the GPU """
+    def record(self):
+        self.time = time.perf_counter()
+
+    def elapsed_time(self, end):
+        return (end.time - self.time) * 1000.0
+
+class DeviceMetricLog:
+    """
+    Per-iteration scalar metrics and iteration times kept on the GPU. Iterations are
+    written to the slots of a fixed ring of capacity rows and CUDA event pairs, and
+    drain() reads all buffered iterations back with a single synchronization, so
+    logging no longer stalls every training step. On other devices iterations are
+    timed on the host.
+    """
+    def __init__(self, names, capacity, device="cuda"):
+        self.names = list(names)
+        self.capacity = capacity
+        self.values = torch.zeros((capacity, len(self.names)), device=device)
+        event = partial(torch.cuda.Event, enable_timing = True) if torch.device(device).type == "cuda" else HostEvent
+        self.events = [(event(), event()) for _ in range(capacity)]
+        self.iterations = []
+
+    def __len__(self):
+        return len(self.iterations)
+
+    def full(self):
+        return len(self.iterations) == self.capacity
+
+    def start(self):
+        """ Mark the start of the next iteration """
+        self.events[len(self.iterations)][0].record()
+
+    def push(self, iteration, **values):
+        """ Mark the end of iteration and store its metrics (tensors or numbers) without reading them back """
+        slot = len(self.iterations)
+        self.events[slot][1].record()
+        with torch.no_grad():
+            for column, name in enumerate(self.names):
+                self.values[slot, column] = values[name]
+        self.iterations.append(iteration)
+
+    def drain(self):
+        """ (iteration, elapsed ms, {name: value}) of every buffered iteration, oldest first """
+        rows = self.values[:len(self.iterations)].tolist()
+        drained = [(iteration, start.elapsed_time(end), dict(zip(self.names, row)))
+                   for iteration, (start, end), row in zip(self.iterations, self.events, rows)]
+        self.iterations = []
+        return drained
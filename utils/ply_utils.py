@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import numpy as np
+
+# PLY scalar type names, as written by plyfile, and their numpy counterparts
+PLY_TO_NUMPY = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8',
+}
+NUMPY_TO_PLY = {
+    'i1': 'char', 'u1': 'uchar',
+    'i2': 'short', 'u2': 'ushort',
+    'i4': 'int', 'u4': 'uint',
+    'f4': 'float', 'f8': 'double',
+}
+
+class PlyHeader:
+    def __init__(self, format, elements, header_size):
+        self.format = format
+        # List of (name, count, [(property, numpy dtype) or None for list properties])
+        self.elements = elements
+        self.header_size = header_size
+
+def read_ply_header(fid):
+    """
+    Parse a PLY header from an open binary file. The file position is left
+    right after 'end_header'.
+    """
+    magic = fid.readline()
+    if magic.strip() != b"ply":
+        raise ValueError("Not a PLY file")
+    format = None
+    elements = []
+    while True:
+        line = fid.readline()
+        if not line:
+            raise ValueError("Unexpected end of file in PLY header")
+        elems = line.decode("ascii").split()
+        if len(elems) == 0 or elems[0] in ("comment", "obj_info"):
+            continue
+        if elems[0] == "end_header":
+            break
+        if elems[0] == "format":
+            format = elems[1]
+        elif elems[0] == "element":
+            elements.append((elems[1], int(elems[2]), []))
+        elif elems[0] == "property":
+            if elems[1] == "list":
+                elements[-1][2].append((elems[4], None))
+            else:
+                elements[-1][2].append((elems[2], PLY_TO_NUMPY[elems[1]]))
+    return PlyHeader(format, elements, fid.tell())
+
+def read_ply_vertices(path, element="vertex"):
+    """
+    Memory-map the records of a binary little-endian PLY element as a numpy
+    structured array. Nothing is read from disk until fields are accessed.
+    Falls back to plyfile for ascii / big-endian files or elements that follow
+    variable-length (list) elements.
+    """
+    with open(path, "rb") as fid:
+        header = read_ply_header(fid)
+
+    offset = header.header_size
+    if header.format == "binary_little_endian":
+        for name, count, properties in header.elements:
+            if any(dtype is None for _, dtype in properties):
+                break
+            dtype = np.dtype([(prop, "<" + dtype) for prop, dtype in properties])
+            if name == element:
+                if count == 0:
+                    return np.empty(0, dtype=dtype)
+                return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+            offset += dtype.itemsize * count
+
+    from plyfile import PlyData
+    return PlyData.read(path)[element].data
+
+def write_ply_vertices(path, vertices, element="vertex"):
+    """
+    Write a numpy structured array as a single-element binary little-endian PLY.
+    The header is byte-identical to what plyfile produces for the same array.
+    """
+    lines = ["ply", "format binary_little_endian 1.0", "element {} {}".format(element, vertices.shape[0])]
+    for name in vertices.dtype.names:
+        lines.append("property {} {}".format(NUMPY_TO_PLY[vertices.dtype[name].str[1:]], name))
+    lines.append("end_header")
+
+    vertices = np.ascontiguousarray(vertices, dtype=vertices.dtype.newbyteorder("<"))
+    with open(path, "wb") as fid:
+        fid.write(("\n".join(lines) + "\n").encode("ascii"))
+        vertices.tofile(fid)
+
+def ply_columns(vertices, names, dtype=np.float32):
+    """
+    Gather the given fields of a structured vertex array into a dense (N, len(names))
+    array. When every field shares the same type the records are viewed as a
+    plain 2D array, so only the requested columns are copied.
+    """
+    fields = vertices.dtype.names
+    field_types = set(vertices.dtype[name] for name in fields)
+    if len(field_types) == 1 and vertices.dtype.itemsize == len(fields) * vertices.dtype[0].itemsize:
+        flat = vertices.view(vertices.dtype[0]).reshape(vertices.shape[0], len(fields))
+        index = [fields.index(name) for name in names]
+        start = index[0] if index else 0
+        if index == list(range(start, start + len(index))):
+            return np.array(flat[:, start:start + len(index)], dtype=dtype)
+        return np.asarray(flat[:, index], dtype=dtype)
+
+    out = np.empty((vertices.shape[0], len(names)), dtype=dtype)
+    for idx, name in enumerate(names):
+        out[:, idx] = vertices[name]
+    return out
+
+def sorted_property_names(vertices, prefix):
+    names = [name for name in vertices.dtype.names if name.startswith(prefix)]
+    return sorted(names, key = lambda x: int(x.split('_')[-1]))
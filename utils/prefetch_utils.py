@@ -0,0 +1,71 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import torch
+
+class ViewPrefetcher:
+    """
+    Uploads the ground truth of the next training views while the current ones are
+    being processed. stage() copies the camera's uint8 image, alpha mask and
+    inverse depth through pinned host memory with non-blocking copies on a side
+    stream; get() makes the current stream wait for them and converts to float.
+    Without CUDA (or when disabled) get() simply loads synchronously.
+    """
+    def __init__(self, device="cuda", enabled=True):
+        self.device = torch.device(device)
+        self.enabled = enabled and self.device.type == "cuda" and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(self.device) if self.enabled else None
+        self.staged = {}
+
+    def stage(self, camera):
+        if not self.enabled:
+            return
+        data = camera.image_data
+        tensors = {}
+        with torch.cuda.stream(self.stream):
+            for name in ("image", "alpha_mask", "invdepthmap"):
+                tensor = data[name]
+                if tensor is not None and tensor.device != self.device:
+                    if tensor.device.type == "cpu":
+                        tensor = tensor.pin_memory()
+                    tensor = tensor.to(self.device, non_blocking=True)
+                tensors[name] = tensor
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self.staged[camera] = (tensors, event)
+
+    def _convert(self, camera, image, alpha_mask, invdepthmap):
+        depth_mask = None
+        if invdepthmap is not None:
+            depth_mask = torch.full_like(invdepthmap, 1.0 if camera.depth_reliable else 0.0)
+        return {
+            "image": image.float() / 255.0,
+            "alpha_mask": alpha_mask.float() / 255.0 if alpha_mask is not None else None,
+            "invdepthmap": invdepthmap,
+            "depth_mask": depth_mask,
+        }
+
+    def get(self, camera):
+        """ Ground truth image, alpha mask (None if absent), inverse depth and depth mask of camera on the device """
+        if camera in self.staged:
+            tensors, event = self.staged.pop(camera)
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            for tensor in tensors.values():
+                if tensor is not None:
+                    # Memory allocated on the side stream is now used on the current one
+                    tensor.record_stream(current_stream)
+            return self._convert(camera, tensors["image"], tensors["alpha_mask"], tensors["invdepthmap"])
+
+        data = camera.image_data
+        invdepthmap = data["invdepthmap"].to(self.device) if data["invdepthmap"] is not None else None
+        alpha_mask = data["alpha_mask"].to(self.device) if data["alpha_mask"] is not None else None
+        return self._convert(camera, data["image"].to(self.device), alpha_mask, invdepthmap)
@@ -0,0 +1,154 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import random
+import numpy as np
+
+# Samplers pick the index of the next training view with draw(). Samplers with
+# needs_losses set are fed the per-view training losses through update(). They
+# own their random generator, seeded explicitly, and expose state_dict() /
+# load_state_dict() so a resumed run continues with the same sequence of views.
+# New samplers are registered in SAMPLERS and read their options in from_opt().
+
+class EpochSampler:
+    """
+    Visits every view once per epoch in random order. Each epoch is a shuffled
+    permutation consumed from its end, so a draw is O(1).
+    """
+    needs_losses = False
+
+    def __init__(self, num_views, seed=0):
+        self.num_views = num_views
+        self.rng = random.Random(seed)
+        self.remaining = []
+
+    @classmethod
+    def from_opt(cls, opt, num_views):
+        return cls(num_views, opt.sampler_seed)
+
+    def draw(self):
+        if not self.remaining:
+            self.remaining = list(range(self.num_views))
+            self.rng.shuffle(self.remaining)
+        return self.remaining.pop()
+
+    def state_dict(self):
+        return {"remaining": list(self.remaining), "rng": self.rng.getstate()}
+
+    def load_state_dict(self, state_dict):
+        self.remaining = list(state_dict["remaining"])
+        self.rng.setstate(state_dict["rng"])
+
+    def load_remaining(self, indices):
+        """ Continue the current epoch with the given views, in a fresh random order """
+        self.remaining = list(indices)
+        self.rng.shuffle(self.remaining)
+
+    def update(self, indices, losses):
+        pass
+
+    def probabilities(self):
+        return np.full(self.num_views, 1.0 / self.num_views)
+
+class ImportanceSampler:
+    """
+    Draws views with probability proportional to a tempered running loss, so views
+    with high error are revisited more often than converged ones. A fraction floor
+    of the draws is uniform, so every view keeps being visited. Weights live in a
+    sum tree, making draws and loss updates O(log N).
+    """
+    needs_losses = True
+
+    def __init__(self, num_views, seed=0, temperature=1.0, floor=0.2, decay=0.5):
+        self.num_views = num_views
+        self.rng = random.Random(seed)
+        self.temperature = temperature
+        self.floor = floor
+        self.decay = decay
+        # Views start at a loss of 1, above typical losses, so unseen views are drawn early
+        self.running_loss = np.ones(num_views)
+        self.seen = np.zeros(num_views, dtype=bool)
+        self.size = 1 << max(num_views - 1, 0).bit_length()
+        self.tree = np.zeros(2 * self.size)
+        self._rebuild()
+
+    @classmethod
+    def from_opt(cls, opt, num_views):
+        return cls(num_views, opt.sampler_seed, opt.sampler_temperature, opt.sampler_floor)
+
+    def _weights(self, losses):
+        return np.maximum(losses, 1e-8) ** (1.0 / self.temperature)
+
+    def _rebuild(self):
+        self.tree[:] = 0
+        self.tree[self.size:self.size + self.num_views] = self._weights(self.running_loss)
+        level = self.size
+        while level > 1:
+            self.tree[level // 2:level] = self.tree[level:2 * level:2] + self.tree[level + 1:2 * level:2]
+            level //= 2
+
+    def draw(self):
+        if self.rng.random() < self.floor or self.tree[1] <= 0:
+            return self.rng.randrange(self.num_views)
+        target = self.rng.random() * self.tree[1]
+        node = 1
+        while node < self.size:
+            left = self.tree[2 * node]
+            if target < left:
+                node = 2 * node
+            else:
+                target -= left
+                node = 2 * node + 1
+        # Rounding can step past the last view into the zero-weight padding
+        return min(node - self.size, self.num_views - 1)
+
+    def update(self, indices, losses):
+        """ Fold the training losses of the given views into their running losses """
+        for index, loss in zip(indices, losses):
+            if self.seen[index]:
+                self.running_loss[index] = self.decay * self.running_loss[index] + (1 - self.decay) * loss
+            else:
+                self.running_loss[index] = loss
+                self.seen[index] = True
+            node = index + self.size
+            self.tree[node] = self._weights(self.running_loss[index])
+            node //= 2
+            while node >= 1:
+                self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+                node //= 2
+
+    def probabilities(self):
+        weights = self.tree[self.size:self.size + self.num_views]
+        return (1 - self.floor) * weights / weights.sum() + self.floor / self.num_views
+
+    def state_dict(self):
+        return {"running_loss": self.running_loss.copy(), "seen": self.seen.copy(), "rng": self.rng.getstate()}
+
+    def load_state_dict(self, state_dict):
+        self.running_loss = np.array(state_dict["running_loss"], dtype=np.float64)
+        self.seen = np.array(state_dict["seen"], dtype=bool)
+        self.rng.setstate(state_dict["rng"])
+        self._rebuild()
+
+    def load_remaining(self, indices):
+        # Draws do not follow epochs, there is nothing to continue
+        pass
+
+SAMPLERS = {
+    "epoch": EpochSampler,
+    "importance": ImportanceSampler,
+}
+
+def make_sampler(opt, num_views):
+    """ The view sampler registered under opt.sampler, built from its own options """
+    if opt.sampler not in SAMPLERS:
+        raise ValueError("Unknown sampler '{}', expected one of {}".format(opt.sampler, ", ".join(SAMPLERS)))
+    return SAMPLERS[opt.sampler].from_opt(opt, num_views)
@@ -0,0 +1,81 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import time
+import queue
+import threading
+import torch
+import numpy as np
+
+def clone_state(node):
+    """
+    Copy a nested state (dicts, lists, tuples, tensors, numpy arrays) so that it
+    is no longer affected by in-place updates of the live training state.
+    Tensors are cloned on their own device, which only enqueues a device copy.
+    """
+    if isinstance(node, torch.Tensor):
+        return node.detach().clone()
+    if isinstance(node, np.ndarray):
+        return node.copy()
+    if isinstance(node, dict):
+        return {k: clone_state(v) for k, v in node.items()}
+    if isinstance(node, tuple):
+        return tuple(clone_state(v) for v in node)
+    if isinstance(node, list):
+        return [clone_state(v) for v in node]
+    return node
+
+class SnapshotWriter:
+    """
+    Serializes snapshots on a background thread. Jobs are callables that only
+    touch copies of the training state; submit() blocks when max_queue_size jobs
+    are already pending, which bounds the memory held by queued copies.
+    """
+    def __init__(self, max_queue_size=2, tb_writer=None):
+        self.tb_writer = tb_writer
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, name, iteration, job):
+        self.queue.put((name, iteration, job))
+        depth = self.queue.qsize()
+        print("\n[ITER {}] Queued {} snapshot, queue depth {}".format(iteration, name, depth))
+        if self.tb_writer:
+            self.tb_writer.add_scalar('snapshot/queue_depth', depth, iteration)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            name, iteration, job = item
+            start = time.time()
+            try:
+                job()
+            except Exception as e:
+                print("\n[ITER {}] Writing {} snapshot failed: {}".format(iteration, name, e))
+                self.error = e
+            else:
+                elapsed = time.time() - start
+                print("\n[ITER {}] {} snapshot written in {:.2f}s".format(iteration, name.capitalize(), elapsed))
+                if self.tb_writer:
+                    self.tb_writer.add_scalar('snapshot/{}_seconds'.format(name), elapsed, iteration)
+            self.queue.task_done()
+
+    def close(self):
+        """ Wait for all pending snapshots to be written """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error